@@ -1,8 +1,12 @@
 import os
-import stripe
+import io
+import json
+import numpy as np
 import redis
-import secrets
-from flask import Flask, jsonify, request, render_template, redirect, url_for, session, abort
+from flask import (Flask, Response, jsonify, request, render_template, redirect, url_for,
+                   session, abort, stream_with_context, g)
+from redis.exceptions import RedisError
+from auth import api_keys
 from auth.middleware import Auth0Middleware
 
 # ---- API Blueprints ---------------------------------------------------------
@@ -11,9 +15,28 @@ from wasserstein_app.app import wasserstein_bp
 from heavy_tail_app.app import heavy_tail_bp
 from kolmogorov_app.api.optimize import kolmogorov_bp
 from billing.webhooks import webhook_bp
-
-from usage.rate_limiter import rate_limit
-from billing.stripe_utils import create_checkout_session, get_plan_details
+from billing import events as stripe_events
+from jobs.api import jobs_bp
+from datasets.api import datasets_bp
+from datasets import store as dataset_store
+from cache import results as result_cache
+from cache import lookups
+from formats import arrays as formats
+from metrics.api import metrics_bp
+from metrics import stages as request_stages
+from metrics.connections import RedisConnection
+from profiling.api import profiles_bp
+from profiling import profiler
+
+from engines import executor as compute
+from engines import cvar as cvar_engine
+from engines import wasserstein as wasserstein_engine
+from engines import heavy_tail as heavy_tail_engine
+from engines import kolmogorov as kolmogorov_engine
+
+from usage.rate_limiter import rate_limit, add_rate_limit_headers
+from billing.stripe_utils import create_checkout_session, get_plan_details, get_stripe
+from models.usage import get_usage_summary, get_usage_rollups, get_usage_logs_page
 from dotenv import load_dotenv
 
 # ✨ NEW – Swagger -------------------------------------------------------------
@@ -27,24 +50,49 @@ load_dotenv()
 # -----------------------------------------------------------------------------
 # Stripe / Redis config
 # -----------------------------------------------------------------------------
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+# Stripe is imported and keyed on first use (billing.stripe_utils.get_stripe)
+# from STRIPE_SECRET_KEY in the app config
 
 redis_host = os.getenv('REDIS_HOST', 'localhost')
 redis_port = int(os.getenv('REDIS_PORT', 6379))
 redis_db   = int(os.getenv('REDIS_DB', 0))
-r = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db, decode_responses=True)
+# Connections count their round trips for the request metrics
+r = redis.StrictRedis(connection_pool=redis.ConnectionPool(
+    host=redis_host, port=redis_port, db=redis_db, decode_responses=True,
+    connection_class=RedisConnection))
+# Same server without response decoding, for compressed / binary payloads
+r_bin = redis.StrictRedis(connection_pool=redis.ConnectionPool(
+    host=redis_host, port=redis_port, db=redis_db, connection_class=RedisConnection))
 
 # -----------------------------------------------------------------------------
 # Auth helper
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
-# RapidAPI-only auth check
+# RapidAPI proxy or per-client API key
 # -----------------------------------------------------------------------------
 def verify_api_key_or_abort():
+    # Job replays carry the key context resolved (and rate limited) when the
+    # job was submitted; only server code can set WSGI environ keys
+    context = request.environ.get(api_keys.ENVIRON_KEY)
+    if context is not None:
+        g.api_key = context
+        return None
     proxy_secret = request.headers.get('X-RapidAPI-Proxy-Secret')
-    if proxy_secret != os.getenv('RAPIDAPI_PROXY_SECRET'):
-        abort(401, "Request did not originate from RapidAPI")
-    # Remove the key-presence check entirely
+    if proxy_secret == os.getenv('RAPIDAPI_PROXY_SECRET'):
+        return None
+    # Direct callers send their own key; the client's id, plan and limit
+    # come back with it (usually from this worker's cache)
+    try:
+        context = api_keys.from_header(request.headers.get('Authorization'))
+    except RedisError:
+        abort(503, "API keys are temporarily unavailable")
+    if context is None:
+        abort(401, "Request did not originate from RapidAPI or carry a valid API key")
+    g.api_key = context
+    # RapidAPI enforces its own quotas; key holders get their plan's limit
+    if not rate_limit(context.client_id, max_requests_per_minute=context.requests_per_minute):
+        return jsonify({"message": "Rate limit exceeded"}), 429
+    return None
 
 # -----------------------------------------------------------------------------
 # Inject auth check into every Blueprint BEFORE registration
@@ -54,14 +102,23 @@ def verify_api_key_or_abort():
 @wasserstein_bp.before_request
 @heavy_tail_bp.before_request
 @kolmogorov_bp.before_request
+@jobs_bp.before_request
+@datasets_bp.before_request
 def _global_api_guard():
-    verify_api_key_or_abort()
+    with request_stages.stage("guard"):
+        return verify_api_key_or_abort()
 
 # -----------------------------------------------------------------------------
 # Blueprint‑level documented route example (CVaR)
 # -----------------------------------------------------------------------------
 
+def _cvar_is_deterministic(payload):
+    # Unseeded Monte Carlo runs must not be frozen by the result cache
+    return payload.get("method") != "monte_carlo" or payload.get("seed") is not None
+
 @cvar_bp.route("/estimate", methods=["POST"])
+@result_cache.cached("cvar/estimate", cacheable=_cvar_is_deterministic,
+                     array_field="returns")
 def estimate_cvar():
     """
     Estimate CVaR
@@ -81,24 +138,133 @@ def estimate_cvar():
               summary: Simple two‑asset portfolio
               value:
                 portfolio: [0.3, 0.7]
+                returns: [[0.01, -0.02], [-0.05, 0.03], [0.02, -0.08]]
                 confidence_level: 0.95
+            multi_level:
+              summary: Several confidence levels in one call
+              value:
+                portfolio: [0.3, 0.7]
+                method: parametric
+                mean: [0.001, 0.002]
+                cov: [[0.0004, 0.0001], [0.0001, 0.0009]]
+                confidence_level: [0.9, 0.95, 0.99]
     responses:
       200:
         description: Result
         content:
           application/json:
             example:
+              var: -0.0512
               cvar: -0.0731
+              confidence_level: 0.95
               method: historical
     """
-    # TODO: Call actual CVaR estimator in cvar_app
-    return jsonify({"cvar": -0.0731, "method": "historical"})
+    data = formats.read_payload("returns")
+    method = data.get("method", "historical")
+    levels = data.get("confidence_level", 0.95)
+    try:
+        var, cvar = compute.run(
+            "cvar",
+            cvar_engine.estimate,
+            data.get("portfolio", []),
+            returns=dataset_store.resolve(data, "returns", owner=api_keys.caller()),
+            confidence_level=levels,
+            method=method,
+            mean=data.get("mean"),
+            cov=data.get("cov"),
+            n_scenarios=data.get("n_scenarios", 10000),
+            dof=data.get("dof"),
+            seed=data.get("seed"),
+        )
+    except (TypeError, ValueError) as e:
+        # TypeError: wrongly typed fields, e.g. a string portfolio
+        abort(400, str(e))
+
+    if np.ndim(levels):
+        return formats.respond({"var": var, "cvar": cvar,
+                                "confidence_level": levels, "method": method})
+    return formats.respond({"var": float(var[0]), "cvar": float(cvar[0]),
+                            "confidence_level": levels, "method": method})
+
+@cvar_bp.route("/estimate/batch", methods=["POST"])
+@result_cache.cached("cvar/estimate/batch", cacheable=_cvar_is_deterministic,
+                     array_field="returns")
+def estimate_cvar_batch():
+    """
+    Estimate CVaR for many portfolios against one scenario matrix
+    ---
+    tags:
+      - CVaR
+    security:
+      - bearerAuth: []
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: object
+            properties:
+              portfolios:
+                type: array
+                description: (P x N) weight matrix, one row per portfolio
+                items:
+                  type: array
+                  items: number
+              returns:
+                type: array
+                description: shared (S x N) scenario return matrix
+                items:
+                  type: array
+                  items: number
+              confidence_level: {}
+              method: {type: string}
+            required: [portfolios]
+          example:
+            portfolios: [[0.3, 0.7], [0.5, 0.5], [0.9, 0.1]]
+            returns: [[0.01, -0.02], [-0.05, 0.03], [0.02, -0.08]]
+            confidence_level: 0.95
+    responses:
+      200:
+        description: Per-portfolio results, in request order
+        content:
+          application/json:
+            example:
+              var: [-0.0512, -0.0250, -0.0370]
+              cvar: [-0.0731, -0.0300, -0.0450]
+              confidence_level: 0.95
+              method: historical
+    """
+    data = formats.read_payload("returns")
+    method = data.get("method", "historical")
+    levels = data.get("confidence_level", 0.95)
+    try:
+        var, cvar = compute.run(
+            "cvar",
+            cvar_engine.estimate_batch,
+            data.get("portfolios", []),
+            returns=dataset_store.resolve(data, "returns", owner=api_keys.caller()),
+            confidence_level=levels,
+            method=method,
+            mean=data.get("mean"),
+            cov=data.get("cov"),
+            n_scenarios=data.get("n_scenarios", 10000),
+            dof=data.get("dof"),
+            seed=data.get("seed"),
+        )
+    except (TypeError, ValueError) as e:
+        abort(400, str(e))
+
+    if not np.ndim(levels):
+        var, cvar = var[:, 0], cvar[:, 0]
+    return formats.respond({"var": var, "cvar": cvar,
+                            "confidence_level": levels, "method": method})
 
 # -----------------------------------------------------------------------------
 # Wasserstein robust optimiser
 # -----------------------------------------------------------------------------
 
 @wasserstein_bp.route("/optimize", methods=["POST"])
+@result_cache.cached("wasserstein/optimize", array_field="assets")
 def optimize_wasserstein():
     """
     Wasserstein robust portfolio optimisation
@@ -115,13 +281,21 @@ def optimize_wasserstein():
             properties:
               assets:
                 type: array
-                items: number
+                description: (samples x assets) matrix of historical returns
+                items:
+                  type: array
+                  items: number
               risk_aversion:
                 type: number
+              wasserstein_radius:
+                type: number
+              confidence_level:
+                type: number
             required: [assets, risk_aversion]
           example:
-            assets: [0.4, 0.6]
+            assets: [[0.01, -0.02], [-0.03, 0.01], [0.02, 0.04]]
             risk_aversion: 0.5
+            wasserstein_radius: 0.1
     responses:
       200:
         description: Optimised weights
@@ -130,16 +304,118 @@ def optimize_wasserstein():
             example:
               weights: [0.38, 0.62]
               wasserstein_radius: 0.1
+              objective: 0.0412
+      422:
+        description: The solver found no optimal solution; "status" is its cvxpy status
     """
-    data = request.get_json(force=True)
-    # TODO: Replace with real call e.g., wasserstein_app.app.optimize_portfolio
-    weights = [round(x * 0.95, 2) for x in data.get("assets", [])]
-    return jsonify({"weights": weights, "wasserstein_radius": 0.1})
+    data = formats.read_payload("assets")
+    radius = data.get("wasserstein_radius", 0.1)
+    try:
+        weights, objective = wasserstein_engine.optimize(
+            dataset_store.resolve(data, "assets", [], owner=api_keys.caller()),
+            radius=radius,
+            risk_aversion=data.get("risk_aversion", 0.5),
+            confidence_level=data.get("confidence_level", 0.95),
+            client_id=api_keys.caller(),
+            run=compute.pool("wasserstein").run,
+        )
+    except (TypeError, ValueError) as e:
+        abort(400, str(e))
+    return formats.respond({"weights": weights.round(6),
+                            "wasserstein_radius": float(radius),
+                            "objective": objective})
+
+@wasserstein_bp.route("/frontier", methods=["POST"])
+def wasserstein_frontier():
+    """
+    Wasserstein radius / risk-aversion frontier
+    ---
+    tags: [Wasserstein]
+    security:
+      - bearerAuth: []
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: object
+            properties:
+              assets:
+                type: array
+                description: (samples x assets) matrix of historical returns
+                items:
+                  type: array
+                  items: number
+              radii:
+                type: array
+                items: number
+              risk_aversion:
+                type: array
+                items: number
+              confidence_level:
+                type: number
+            required: [assets, radii, risk_aversion]
+          example:
+            assets: [[0.01, -0.02], [-0.03, 0.01], [0.02, 0.04]]
+            radii: [0.0, 0.05, 0.1]
+            risk_aversion: [0.5, 1.0]
+    responses:
+      200:
+        description: One NDJSON line per frontier point, streamed as each is solved
+        content:
+          application/x-ndjson:
+            example:
+              wasserstein_radius: 0.05
+              risk_aversion: 0.5
+              weights: [0.38, 0.62]
+              objective: 0.0412
+              expected_return: 0.0011
+              cvar: -0.0291
+    """
+    data = formats.read_payload("assets")
+    # A single value stands for a one-element list
+    risk_aversions = data.get("risk_aversion", [0.5])
+    if not np.ndim(risk_aversions):
+        risk_aversions = [risk_aversions]
+    radii = data.get("radii", [])
+    if not np.ndim(radii):
+        radii = [radii]
+    try:
+        points = wasserstein_engine.frontier(
+            dataset_store.resolve(data, "assets", [], owner=api_keys.caller()),
+            radii,
+            risk_aversions,
+            confidence_level=data.get("confidence_level", 0.95),
+            pool=compute.pool("wasserstein").profiled(),
+        )
+        # Solve the first point eagerly so input and capacity errors still
+        # produce a proper status code instead of a truncated stream
+        first = next(points)
+    except (TypeError, ValueError) as e:
+        abort(400, str(e))
+
+    def generate():
+        yield json.dumps(first) + "\n"
+        try:
+            for point in points:
+                yield json.dumps(point) + "\n"
+        except wasserstein_engine.SolverFailed as e:
+            yield json.dumps({"error": str(e), "status": e.status}) + "\n"
+        except (compute.ComputeBusy, compute.ComputeTimeout, RuntimeError) as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 # -----------------------------------------------------------------------------
 # Heavy-tail volatility simulator
 # -----------------------------------------------------------------------------
 
+HEAVY_TAIL_PARAMS = ("dof", "alpha", "beta", "base_volatility", "jump_intensity")
+MAX_JSON_SIMULATION_VALUES = int(os.getenv("MAX_JSON_SIMULATION_VALUES", 1_000_000))
+MAX_STREAM_SIMULATION_VALUES = int(os.getenv("MAX_STREAM_SIMULATION_VALUES", 300_000_000))
+STREAM_BLOCK_PATHS = int(os.getenv("HEAVY_TAIL_STREAM_BLOCK_PATHS", 256))
+HEAVY_TAIL_STREAM_FORMATS = ("application/x-ndjson", "application/octet-stream")
+
 @heavy_tail_bp.route("/simulate", methods=["POST"])
 def simulate_heavy_tail():
     """
@@ -157,30 +433,132 @@ def simulate_heavy_tail():
             properties:
               shock_magnitude: {type: number}
               periods: {type: integer}
+              n_paths: {type: integer}
+              seed: {type: integer}
+              dof: {type: number}
+              alpha: {type: number}
+              beta: {type: number}
+              base_volatility: {type: number}
+              jump_intensity: {type: number}
             required: [shock_magnitude, periods]
           example:
             shock_magnitude: 3.0
             periods: 100
+            seed: 42
     responses:
       200:
-        description: Simulated return series
+        description: Simulated return series (or one per path when n_paths > 1)
         content:
           application/json:
             example:
               series: [0.021, -0.033, 0.017]
+          application/x-ndjson:
+            example:
+              path: 0
+              series: [0.021, -0.033, 0.017]
+          application/octet-stream:
+            schema:
+              type: string
+              format: binary
+          application/x-npy:
+            schema:
+              type: string
+              format: binary
     """
-    data = request.get_json(force=True)
-    shock = float(data.get("shock_magnitude", 1))
-    periods = int(data.get("periods", 10))
-    # Dummy simulation
-    series = [round(((i % 2) * -2 + 1) * shock * 0.01, 3) for i in range(periods)]
-    return jsonify({"series": series})
+    data = formats.read_payload()
+    try:
+        n_paths = int(data.get("n_paths", 1))
+        periods = int(data.get("periods", 10))
+        params = {k: float(data[k]) for k in HEAVY_TAIL_PARAMS if k in data}
+        shock = float(data.get("shock_magnitude", 1))
+    except (TypeError, ValueError) as e:
+        # e.g. "n_paths": "abc" or "dof": [5]
+        abort(400, f"invalid simulation parameter: {e}")
+
+    response_format = request.accept_mimetypes.best_match(
+        formats.FORMATS + HEAVY_TAIL_STREAM_FORMATS, default=formats.JSON)
+    if response_format in HEAVY_TAIL_STREAM_FORMATS or response_format == formats.NPY:
+        return _stream_heavy_tail(response_format, n_paths, periods, shock,
+                                  data.get("seed"), params)
+
+    if n_paths * periods > MAX_JSON_SIMULATION_VALUES:
+        abort(400, f"at most {MAX_JSON_SIMULATION_VALUES} simulated values per "
+                   "request; use Accept: application/x-ndjson to stream larger runs")
+    try:
+        paths = compute.run("heavy_tail", heavy_tail_engine.simulate, n_paths, periods,
+                            shock_magnitude=shock, seed=data.get("seed"), **params)
+    except (TypeError, ValueError) as e:
+        # TypeError: a seed numpy cannot use, e.g. "seed": "abc"
+        abort(400, str(e))
+
+    paths = paths.round(6)
+    if n_paths == 1:
+        return formats.respond({"series": paths[0]})
+    return formats.respond({"paths": paths})
+
+
+def _stream_heavy_tail(mimetype, n_paths, periods, shock, seed, params):
+    """
+    Stream a simulation block by block so only STREAM_BLOCK_PATHS paths are
+    ever held in memory. NDJSON sends one {"path", "series"} object per line;
+    application/octet-stream sends the (n_paths x periods) matrix as raw
+    little-endian float32, row-major, with the shape in X-Array-Shape, and
+    application/x-npy sends the same bytes behind a .npy header.
+
+    The simulation runs in this thread as the body is sent, not on the
+    pool, but holds one of the heavy_tail family's pending slots until the
+    response closes (ComputeBusy, i.e. 503, when none is free) and uses
+    no more threads than the family has workers.
+    """
+    if n_paths * periods > MAX_STREAM_SIMULATION_VALUES:
+        abort(400, f"at most {MAX_STREAM_SIMULATION_VALUES} simulated values per request")
+    raw = mimetype in ("application/octet-stream", formats.NPY)
+    family = compute.pool("heavy_tail")
+    try:
+        blocks = heavy_tail_engine.simulate_blocks(
+            n_paths, periods, shock_magnitude=shock,
+            rng=np.random.default_rng(seed), block_paths=STREAM_BLOCK_PATHS,
+            dtype=np.dtype("<f4") if raw else np.float64,
+            threads=max(1, family.workers), **params)
+    except (TypeError, ValueError) as e:
+        # TypeError: a seed numpy cannot use, e.g. "seed": "abc"
+        abort(400, str(e))
+    family.acquire()
+
+    def generate_raw():
+        if mimetype == formats.NPY:
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(
+                header, {"descr": "<f4", "fortran_order": False, "shape": (n_paths, periods)})
+            yield header.getvalue()
+        for block in blocks:
+            yield block.tobytes()
+
+    def generate_ndjson():
+        path = 0
+        for block in blocks:
+            lines = []
+            for row in block.round(6).tolist():
+                lines.append(json.dumps({"path": path, "series": row}))
+                path += 1
+            yield "\n".join(lines) + "\n"
+
+    if raw:
+        response = Response(stream_with_context(generate_raw()), mimetype=mimetype,
+                            headers={"X-Array-Shape": f"{n_paths},{periods}",
+                                     "X-Array-Dtype": "<f4"})
+    else:
+        response = Response(stream_with_context(generate_ndjson()),
+                            mimetype="application/x-ndjson")
+    response.call_on_close(family.release)
+    return response
 
 # -----------------------------------------------------------------------------
 # Kolmogorov complexity explorer
 # -----------------------------------------------------------------------------
 
 @kolmogorov_bp.route("/explore", methods=["POST"])
+@result_cache.cached("kolmogorov/explore", array_field="data")
 def explore_kolmogorov():
     """
     Kolmogorov complexity explorer
@@ -198,9 +576,17 @@ def explore_kolmogorov():
               data:
                 type: array
                 items: number
+              n_symbols: {type: integer}
+              block_length: {type: integer}
+              window:
+                type: integer
+                description: Rolling window length; enables rolling mode
+              step: {type: integer}
             required: [data]
           example:
-            data: [1.2, 0.8, 1.5, 0.6]
+            data: [1.2, 0.8, 1.5, 0.6, 1.1, 0.9, 1.4, 0.7]
+            n_symbols: 4
+            block_length: 2
     responses:
       200:
         description: Complexity metrics
@@ -208,16 +594,26 @@ def explore_kolmogorov():
           application/json:
             example:
               complexity_score: 0.72
+              n_symbols: 4
+              compression: {zlib: 1.25, lzma: 1.17, bz2: 1.06}
+              lempel_ziv: {phrases: 6, normalised: 0.72}
+              block_entropy: {block_length: 2, entropy_bits: 2.8, entropy_rate: 0.7}
     """
-    data = request.get_json(force=True)
-    nums = data.get("data", [])
-    # Dummy complexity score: normalised variance
-    if not nums:
-        return jsonify({"complexity_score": 0})
-    mean = sum(nums) / len(nums)
-    var = sum((x - mean) ** 2 for x in nums) / len(nums)
-    complexity = round(min(var / 10, 1), 2)
-    return jsonify({"complexity_score": complexity})
+    data = formats.read_payload("data")
+    nums = dataset_store.resolve(data, "data", [], owner=api_keys.caller())
+    n_symbols = data.get("n_symbols", 8)
+    block_length = data.get("block_length", 3)
+    try:
+        if "window" in data:
+            result = compute.run("kolmogorov", kolmogorov_engine.explore_rolling,
+                                 nums, data["window"], data.get("step"),
+                                 n_symbols, block_length)
+        else:
+            result = compute.run("kolmogorov", kolmogorov_engine.explore,
+                                 nums, n_symbols, block_length)
+    except ValueError as e:
+        abort(400, str(e))
+    return formats.respond(result)
 
 # -----------------------------------------------------------------------------
 # Factory pattern
@@ -231,7 +627,24 @@ def create_master_app():
     app.register_blueprint(wasserstein_bp,  url_prefix="/wasserstein")
     app.register_blueprint(heavy_tail_bp,   url_prefix="/heavy-tail")
     app.register_blueprint(kolmogorov_bp,   url_prefix="/kolmogorov")
+    app.register_blueprint(jobs_bp,         url_prefix="/jobs")
+    app.register_blueprint(datasets_bp,     url_prefix="/datasets")
     app.register_blueprint(webhook_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(profiles_bp)
+
+    app.extensions["redis"] = r
+    app.extensions["redis_binary"] = r_bin
+    # Plan / client lookup caches invalidate each other over Redis pub/sub
+    lookups.bind(r)
+    api_keys.bind(r)
+    # Apply Stripe webhook events queued before a restart
+    app.before_request(stripe_events.ensure_worker)
+    app.after_request(add_rate_limit_headers)
+    # Per-stage latency histograms (/metrics) and Server-Timing headers
+    request_stages.init_app(app)
+    # On-demand profiles of single requests (X-Profile; off without PROFILE_TOKEN)
+    profiler.init_app(app)
 
     # Core settings
     app.config.update(
@@ -242,6 +655,24 @@ def create_master_app():
         STRIPE_WEBHOOK_SECRET= os.getenv('STRIPE_WEBHOOK_SECRET')
     )
 
+    # Compute pool back-pressure
+    @app.errorhandler(compute.ComputeBusy)
+    def compute_busy_error(error):
+        return jsonify({"message": str(error)}), 503, {"Retry-After": "1"}
+
+    @app.errorhandler(compute.ComputeTimeout)
+    def compute_timeout_error(error):
+        return jsonify({"message": str(error)}), 504
+
+    # Infeasible, unbounded or numerically failed solves
+    @app.errorhandler(wasserstein_engine.SolverFailed)
+    def solver_failed_error(error):
+        return jsonify({"message": str(error), "status": error.status}), 422
+
+    @app.errorhandler(dataset_store.DatasetNotFound)
+    def dataset_not_found_error(error):
+        return jsonify({"message": str(error)}), 404
+
     # Custom error pages
     @app.errorhandler(404)
     def not_found_error(error):
@@ -285,20 +716,22 @@ swagger = Swagger(app, template=swagger_template, merge=True)
 # -----------------------------------------------------------------------------
 # Helper functions (API secrets, usage, etc.)
 # -----------------------------------------------------------------------------
+# Keys are stored hashed (auth.api_keys): a secret is shown in full only when
+# it is generated; afterwards only its last characters are known
 def generate_api_secret(user_id):
-    secret = secrets.token_urlsafe(32)
-    r.set(f"user:{user_id}:api_secret", secret)
-    return secret
+    return api_keys.issue(user_id)
 
 def get_api_secret(user_id):
-    return r.get(f"user:{user_id}:api_secret")
+    hint = api_keys.hint(user_id)
+    return f"…{hint}" if hint else None
 
 def regenerate_api_secret(user_id):
-    return generate_api_secret(user_id)
+    # Replaces the old key's index entry and evicts it from every worker
+    return api_keys.issue(user_id)
 
 def validate_api_secret(user_id, provided):
-    stored = get_api_secret(user_id)
-    return secrets.compare_digest(stored or '', provided)
+    context = api_keys.resolve(provided)
+    return context is not None and context.client_id == str(user_id)
 
 # -----------------------------------------------------------------------------
 # Auth routes & billing / usage
@@ -346,10 +779,42 @@ def auth_callback_passthrough():
 @auth0.token_required
 def usage(decoded_token):
     client_id = decoded_token['client_id']
-    usage_data = get_usage(client_id)          # TODO: implement
+    usage_data = get_usage_summary(client_id)
     secret = get_api_secret(client_id) or generate_api_secret(client_id)
     return render_template('usage.ejs', usage=usage_data, api_secret=secret)
 
+@app.route('/usage/rollups')
+@auth0.token_required
+def usage_rollups(decoded_token):
+    client_id = decoded_token['client_id']
+    try:
+        rollups = get_usage_rollups(client_id,
+                                    granularity=request.args.get('granularity', 'day'),
+                                    start=request.args.get('start'),
+                                    end=request.args.get('end'))
+    except ValueError as e:
+        abort(400, str(e))
+    for row in rollups:
+        row['bucket_start'] = row['bucket_start'].isoformat()
+        row['cost'] = float(row['cost'])
+    return jsonify(rollups=rollups)
+
+@app.route('/usage/logs')
+@auth0.token_required
+def usage_logs(decoded_token):
+    # Keyset-paginated raw log export: pass back ``next`` as ?after=
+    client_id = decoded_token['client_id']
+    try:
+        logs, next_cursor = get_usage_logs_page(client_id,
+                                                after=request.args.get('after'),
+                                                limit=request.args.get('limit'))
+    except ValueError as e:
+        abort(400, str(e))
+    for row in logs:
+        row['timestamp'] = row['timestamp'].isoformat()
+        row['usage_cost'] = float(row['usage_cost'] or 0)
+    return jsonify(logs=logs, next=next_cursor)
+
 @app.route('/checkout', methods=['POST'])
 @auth0.token_required
 def checkout(decoded_token):
@@ -370,12 +835,13 @@ def some_api_route(decoded_token):
 def stripe_webhook():
     payload    = request.get_data(as_text=True)
     sig_header = request.headers.get('Stripe-Signature')
+    stripe     = get_stripe()
     try:
         event = stripe.Webhook.construct_event(payload, sig_header, os.getenv('STRIPE_WEBHOOK_SECRET'))
     except (ValueError, stripe.error.SignatureVerificationError):
         return 'Webhook error', 400
-    if event['type'] == 'checkout.session.completed':
-        handle_checkout_session(event['data']['object'])   # you must define this util
+    # Verified: record for the billing.events worker and acknowledge
+    stripe_events.accept_event(event['id'], event['type'], payload)
     return '', 200
 
 @app.route('/')
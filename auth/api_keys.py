@@ -0,0 +1,232 @@
+"""
+Per-client API keys ("Authorization: Bearer <secret>"). Only the SHA-256 of
+a key is kept: ``api_key:<digest>`` holds the owning client's id, plan and
+requests-per-minute limit, so a presented key resolves to everything a
+request needs in one lookup, without knowing the client first.
+``client:<id>:api_key`` points back at the current digest, plus the last
+characters of the key for display, so a key can be replaced or revoked.
+
+Resolved keys are cached in each worker (a LookupCache, API_KEY_CACHE_TTL
+seconds); issuing a new key or revoking one invalidates the old digest in
+every worker over pub/sub.
+
+    python -m auth.api_keys --migrate   # index plaintext user:<id>:api_secret keys
+"""
+import argparse
+import hashlib
+import os
+import secrets
+from collections import namedtuple
+
+from cache import lookups
+
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", 30))
+# Characters of the key kept in clear for "your key ends in ..." displays
+HINT_LENGTH = 4
+
+KeyContext = namedtuple("KeyContext", ["client_id", "plan_id", "requests_per_minute"])
+# WSGI environ key carrying a KeyContext into replayed (job) requests
+ENVIRON_KEY = "seas.api_key"
+
+key_cache = lookups.LookupCache("api_keys", ttl=API_KEY_CACHE_TTL)
+_store = None
+
+
+def bind(store):
+    """
+    Keep keys in ``store`` (a decode_responses Redis client).
+    """
+    global _store
+    _store = store
+
+
+def digest(secret):
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def _index_key(key_digest):
+    return f"api_key:{key_digest}"
+
+
+def _client_key(client_id):
+    return f"client:{client_id}:api_key"
+
+
+def _legacy_key(client_id):
+    return f"user:{client_id}:api_secret"
+
+
+def _context(client_id):
+    # Plan and limit as of now; refresh_client() rewrites them on plan changes
+    from models.client import get_client_by_id
+    from usage.rate_limiter import plan_limit
+
+    client = get_client_by_id(client_id) or {}
+    plan_id = client.get("plan_id")
+    return {"client_id": str(client_id),
+            "plan_id": "" if plan_id is None else str(plan_id),
+            "requests_per_minute": str(plan_limit(plan_id))}
+
+
+def _install(client_id, secret):
+    new = digest(secret)
+    context = _context(client_id)
+    client_key = _client_key(client_id)
+
+    def replace(pipe):
+        old = pipe.hget(client_key, "digest")
+        pipe.multi()
+        if old:
+            pipe.delete(_index_key(old))
+        pipe.hset(_index_key(new), mapping=context)
+        pipe.hset(client_key, mapping={"digest": new, "hint": secret[-HINT_LENGTH:]})
+        pipe.delete(_legacy_key(client_id))
+        return old
+
+    old = _store.transaction(replace, client_key, value_from_callable=True)
+    if old and old != new:
+        lookups.invalidate("api_keys", old)
+
+
+def issue(client_id):
+    """
+    Create a new key for ``client_id``, replacing (and invalidating) any
+    previous one, and return it. This is the only time the key is seen in
+    clear.
+    """
+    secret = secrets.token_urlsafe(32)
+    _install(client_id, secret)
+    return secret
+
+
+def revoke(client_id):
+    """
+    Delete ``client_id``'s key. Does nothing without a bound store.
+    """
+    if _store is None:
+        return
+    client_key = _client_key(client_id)
+
+    def remove(pipe):
+        old = pipe.hget(client_key, "digest")
+        pipe.multi()
+        if old:
+            pipe.delete(_index_key(old))
+        pipe.delete(client_key, _legacy_key(client_id))
+        return old
+
+    old = _store.transaction(remove, client_key, value_from_callable=True)
+    if old:
+        lookups.invalidate("api_keys", old)
+
+
+def refresh_client(client_id):
+    """
+    Rewrite the plan and limit stored with ``client_id``'s key after the
+    client changed plan. Does nothing without a bound store or a key.
+    """
+    if _store is None:
+        return
+    context = _context(client_id)
+    client_key = _client_key(client_id)
+
+    def rewrite(pipe):
+        # Watching the pointer means a concurrent issue() or revoke() aborts
+        # this write instead of resurrecting the key it just replaced
+        current = pipe.hget(client_key, "digest")
+        pipe.multi()
+        if current:
+            pipe.hset(_index_key(current), mapping=context)
+        return current
+
+    current = _store.transaction(rewrite, client_key, value_from_callable=True)
+    if current:
+        lookups.invalidate("api_keys", current)
+
+
+def hint(client_id):
+    """
+    The last characters of ``client_id``'s key, or None if it has none.
+    """
+    return _store.hget(_client_key(client_id), "hint")
+
+
+def _load(key_digest):
+    fields = _store.hgetall(_index_key(key_digest))
+    if not fields:
+        return None
+    plan_id = fields.get("plan_id")
+    return KeyContext(fields["client_id"], int(plan_id) if plan_id else None,
+                      int(fields["requests_per_minute"]))
+
+
+def resolve(secret):
+    """
+    The KeyContext of the client owning ``secret``, or None for an unknown
+    key. Served from this worker's cache after the first request.
+    """
+    if not secret:
+        return None
+    key_digest = digest(secret)
+    return key_cache.get(key_digest, lambda: _load(key_digest))
+
+
+def from_header(value):
+    """
+    Resolve an ``Authorization: Bearer <secret>`` header value.
+    """
+    if not value:
+        return None
+    scheme, _, secret = value.partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return resolve(secret.strip())
+
+
+def caller():
+    """
+    Who is making the current request: ``client:<id>`` for an API key,
+    ``rapidapi:<user>`` for RapidAPI traffic, None if neither is known.
+    """
+    from flask import g, request
+
+    context = g.get("api_key")
+    if context is not None:
+        return f"client:{context.client_id}"
+    user = request.headers.get("X-RapidAPI-User")
+    return f"rapidapi:{user}" if user else None
+
+
+def migrate_legacy(store):
+    """
+    Index every plaintext ``user:<id>:api_secret`` under its digest (so the
+    key keeps working) and delete the plaintext. Returns the number moved.
+    """
+    bind(store)
+    moved = 0
+    for key in store.scan_iter(match=_legacy_key("*"), count=1000):
+        secret = store.get(key)
+        if secret:
+            _install(key[len("user:"):-len(":api_secret")], secret)
+            moved += 1
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--migrate", action="store_true",
+                        help="index plaintext user:<id>:api_secret keys and delete them")
+    args = parser.parse_args(argv)
+    if not args.migrate:
+        parser.print_help()
+        return
+    import redis
+
+    store = redis.StrictRedis(host=os.getenv("REDIS_HOST", "localhost"),
+                              port=int(os.getenv("REDIS_PORT", 6379)),
+                              db=int(os.getenv("REDIS_DB", 0)), decode_responses=True)
+    print(f"migrated {migrate_legacy(store)} API keys")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+
+import jwt
+import requests
+
+
+class JWKSCache:
+    """
+    Parsed JWKS public keys keyed by ``kid``.
+
+    Keys are fetched from ``url`` (or read from a local ``path``, which makes
+    verification testable offline) and reused for ``ttl`` seconds. After that
+    they are served stale while a background thread refreshes them. An
+    unknown ``kid`` (or an empty cache) triggers a synchronous refresh to
+    pick up key rotation: one caller fetches while concurrent ones wait for
+    its result, and fetches are at least ``min_refresh_interval`` seconds
+    apart whether or not the last one succeeded, so a flood of tokens with
+    made-up kids cannot hammer the identity provider.
+    """
+
+    def __init__(self, url=None, path=None, ttl=3600, min_refresh_interval=30,
+                 timeout=5):
+        if not url and not path:
+            raise ValueError("JWKSCache needs a url or a path")
+        self.url = url
+        self.path = path
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._attempted_at = float("-inf")
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    def _load(self):
+        if self.path:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh(self):
+        """
+        Fetch the key set and swap it in. Keys that fail to parse (e.g. an
+        unsupported algorithm) are skipped rather than failing the whole set.
+        """
+        with self._lock:
+            self._attempted_at = time.monotonic()
+        keys = {}
+        for jwk in self._load().get("keys", []):
+            try:
+                parsed = jwt.PyJWK(jwk)
+            except (jwt.PyJWKError, jwt.InvalidKeyError):
+                continue
+            keys[jwk.get("kid")] = parsed
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return keys
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the stale keys; the next lookup retries
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="jwks-refresh", daemon=True).start()
+
+    def _refresh_now(self, seen_at):
+        """
+        Refresh in the calling thread unless another thread has fetched since
+        ``seen_at`` or the last attempt was too recent; returns the keys.
+        """
+        with self._refresh_lock:
+            with self._lock:
+                keys = self._keys
+                if (self._fetched_at > seen_at or
+                        time.monotonic() - self._attempted_at < self.min_refresh_interval):
+                    return keys
+            return self.refresh()
+
+    def get_key(self, kid):
+        """
+        Return the PyJWK for ``kid``, refreshing as described above.
+        """
+        with self._lock:
+            keys, fetched_at = self._keys, self._fetched_at
+
+        if not keys:
+            keys = self._refresh_now(fetched_at)
+        elif time.monotonic() - fetched_at > self.ttl:
+            self._refresh_in_background()
+
+        key = keys.get(kid)
+        if key is None:
+            key = self._refresh_now(fetched_at).get(kid)
+        if key is None:
+            raise ValueError(f"Unknown signing key: {kid}")
+        return key
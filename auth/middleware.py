@@ -1,56 +1,125 @@
-import json
-import requests
+import hashlib
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
 from flask import request
 from functools import wraps
 
+from auth.jwks import JWKSCache
+from metrics.stages import stage
+
 class Auth0Middleware:
-    def __init__(self, domain, client_id, client_secret):
+    def __init__(self, domain, client_id, client_secret, audience=None,
+                 jwks_file=None, jwks_ttl=3600, token_cache_size=4096,
+                 algorithms=("RS256",)):
         self.domain = domain
         self.client_id = client_id
         self.client_secret = client_secret
+        self.audience = audience or os.getenv("AUTH0_AUDIENCE") or client_id
+        self.issuer = f"https://{domain}/"
+        self.algorithms = list(algorithms)
+        # A local JWKS file (AUTH0_JWKS_FILE) replaces the network fetch
+        self.jwks = JWKSCache(url=f"https://{domain}/.well-known/jwks.json",
+                              path=jwks_file or os.getenv("AUTH0_JWKS_FILE"),
+                              ttl=jwks_ttl)
+
+        # Verified token digest -> (expiry, claims), bounded by size and exp
+        self.token_cache_size = token_cache_size
+        self._verified = OrderedDict()
+        self._verified_lock = threading.Lock()
+
+    def _cached_claims(self, digest):
+        with self._verified_lock:
+            entry = self._verified.get(digest)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._verified[digest]
+                return None
+            self._verified.move_to_end(digest)
+            return entry[1]
+
+    def _remember(self, digest, claims):
+        exp = claims.get("exp")
+        if exp is None:
+            return
+        with self._verified_lock:
+            self._verified[digest] = (float(exp), claims)
+            self._verified.move_to_end(digest)
+            while len(self._verified) > self.token_cache_size:
+                self._verified.popitem(last=False)
+
+    def decode(self, token):
+        """
+        Verify a JWT's signature, expiry, audience and issuer against the
+        cached JWKS and return its claims.
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+            key = self.jwks.get_key(header.get("kid"))
+            return jwt.decode(
+                token,
+                key.key,
+                algorithms=self.algorithms,
+                audience=self.audience,
+                issuer=self.issuer,
+                options={"require": ["exp"], "verify_aud": self.audience is not None},
+            )
+        except jwt.InvalidTokenError as e:
+            raise ValueError(f"Invalid token: {e}")
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Error validating token: {e}")
 
     def verify_token(self, req):
         """
-        Verify the Auth0 token passed in the Authorization header
+        Verify the Auth0 token passed in the Authorization header and return
+        its claims. Tokens already verified are answered from memory until
+        they expire.
         """
         auth = req.headers.get("Authorization", None)
-        
+
         if not auth:
             raise ValueError("Authorization token is missing")
-        
+
         parts = auth.split()
 
         if len(parts) != 2:
             raise ValueError("Authorization token format is incorrect")
-        
+
         token = parts[1]
 
-        # Check token with Auth0 Public Key endpoint
-        public_key_url = f"https://{self.domain}/.well-known/jwks.json"
-        try:
-            response = requests.get(public_key_url)
-            jwks = response.json()
-            # Look for the correct key to validate
-            for key in jwks['keys']:
-                # Extract the key based on 'kid' to verify JWT
-                pass  # You should decode and verify the JWT here
-        except Exception as e:
-            raise ValueError(f"Error validating token: {e}")
+        digest = hashlib.sha256(token.encode()).digest()
+        claims = self._cached_claims(digest)
+        if claims is None:
+            claims = self.decode(token)
+            self._remember(digest, claims)
 
-        return True
+        return claims
 
     def token_required(self, f):
         """
         Decorator to ensure that a valid token is present and verified in the request header.
+        Views with a ``decoded_token`` parameter receive the token's claims.
         """
+        wants_claims = "decoded_token" in inspect.signature(f).parameters
+
         @wraps(f)
         def decorated_function(*args, **kwargs):
             try:
                 # Attempt to verify the token in the request
-                self.verify_token(request)
+                with stage("auth"):
+                    claims = self.verify_token(request)
             except ValueError as e:
                 return {"message": f"Unauthorized: {str(e)}"}, 401
 
+            if wants_claims:
+                kwargs["decoded_token"] = claims
             return f(*args, **kwargs)
 
         return decorated_function
@@ -0,0 +1,86 @@
+"""
+Benchmarks for the API hot paths, run against local stand-ins (fakeredis or
+a local redis-server, SQLite or a throwaway MySQL, and a JWKS file).
+
+    python -m benchmarks                                # everything
+    python -m benchmarks -k rate_limit -k plans         # name substrings
+    python -m benchmarks --out bench.json               # save results
+    python -m benchmarks --baseline benchmarks/baseline.json
+    python -m benchmarks --compare bench.json --baseline benchmarks/baseline.json
+    python -m benchmarks --redis-url redis://localhost:6379/15 --database mysql
+
+Results are JSON with percentiles per benchmark (microseconds per call).
+With --baseline the run is compared on --metric and the exit status is 1 if
+any benchmark got more than --threshold slower.
+"""
+import argparse
+import sys
+
+from benchmarks import harness
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="API hot path benchmarks")
+    parser.add_argument("-k", dest="patterns", action="append", default=[],
+                        help="only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--list", action="store_true", help="list benchmarks and exit")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--compare", metavar="RESULTS",
+                        help="compare an existing results file instead of running")
+    parser.add_argument("--metric", default="p50",
+                        choices=[f"p{p}" for p in harness.PERCENTILES] + ["mean", "min"])
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown counted as a regression (fraction, default 0.10)")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="seconds to time each benchmark for (default 1)")
+    parser.add_argument("--min-iterations", type=int, default=20)
+    parser.add_argument("--max-iterations", type=int, default=10000)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--redis-url", help="use this Redis instead of fakeredis")
+    parser.add_argument("--database", choices=("sqlite", "mysql"), default="sqlite",
+                        help="mysql uses the DB_* settings; point them at a scratch database")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        if not args.baseline:
+            parser.error("--compare needs --baseline")
+        results = harness.load(args.compare)
+    else:
+        # Registering the suites imports nothing from the app yet
+        from benchmarks import micro, routes  # noqa: F401
+
+        selected = [b for b in harness.registry
+                    if not args.patterns or any(p in b.name for p in args.patterns)]
+        if args.list:
+            for b in selected:
+                print(f"{b.group:<12} {b.name}")
+            return 0
+
+        from benchmarks.standins import StandIns
+
+        standins = StandIns(redis_url=args.redis_url, database=args.database)
+        try:
+            results = harness.run(standins, selected, warmup=args.warmup,
+                                  min_iterations=args.min_iterations,
+                                  max_iterations=args.max_iterations,
+                                  min_time=args.min_time)
+        finally:
+            standins.close()
+        print(harness.format_results(results))
+        if args.out:
+            harness.save(args.out, results)
+
+    if args.baseline:
+        baseline = harness.load(args.baseline)
+        rows = harness.compare(results, baseline, args.metric, args.threshold)
+        print()
+        print(harness.format_comparison(rows, results, baseline, args.metric))
+        if any(r["status"] == "regression" for r in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
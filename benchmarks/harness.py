@@ -0,0 +1,189 @@
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+PERCENTILES = (50, 90, 95, 99)
+
+Benchmark = namedtuple("Benchmark", ["name", "group", "setup"])
+
+# Registered benchmarks in definition order
+registry = []
+
+
+class Skip(Exception):
+    """Raised by a benchmark's setup when its stand-in is not available."""
+
+
+def benchmark(name, group):
+    """
+    Register a setup function. It receives the StandIns and returns the
+    zero-argument callable to time, so setup cost is not measured.
+    """
+    def decorator(setup):
+        registry.append(Benchmark(name, group, setup))
+        return setup
+    return decorator
+
+
+def measure(fn, warmup=5, min_iterations=20, max_iterations=10000, min_time=1.0):
+    """
+    Call ``fn`` ``warmup`` times untimed, then time it until both
+    ``min_iterations`` calls and ``min_time`` seconds have passed (or
+    ``max_iterations`` calls). Returns per-call durations in seconds.
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_iterations:
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append((time.perf_counter_ns() - t0) / 1e9)
+        if len(samples) >= min_iterations and time.perf_counter() - started >= min_time:
+            break
+    return samples
+
+
+def summarise(samples):
+    """
+    Summary statistics in microseconds: mean, stdev, min, max and the
+    PERCENTILES, plus throughput for one caller.
+    """
+    us = sorted(s * 1e6 for s in samples)
+    # Inclusive method: p0 is the minimum, p100 the maximum
+    cuts = statistics.quantiles(us, n=100, method="inclusive") if len(us) > 1 else us * 99
+    summary = {
+        "unit": "us",
+        "n": len(us),
+        "mean": statistics.fmean(us),
+        "stdev": statistics.stdev(us) if len(us) > 1 else 0.0,
+        "min": us[0],
+        "max": us[-1],
+    }
+    for p in PERCENTILES:
+        summary[f"p{p}"] = cuts[p - 1]
+    summary["ops_per_sec"] = 1e6 / summary["mean"] if summary["mean"] else math.inf
+    return summary
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment(**extra):
+    """
+    Metadata stored with a run so comparisons across machines or stand-ins
+    can be spotted.
+    """
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        **extra,
+    }
+
+
+def save(path, results):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(current, baseline, metric="p50", threshold=0.10):
+    """
+    Compare two result files benchmark by benchmark on ``metric``. A
+    benchmark regresses when it is more than ``threshold`` (a fraction)
+    slower than the baseline, and improves when it is that much faster.
+    Returns one dict per benchmark present in either file.
+    """
+    rows = []
+    names = list(current["benchmarks"]) + [n for n in baseline["benchmarks"]
+                                           if n not in current["benchmarks"]]
+    for name in names:
+        new = current["benchmarks"].get(name)
+        old = baseline["benchmarks"].get(name)
+        row = {"name": name, "baseline": old and old[metric], "current": new and new[metric]}
+        if new is None or old is None:
+            row["status"] = "missing" if new is None else "new"
+        else:
+            row["ratio"] = new[metric] / old[metric] if old[metric] else math.inf
+            if row["ratio"] > 1 + threshold:
+                row["status"] = "regression"
+            elif row["ratio"] < 1 / (1 + threshold):
+                row["status"] = "improvement"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:,.1f}"
+
+
+def format_results(results):
+    width = max([len(n) for n in results["benchmarks"]]
+                + [len(n) for n in results.get("skipped", {})] + [9])
+    lines = [f"{'benchmark':<{width}}  {'n':>6}  {'p50 us':>11}  {'p90 us':>11}  "
+             f"{'p99 us':>11}  {'ops/s':>11}"]
+    for name, s in results["benchmarks"].items():
+        lines.append(f"{name:<{width}}  {s['n']:>6}  {_fmt(s['p50']):>11}  "
+                     f"{_fmt(s['p90']):>11}  {_fmt(s['p99']):>11}  {_fmt(s['ops_per_sec']):>11}")
+    for name, reason in results.get("skipped", {}).items():
+        lines.append(f"{name:<{width}}  skipped: {reason}")
+    return "\n".join(lines)
+
+
+def format_comparison(rows, current, baseline, metric="p50"):
+    lines = []
+    for key in ("redis", "database"):
+        old, new = baseline["meta"].get(key), current["meta"].get(key)
+        if old != new:
+            lines.append(f"warning: {key} stand-in differs (baseline {old}, current {new})")
+    width = max([len(r["name"]) for r in rows] + [9])
+    lines.append(f"{'benchmark':<{width}}  {'baseline':>11}  {'current':>11}  "
+                 f"{'change':>8}  status  ({metric}, us)")
+    for r in rows:
+        change = f"{(r['ratio'] - 1) * 100:+.1f}%" if "ratio" in r else "-"
+        lines.append(f"{r['name']:<{width}}  {_fmt(r['baseline']):>11}  "
+                     f"{_fmt(r['current']):>11}  {change:>8}  {r['status']}")
+    return "\n".join(lines)
+
+
+def run(standins, selected, **measure_opts):
+    """
+    Set up and time each selected benchmark; returns the result document
+    (``meta``, ``benchmarks`` and ``skipped``).
+    """
+    results = {"meta": environment(**standins.describe()), "benchmarks": {}, "skipped": {}}
+    for bench in selected:
+        try:
+            fn = bench.setup(standins)
+        except Skip as e:
+            results["skipped"][bench.name] = str(e)
+            continue
+        print(f"  {bench.name} ...", file=sys.stderr, flush=True)
+        summary = summarise(measure(fn, **measure_opts))
+        summary["group"] = bench.group
+        results["benchmarks"][bench.name] = summary
+    return results
@@ -0,0 +1,203 @@
+"""
+Per-request hot paths outside the analytics engines: token and API key checks,
+rate limiting, usage logging and plan lookups.
+"""
+import datetime
+import itertools
+import time
+
+from benchmarks import standins
+from benchmarks.harness import Skip, benchmark
+
+
+# -----------------------------------------------------------------------------
+# Auth0Middleware.verify_token
+# -----------------------------------------------------------------------------
+
+class _Request:
+    def __init__(self, token):
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+
+@benchmark("auth.verify_token.cached", group="auth")
+def verify_token_cached(env):
+    middleware, _ = env.auth
+    req = _Request(env.token())
+    middleware.verify_token(req)
+    return lambda: middleware.verify_token(req)
+
+
+@benchmark("auth.verify_token.uncached", group="auth")
+def verify_token_uncached(env):
+    # A distinct token per call: header parse, JWKS lookup, RS256 signature
+    # check and claim validation every time
+    middleware, _ = env.auth
+    tokens = itertools.cycle([_Request(env.token(f"auth0|bench-{i}")) for i in range(256)])
+
+    def call():
+        middleware._verified.clear()
+        middleware.verify_token(next(tokens))
+    return call
+
+
+# -----------------------------------------------------------------------------
+# API key resolution (auth.api_keys)
+# -----------------------------------------------------------------------------
+
+def _api_key_header(env):
+    from auth import api_keys
+
+    api_keys.bind(env.redis)
+    return f"Bearer {api_keys.issue(standins.CLIENT_ID)}"
+
+
+@benchmark("auth.api_key.cached", group="auth")
+def api_key_cached(env):
+    from auth import api_keys
+
+    header = _api_key_header(env)
+    api_keys.from_header(header)
+    return lambda: api_keys.from_header(header)
+
+
+@benchmark("auth.api_key.uncached", group="auth")
+def api_key_uncached(env):
+    # Hash plus one HGETALL on the key index every call
+    from auth import api_keys
+
+    header = _api_key_header(env)
+
+    def call():
+        api_keys.key_cache.invalidate()
+        api_keys.from_header(header)
+    return call
+
+
+# -----------------------------------------------------------------------------
+# rate_limit
+# -----------------------------------------------------------------------------
+
+def _with_app_context(env, fn):
+    def call():
+        with env.flask_app.app_context():
+            fn()
+    return call
+
+
+@benchmark("rate_limit.leased", group="rate_limit")
+def rate_limit_leased(env):
+    from usage import rate_limiter
+
+    if rate_limiter.LEASE_FRACTION <= 0:
+        raise Skip("RATE_LIMIT_LEASE_FRACTION is 0")
+    clients = itertools.cycle(range(1000, 1100))
+    call = _with_app_context(
+        env, lambda: rate_limiter.rate_limit(next(clients), max_requests_per_minute=10 ** 9))
+    # Leases are sized from the previous rate window's traffic; time the
+    # steady state, not the first window of single-token round trips
+    deadline = time.monotonic() + 1.5 * rate_limiter.LEASE_RATE_WINDOW_SECONDS
+    while time.monotonic() < deadline:
+        call()
+    return call
+
+
+@benchmark("rate_limit.shared", group="rate_limit")
+def rate_limit_shared(env):
+    # One shared-store round trip (the Lua token bucket) per call
+    from usage import rate_limiter
+
+    clients = itertools.cycle(range(2000, 2100))
+    return lambda: rate_limiter.check_rate_limit(next(clients), 10 ** 9, env.redis)
+
+
+@benchmark("rate_limit.plan_lookup", group="rate_limit")
+def rate_limit_plan(env):
+    # Limit resolved from the plan (cached catalogue) on every call
+    from usage import rate_limiter
+
+    return _with_app_context(
+        env, lambda: rate_limiter.rate_limit(standins.CLIENT_ID, plan_id=standins.PLAN_ID))
+
+
+# -----------------------------------------------------------------------------
+# log_usage
+# -----------------------------------------------------------------------------
+
+@benchmark("usage.log_usage", group="usage")
+def log_usage(env):
+    # The request-path cost: buffering one event for the background flusher
+    from models.usage import log_usage
+
+    return lambda: log_usage(standins.CLIENT_ID, "/cvar/estimate", 0.001)
+
+
+@benchmark("usage.write_batch", group="usage")
+def write_usage_batch(env):
+    # What the flusher does per batch: one executemany for USAGE_BATCH_SIZE
+    # rows plus the rollup and monthly-total upserts
+    from models.usage import USAGE_BATCH_SIZE
+
+    now = datetime.datetime.utcnow()
+    rows = [(standins.CLIENT_ID, "/cvar/estimate", now, 0.001)] * USAGE_BATCH_SIZE
+    return lambda: env.usage_writer(rows)
+
+
+# -----------------------------------------------------------------------------
+# Plan lookups
+# -----------------------------------------------------------------------------
+
+@benchmark("plans.get_plan_by_id.cached", group="plans")
+def plan_by_id_cached(env):
+    from models.plan import get_plan_by_id
+
+    return lambda: get_plan_by_id(standins.PLAN_ID)
+
+
+@benchmark("plans.get_plan_by_id.uncached", group="plans")
+def plan_by_id_uncached(env):
+    # Pool checkout and a primary-key SELECT every call
+    from models.plan import get_plan_by_id, plan_cache
+
+    def call():
+        plan_cache.invalidate()
+        get_plan_by_id(standins.PLAN_ID)
+    return call
+
+
+@benchmark("plans.get_active_plans.cached", group="plans")
+def active_plans_cached(env):
+    from models.plan import get_active_plans
+
+    return get_active_plans
+
+
+@benchmark("plans.get_active_plans.uncached", group="plans")
+def active_plans_uncached(env):
+    from models.plan import get_active_plans, plan_cache
+
+    def call():
+        plan_cache.invalidate()
+        get_active_plans()
+    return call
+
+
+# -----------------------------------------------------------------------------
+# Request instrumentation
+# -----------------------------------------------------------------------------
+
+@benchmark("metrics.request_overhead", group="metrics")
+def request_overhead(env):
+    # What metrics.stages adds to a request with the usual stages and round
+    # trips: timer, five stages, recording and the Server-Timing header
+    from metrics import stages
+
+    names = ("guard", "parse", "cache", "compute", "serialise")
+
+    def call():
+        stages.begin()
+        for name in names:
+            with stages.stage(name):
+                pass
+        stages.count("redis")
+        stages.finish("/wasserstein/optimize", "POST", 200)
+    return call
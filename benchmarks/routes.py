@@ -0,0 +1,102 @@
+"""
+End-to-end analytics routes through ``create_master_app().test_client()``:
+body parsing, the RapidAPI guard, the result cache, the compute pools and
+response encoding. Each route is timed computing (``Cache-Control:
+no-cache``) and, where it is cached, answered from the result cache.
+"""
+import io
+import json
+
+import numpy as np
+
+from benchmarks.harness import benchmark
+
+N_SCENARIOS = 5000
+N_ASSETS = 10
+
+_rng = np.random.default_rng(7)
+RETURNS = _rng.normal(0.0005, 0.02, (N_SCENARIOS, N_ASSETS))
+WEIGHTS = np.full(N_ASSETS, 1.0 / N_ASSETS)
+
+# (name, path, JSON payload, cached by the result cache)
+ROUTES = (
+    ("cvar.estimate", "/cvar/estimate",
+     {"portfolio": WEIGHTS.tolist(), "returns": RETURNS.tolist(), "confidence_level": 0.95},
+     True),
+    ("cvar.estimate.parametric", "/cvar/estimate",
+     {"portfolio": WEIGHTS.tolist(), "method": "parametric",
+      "mean": RETURNS.mean(axis=0).tolist(), "cov": np.cov(RETURNS.T).tolist(),
+      "confidence_level": [0.9, 0.95, 0.99]},
+     True),
+    ("cvar.estimate_batch", "/cvar/estimate/batch",
+     {"portfolios": np.tile(WEIGHTS, (64, 1)).tolist(), "returns": RETURNS.tolist()},
+     True),
+    ("wasserstein.optimize", "/wasserstein/optimize",
+     {"assets": RETURNS[:250].tolist(), "wasserstein_radius": 0.05, "risk_aversion": 0.5},
+     True),
+    ("wasserstein.frontier", "/wasserstein/frontier",
+     {"assets": RETURNS[:250].tolist(), "radii": [0.01, 0.05, 0.1]},
+     False),
+    ("heavy_tail.simulate", "/heavy-tail/simulate",
+     {"n_paths": 100, "periods": 252, "seed": 7},
+     False),
+    ("kolmogorov.explore", "/kolmogorov/explore",
+     {"data": RETURNS[:, 0].tolist(), "n_symbols": 8, "block_length": 3},
+     True),
+    ("kolmogorov.explore_rolling", "/kolmogorov/explore",
+     {"data": RETURNS[:, 0].tolist(), "window": 1000, "step": 250},
+     True),
+)
+
+
+def _npy(arr):
+    buf = io.BytesIO()
+    np.save(buf, arr)
+    return buf.getvalue()
+
+
+def _post(env, path, body, headers):
+    client = env.master_app.test_client()
+
+    def call():
+        response = client.post(path, data=body, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"POST {path} returned {response.status_code}: "
+                               f"{response.get_data(as_text=True)[:200]}")
+    return call
+
+
+def _register(name, path, payload, cacheable):
+    body = json.dumps(payload)
+
+    @benchmark(f"route.{name}", group="routes")
+    def compute(env):
+        return _post(env, path, body, env.api_headers(Cache_Control="no-cache"))
+
+    if cacheable:
+        @benchmark(f"route.{name}.cached", group="routes")
+        def cached(env):
+            return _post(env, path, body, env.api_headers())
+
+
+for _route in ROUTES:
+    _register(*_route)
+
+
+@benchmark("route.cvar.estimate.npy", group="routes")
+def cvar_estimate_npy(env):
+    # Same request as route.cvar.estimate with the matrix as a .npy body
+    return _post(env, "/cvar/estimate?portfolio=" + json.dumps(WEIGHTS.tolist()),
+                 _npy(RETURNS),
+                 env.api_headers("application/x-npy", Cache_Control="no-cache"))
+
+
+@benchmark("route.cvar.estimate.dataset", group="routes")
+def cvar_estimate_dataset(env):
+    # Same request again with the matrix uploaded once and sent by id
+    client = env.master_app.test_client()
+    response = client.post("/datasets", data=_npy(RETURNS),
+                           headers=env.api_headers("application/x-npy"))
+    body = json.dumps({"portfolio": WEIGHTS.tolist(),
+                       "dataset_id": response.get_json()["dataset_id"]})
+    return _post(env, "/cvar/estimate", body, env.api_headers(Cache_Control="no-cache"))
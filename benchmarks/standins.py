@@ -0,0 +1,376 @@
+"""
+Local stand-ins for the services the API talks to: Redis (fakeredis, or a
+local redis-server via --redis-url), the database (SQLite, or a throwaway
+MySQL configured through the usual DB_* variables), Auth0 (a generated
+RSA key served from a JWKS file) and, when the git submodules are not
+checked out, the blueprints app.py attaches its analytics routes to.
+"""
+import datetime
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import types
+from importlib.util import find_spec
+
+from benchmarks.harness import Skip
+
+PROXY_SECRET = "seas-bench"
+AUTH0_DOMAIN = "bench.local"
+AUTH0_AUDIENCE = "seas-bench"
+SIGNING_KID = "bench-key"
+
+PLAN_ID = 1
+CLIENT_ID = 1
+
+# Portable subset of the production tables the benchmarked code reads
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS plans (
+        id INTEGER PRIMARY KEY,
+        name VARCHAR(64) NOT NULL,
+        price DECIMAL(10, 2),
+        api_price DECIMAL(10, 4),
+        consulting_rate DECIMAL(10, 2),
+        description TEXT,
+        is_active BOOLEAN NOT NULL DEFAULT 1,
+        api_limit INT,
+        rate_limit_per_minute INT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS clients (
+        id INTEGER PRIMARY KEY,
+        name VARCHAR(255),
+        email VARCHAR(255),
+        plan_id INT,
+        active BOOLEAN NOT NULL DEFAULT 1,
+        created_at DATETIME,
+        trial_end_date DATETIME
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS usage_logs (
+        id INTEGER PRIMARY KEY {autoincrement},
+        client_id INT NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        timestamp DATETIME NOT NULL,
+        usage_cost DECIMAL(10, 4) NOT NULL
+    )
+    """,
+)
+
+# models.usage.USAGE_ROLLUP_DDL without the MySQL-only ENUM column type
+SQLITE_ROLLUP_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS usage_rollups (
+        client_id INT NOT NULL,
+        granularity VARCHAR(4) NOT NULL,
+        bucket_start DATETIME NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        calls BIGINT NOT NULL DEFAULT 0,
+        cost DECIMAL(18, 6) NOT NULL DEFAULT 0,
+        PRIMARY KEY (client_id, granularity, bucket_start, endpoint)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS usage_totals (
+        client_id INT NOT NULL,
+        period_start DATE NOT NULL,
+        calls BIGINT NOT NULL DEFAULT 0,
+        cost DECIMAL(18, 6) NOT NULL DEFAULT 0,
+        PRIMARY KEY (client_id, period_start)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_usage_logs_client_id ON usage_logs (client_id, id)",
+)
+
+# (module, blueprint attribute, blueprint name) app.py imports from the
+# submodules; the routes themselves are defined in app.py
+BLUEPRINTS = (
+    ("cvar_app.app.main", "cvar_bp", "cvar"),
+    ("wasserstein_app.app", "wasserstein_bp", "wasserstein"),
+    ("heavy_tail_app.app", "heavy_tail_bp", "heavy_tail"),
+    ("kolmogorov_app.api.optimize", "kolmogorov_bp", "kolmogorov"),
+)
+
+
+# -----------------------------------------------------------------------------
+# SQLite in place of mysql.connector
+# -----------------------------------------------------------------------------
+
+class _SQLiteCursor:
+    """
+    The slice of the mysql.connector cursor API the models use, with
+    ``%s`` placeholders and ``dictionary=True`` rows.
+    """
+
+    def __init__(self, cursor, dictionary):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    _VALUES = re.compile(r"VALUES\((\w+)\)")
+
+    @classmethod
+    def _sql(cls, sql):
+        # MySQL's upsert as SQLite's (3.35+: no conflict target needed)
+        head, upsert, update = sql.partition("ON DUPLICATE KEY UPDATE")
+        if upsert:
+            sql = head + "ON CONFLICT DO UPDATE SET" + cls._VALUES.sub(r"excluded.\1", update)
+        return sql.replace("%s", "?")
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(self._sql(sql), params)
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(self._sql(sql), rows)
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class _SQLiteConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self, dictionary=False, **kwargs):
+        return _SQLiteCursor(self._conn.cursor(), dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self._conn.close()
+
+
+def _install_blueprints():
+    """
+    Register empty stand-in modules for the blueprints of submodules that
+    are not checked out, so ``import app`` works without them.
+    """
+    from flask import Blueprint
+
+    for module, attr, name in BLUEPRINTS:
+        top = module.split(".")[0]
+        if top in sys.modules or find_spec(top) is not None:
+            continue
+        parts = module.split(".")
+        for i in range(1, len(parts) + 1):
+            package = ".".join(parts[:i])
+            stub = sys.modules.setdefault(package, types.ModuleType(package))
+            if i < len(parts):
+                stub.__path__ = []
+            if i > 1:
+                setattr(sys.modules[".".join(parts[:i - 1])], parts[i - 1], stub)
+        setattr(sys.modules[module], attr, Blueprint(name, module))
+
+
+# -----------------------------------------------------------------------------
+# Stand-in set
+# -----------------------------------------------------------------------------
+
+class StandIns:
+    """
+    Creates the stand-ins and points the app's modules at them. Construct it
+    before importing anything from the app: module-level settings (spool and
+    dataset directories, the RapidAPI secret) are read from the environment
+    at import time.
+    """
+
+    def __init__(self, redis_url=None, database="sqlite"):
+        self.tmpdir = tempfile.mkdtemp(prefix="seas-bench-")
+        os.environ["USAGE_SPOOL_DIR"] = os.path.join(self.tmpdir, "usage_spool")
+        os.environ["DATASET_DIR"] = os.path.join(self.tmpdir, "datasets")
+        os.environ["RAPIDAPI_PROXY_SECRET"] = PROXY_SECRET
+
+        self.redis, self.redis_binary, self.redis_name = self._redis(redis_url)
+        self.database = database
+        self.usage_writer = self._database(database)
+        self._auth = None
+        self._flask_app = None
+        self._master_app = None
+
+    def describe(self):
+        return {"redis": self.redis_name, "database": self.database}
+
+    def close(self):
+        from models.usage import usage_recorder
+
+        usage_recorder.close()
+        if self._master_app is not None:
+            from engines import executor
+            executor.shutdown()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    # -- Redis ----------------------------------------------------------------
+
+    @staticmethod
+    def _redis(url):
+        if url:
+            import redis
+
+            return (redis.Redis.from_url(url, decode_responses=True),
+                    redis.Redis.from_url(url), url)
+        if find_spec("fakeredis") is None:
+            raise SystemExit("benchmarks need fakeredis (pip install fakeredis) "
+                             "or --redis-url pointing at a local redis-server")
+        import fakeredis
+
+        server = fakeredis.FakeServer()
+        # Without lupa fakeredis cannot run the rate limiter's Lua script
+        name = "fakeredis" if find_spec("lupa") else "fakeredis (no Lua)"
+        return (fakeredis.FakeRedis(server=server, decode_responses=True),
+                fakeredis.FakeRedis(server=server), name)
+
+    # -- database -------------------------------------------------------------
+
+    def _database(self, database):
+        from models import db
+        from models import usage
+
+        if database == "sqlite":
+            path = os.path.join(self.tmpdir, "seas.sqlite3")
+            db._pool = db.ConnectionPool(connect=lambda: _SQLiteConnection(path))
+            autoincrement = ""
+        elif database == "mysql":
+            # Uses DB_HOST / DB_USER / DB_PASSWORD / DB_NAME; the tables
+            # below are created there and the seed rows overwritten, so
+            # point it at a database that holds nothing else
+            autoincrement = "AUTO_INCREMENT"
+        else:
+            raise ValueError(f"unknown database stand-in: {database}")
+
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            for ddl in SCHEMA:
+                cursor.execute(ddl.format(autoincrement=autoincrement))
+            if database == "sqlite":
+                for ddl in SQLITE_ROLLUP_DDL:
+                    cursor.execute(ddl)
+            cursor.execute("DELETE FROM plans WHERE id = %s", (PLAN_ID,))
+            cursor.execute("DELETE FROM clients WHERE id = %s", (CLIENT_ID,))
+            cursor.execute(
+                "INSERT INTO plans (id, name, price, api_price, consulting_rate, description, "
+                "is_active, api_limit, rate_limit_per_minute) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (PLAN_ID, "Bench", 0, 0.001, 0, "benchmark plan", 1, 10 ** 9, 10 ** 9))
+            cursor.execute(
+                "INSERT INTO clients (id, name, email, plan_id, active, created_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                (CLIENT_ID, "Bench", "bench@example.com", PLAN_ID, 1, now))
+            conn.commit()
+            cursor.close()
+        if database == "mysql":
+            usage.create_rollup_tables()
+
+        usage.usage_recorder.writer = usage.write_usage_logs
+        return usage.write_usage_logs
+
+    # -- Auth0 ----------------------------------------------------------------
+
+    @property
+    def auth(self):
+        """
+        ``(middleware, private_key)``: an Auth0Middleware verifying against a
+        JWKS file holding the public half of a freshly generated key.
+        """
+        if self._auth is None:
+            import jwt
+            from cryptography.hazmat.primitives.asymmetric import rsa
+
+            from auth.middleware import Auth0Middleware
+
+            key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+            jwk.update(kid=SIGNING_KID, alg="RS256", use="sig")
+            path = os.path.join(self.tmpdir, "jwks.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"keys": [jwk]}, f)
+            middleware = Auth0Middleware(AUTH0_DOMAIN, AUTH0_AUDIENCE, None,
+                                         audience=AUTH0_AUDIENCE, jwks_file=path)
+            self._auth = (middleware, key)
+        return self._auth
+
+    def token(self, subject="auth0|bench", ttl=3600):
+        import jwt
+
+        _, key = self.auth
+        now = int(time.time())
+        claims = {"sub": subject, "aud": AUTH0_AUDIENCE, "iss": f"https://{AUTH0_DOMAIN}/",
+                  "iat": now, "exp": now + ttl}
+        return jwt.encode(claims, key, algorithm="RS256", headers={"kid": SIGNING_KID})
+
+    # -- Flask apps -----------------------------------------------------------
+
+    @property
+    def flask_app(self):
+        """
+        A bare Flask app wired to the Redis stand-in, for benchmarks that
+        need an application context but none of the routes.
+        """
+        if self._flask_app is None:
+            from flask import Flask
+
+            self._flask_app = Flask("seas-bench")
+            self._flask_app.extensions["redis"] = self.redis
+            self._flask_app.extensions["redis_binary"] = self.redis_binary
+        return self._flask_app
+
+    @property
+    def master_app(self):
+        """
+        ``create_master_app()`` rebound to the stand-ins, with stand-in
+        blueprints for submodules that are not checked out. Raises Skip when
+        ``app`` still cannot be imported.
+        """
+        if self._master_app is None:
+            _install_blueprints()
+            try:
+                import app as app_module
+            except ImportError as e:
+                raise Skip(f"cannot import app: {e}")
+            from auth import api_keys
+            from cache import lookups
+
+            master = app_module.create_master_app()
+            master.extensions["redis"] = self.redis
+            master.extensions["redis_binary"] = self.redis_binary
+            lookups.bind(self.redis)
+            api_keys.bind(self.redis)
+            self._master_app = master
+        return self._master_app
+
+    def api_headers(self, content_type="application/json", **extra):
+        headers = {"X-RapidAPI-Proxy-Secret": PROXY_SECRET, "Content-Type": content_type}
+        headers.update({k.replace("_", "-"): v for k, v in extra.items()})
+        return headers
@@ -0,0 +1,249 @@
+import datetime
+import json
+import os
+import threading
+
+from cache import lookups
+from models.db import get_connection
+
+# Most events applied per transaction
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 100))
+# How often a worker looks for events accepted by other processes
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", 2))
+# Events that keep failing are left in the table for inspection
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 5))
+
+# Stripe events that can change which plan a client is on
+SUBSCRIPTION_EVENTS = {
+    "checkout.session.completed",
+    "invoice.payment_succeeded",
+    "customer.subscription.created",
+    "customer.subscription.updated",
+    "customer.subscription.deleted",
+}
+
+# The table is both the de-duplication log (primary key on the Stripe event
+# id) and the durable queue (rows with processed_at IS NULL)
+STRIPE_EVENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS stripe_events (
+        id VARCHAR(255) NOT NULL PRIMARY KEY,
+        type VARCHAR(255) NOT NULL,
+        payload MEDIUMTEXT NOT NULL,
+        received_at DATETIME NOT NULL,
+        processed_at DATETIME NULL,
+        attempts INT NOT NULL DEFAULT 0,
+        last_error TEXT NULL,
+        INDEX idx_stripe_events_pending (processed_at, received_at)
+    )
+"""
+
+# purchase_date is when Stripe's webhook reached us (the event's
+# received_at), however long the event then waited in the queue
+INSERT_PURCHASE_SQL = """
+    INSERT INTO purchases (user_id, price_id, session_id, purchase_date)
+    VALUES (%s, %s, %s, %s)
+"""
+
+stats = {"accepted": 0, "duplicates": 0, "applied": 0, "failed": 0, "batches": 0}
+
+_wakeup = threading.Event()
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+# Function to create the webhook event table
+def create_events_table():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(STRIPE_EVENTS_DDL)
+        conn.commit()
+        cursor.close()
+
+
+# Function to accept a verified Stripe event
+def accept_event(event_id, event_type, payload):
+    """
+    Durably records a verified event for the worker and returns True, or
+    returns False if the event id was seen before (a Stripe retry). One
+    single-row INSERT; nothing else runs before the webhook is acknowledged.
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT IGNORE INTO stripe_events (id, type, payload, received_at)
+            VALUES (%s, %s, %s, %s)
+        """, (event_id, event_type, payload, datetime.datetime.utcnow()))
+        accepted = cursor.rowcount == 1
+        conn.commit()
+        cursor.close()
+
+    if accepted:
+        stats["accepted"] += 1
+        ensure_worker()
+        _wakeup.set()
+    else:
+        stats["duplicates"] += 1
+    return accepted
+
+
+def purchases_for(event):
+    """
+    Purchase rows ``(user_id, price_id, session_id)`` an event records.
+    """
+    obj = event["data"]["object"]
+    if event["type"] == "invoice.payment_succeeded":
+        # The customer id identifies the user on Stripe's side
+        return [(obj["customer"], obj["lines"]["data"][0]["price"]["id"], obj["id"])]
+    if event["type"] == "customer.subscription.deleted":
+        return [(obj["customer"], "canceled", obj["id"])]
+    if event["type"] == "checkout.session.completed":
+        user_id = obj.get("client_reference_id") or obj.get("customer")
+        if not user_id:
+            raise ValueError("checkout session has no client_reference_id or customer")
+        return [(user_id, "checkout", obj["id"])]
+    return []
+
+
+def _mark_failed(ids, error, attempts_to_add=1):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            UPDATE stripe_events SET attempts = attempts + %s, last_error = %s
+            WHERE id = %s
+        """, [(attempts_to_add, error[:2000], event_id) for event_id in ids])
+        conn.commit()
+        cursor.close()
+    stats["failed"] += len(ids)
+
+
+def _parse(rows):
+    """
+    Split claimed rows into purchase rows to insert, rows that parsed and
+    ``(id, error)`` for payloads that cannot be applied.
+    """
+    purchases, done, malformed = [], [], []
+    for row in rows:
+        try:
+            purchases.extend(p + (row["received_at"],)
+                             for p in purchases_for(json.loads(row["payload"])))
+            done.append(row)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            malformed.append((row["id"], f"{type(e).__name__}: {e}"))
+    return purchases, done, malformed
+
+
+def _apply(cursor, purchases, done):
+    if purchases:
+        cursor.executemany(INSERT_PURCHASE_SQL, purchases)
+    now = datetime.datetime.utcnow()
+    cursor.executemany(
+        "UPDATE stripe_events SET processed_at = %s WHERE id = %s",
+        [(now, row["id"]) for row in done])
+
+
+def _apply_one(event_id):
+    """
+    Re-claim and apply one event in its own transaction; a failure counts
+    an attempt against this event only. Returns the row if it was applied.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, type, payload, received_at FROM stripe_events
+            WHERE id = %s AND processed_at IS NULL
+            FOR UPDATE SKIP LOCKED
+        """, (event_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            # Applied or claimed by another worker meanwhile
+            conn.commit()
+            cursor.close()
+            return None
+        purchases, done, _ = _parse(rows)
+        try:
+            _apply(cursor, purchases, done)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            _mark_failed([event_id], str(e))
+            return None
+        cursor.close()
+    return rows[0]
+
+
+# Function to apply the next batch of queued events
+def drain_batch(batch_size=WEBHOOK_BATCH_SIZE):
+    """
+    Claims up to ``batch_size`` pending events (skipping rows another worker
+    holds), applies them and marks them processed in one transaction. If
+    that transaction fails, the events are retried one per transaction so a
+    single bad event cannot hold back (or use up the attempts of) the rest.
+    Returns the number of events taken off the queue.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, type, payload, received_at FROM stripe_events
+            WHERE processed_at IS NULL AND attempts < %s
+            ORDER BY received_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (WEBHOOK_MAX_ATTEMPTS, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.commit()
+            cursor.close()
+            return 0
+
+        purchases, done, malformed = _parse(rows)
+        try:
+            _apply(cursor, purchases, done)
+            conn.commit()
+            batch_failed = False
+        except Exception:
+            conn.rollback()
+            batch_failed = True
+        cursor.close()
+
+    if batch_failed:
+        done = [row for row in (_apply_one(row["id"]) for row in done) if row is not None]
+    for event_id, error in malformed:
+        # Retrying cannot fix a payload we cannot read
+        _mark_failed([event_id], error, WEBHOOK_MAX_ATTEMPTS)
+    stats["applied"] += len(done)
+    stats["batches"] += 1
+    if any(row["type"] in SUBSCRIPTION_EVENTS for row in done):
+        # Events carry Stripe customer ids, not client ids, so drop all
+        # cached client rows in every worker
+        lookups.invalidate("clients")
+    return len(rows)
+
+
+def _run():
+    while True:
+        _wakeup.wait(WEBHOOK_POLL_SECONDS)
+        _wakeup.clear()
+        try:
+            while drain_batch() == WEBHOOK_BATCH_SIZE:
+                pass
+        except Exception:
+            # Database unavailable; events stay queued for the next pass
+            pass
+
+
+def ensure_worker():
+    """
+    Start this process's queue worker if it is not running yet.
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        # Threads do not survive fork, so each worker process starts its own
+        _worker_pid = os.getpid()
+        threading.Thread(target=_run, name="stripe-events", daemon=True).start()
@@ -1,16 +1,21 @@
-import os
-import stripe
 from flask import current_app
-import mysql.connector
 from dotenv import load_dotenv
 
+from models.db import get_connection
+from models.plan import plan_cache
+
 # Load environment variables from .env file
 load_dotenv()
 
-# Helper function to set the Stripe API key from Flask app context
-def set_stripe_api_key():
-    """Helper function to set the Stripe API key from Flask app context."""
+# Helper function to get the Stripe SDK configured from Flask app context
+def get_stripe():
+    """
+    Imports stripe on first use (it is one of the slowest imports in the app)
+    and sets its API key from the Flask app context.
+    """
+    import stripe
     stripe.api_key = current_app.config["STRIPE_SECRET_KEY"]
+    return stripe
 
 # Function to create a Stripe checkout session
 def create_checkout_session(price_id, success_url, cancel_url, user_id):
@@ -18,7 +23,7 @@ def create_checkout_session(price_id, success_url, cancel_url, user_id):
     Creates a Stripe checkout session for metered billing and stores purchase info in Google Cloud SQL.
     """
     # Ensure the Stripe API key is set in the app context
-    set_stripe_api_key()
+    stripe = get_stripe()
 
     # Create the checkout session
     session = stripe.checkout.Session.create(
@@ -39,46 +44,37 @@ def save_purchase_info(user_id, price_id, session_id):
     """
     Saves purchase information to Google Cloud SQL database.
     """
-    # Connect to Google Cloud SQL
-    conn = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME"),
-    )
-    cursor = conn.cursor()
+    # Borrow a pooled connection to Google Cloud SQL
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    # Insert the purchase record into the database
-    cursor.execute("""
-        INSERT INTO purchases (user_id, price_id, session_id, purchase_date)
-        VALUES (%s, %s, %s, NOW())
-    """, (user_id, price_id, session_id))
+        # Insert the purchase record into the database
+        cursor.execute("""
+            INSERT INTO purchases (user_id, price_id, session_id, purchase_date)
+            VALUES (%s, %s, %s, NOW())
+        """, (user_id, price_id, session_id))
 
-    # Commit the transaction and close the connection
-    conn.commit()
-    cursor.close()
-    conn.close()
+        # Commit the transaction; the connection goes back to the pool
+        conn.commit()
+        cursor.close()
 
 # Function to get the plan details for rendering in the store page
 def get_plan_details():
     """
-    Fetches all active plans from the Google Cloud SQL database.
+    Fetches all active plans from the Google Cloud SQL database, through
+    the shared plan cache.
     """
-    # Connect to Google Cloud SQL
-    conn = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME"),
-    )
-    cursor = conn.cursor(dictionary=True)
+    return plan_cache.get("details", _load_plan_details)
+
+def _load_plan_details():
+    # Borrow a pooled connection to Google Cloud SQL
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
 
-    # Fetch active plans
-    cursor.execute("SELECT id, name, price, description, api_price, consulting_rate FROM plans WHERE is_active = 1")
-    plans = cursor.fetchall()
+        # Fetch active plans
+        cursor.execute("SELECT id, name, price, description, api_price, consulting_rate FROM plans WHERE is_active = 1")
+        plans = cursor.fetchall()
 
-    # Close the connection
-    cursor.close()
-    conn.close()
+        cursor.close()
 
     return plans
@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from redis.exceptions import RedisError
+
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", 300))
+CLIENT_CACHE_TTL = float(os.getenv("CLIENT_CACHE_TTL", 60))
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", 10000))
+INVALIDATION_CHANNEL = os.getenv("LOOKUP_INVALIDATION_CHANNEL", "cache:invalidate")
+RECONNECT_SECONDS = 1.0
+
+_MISSING = object()
+_caches = {}
+_store = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+# Identifies this process's own broadcasts so it can skip them
+_origin = uuid.uuid4().hex
+
+
+class LookupCache:
+    """
+    Read-through, per-process cache for small, rarely changing lookups.
+
+    Entries live for ``ttl`` seconds and at most ``size`` are kept (LRU).
+    ``None`` results are not cached, so rows created after a miss are seen
+    at once. Cached values are shared between callers and must be treated
+    as read-only.
+    """
+
+    def __init__(self, name, ttl, size=LOOKUP_CACHE_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a load that raced one is not stored
+        self._generation = 0
+        _caches[name] = self
+
+    def get(self, key, loader):
+        _ensure_listener()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._data[key] = (time.monotonic() + self.ttl, value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.size:
+                        self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, key=_MISSING):
+        """
+        Drop ``key``, or every entry when no key is given, in this process.
+        """
+        with self._lock:
+            self._generation += 1
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+def bind(store):
+    """
+    Use ``store`` (a decode_responses Redis client) to broadcast and receive
+    invalidations. Without it caches are per-process and rely on their TTL.
+    """
+    global _store
+    _store = store
+
+
+def invalidate(name, key=_MISSING):
+    """
+    Invalidate ``key`` (or the whole cache) here and in every other worker.
+    """
+    cache = _caches.get(name)
+    if cache is not None:
+        cache.invalidate(key)
+    if _store is None:
+        return
+    message = {"origin": _origin, "cache": name}
+    if key is not _MISSING:
+        message["key"] = key
+    try:
+        _store.publish(INVALIDATION_CHANNEL, json.dumps(message))
+    except RedisError:
+        # Other workers fall back to expiring the entry after its TTL
+        pass
+
+
+def _apply(message):
+    try:
+        data = json.loads(message)
+    except (TypeError, ValueError):
+        return
+    if data.get("origin") == _origin:
+        return
+    cache = _caches.get(data.get("cache"))
+    if cache is not None:
+        key = data.get("key", _MISSING)
+        # JSON turns tuple keys into lists
+        cache.invalidate(tuple(key) if isinstance(key, list) else key)
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = _store.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Messages may have been missed while (re)connecting
+            for cache in list(_caches.values()):
+                cache.invalidate()
+            for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _apply(message["data"])
+        except (RedisError, OSError):
+            time.sleep(RECONNECT_SECONDS)
+
+
+def _ensure_listener():
+    global _listener_pid
+    if _store is None or _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        # One subscriber thread per process (threads do not survive fork)
+        _listener_pid = os.getpid()
+        threading.Thread(target=_listen, name="lookup-invalidation", daemon=True).start()
+
+
+def stats():
+    return {name: {"hits": c.hits, "misses": c.misses, "size": len(c._data)}
+            for name, c in _caches.items()}
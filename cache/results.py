@@ -0,0 +1,316 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+from flask import current_app, request
+from redis.exceptions import RedisError
+
+from auth import api_keys
+from datasets import store as dataset_store
+from formats import arrays as formats
+from metrics.stages import stage
+
+DEFAULT_TTL = int(os.getenv("RESULT_CACHE_TTL", 300))
+LOCAL_SIZE = int(os.getenv("RESULT_CACHE_LOCAL_SIZE", 1024))
+LOCAL_TTL = float(os.getenv("RESULT_CACHE_LOCAL_TTL", 30))
+# How long a leader may hold the cross-worker compute lock
+LOCK_TTL_MS = int(os.getenv("RESULT_CACHE_LOCK_TTL_MS", 30000))
+LOCK_POLL_SECONDS = 0.05
+
+# Delete the lock only if it still holds our token, in one round trip, so a
+# leader whose lock expired cannot delete the next leader's lock
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+stats = {"hits_local": 0, "hits_redis": 0, "misses": 0, "waits": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+# -----------------------------------------------------------------------------
+# Canonical request hashing
+# -----------------------------------------------------------------------------
+
+def _numeric_array(value):
+    """
+    Return ``value`` as a float64 array if it is a (nested) list of numbers.
+    """
+    if not value or isinstance(value[0], (str, dict)):
+        return None
+    try:
+        arr = np.asarray(value, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    # Adding 0.0 folds -0.0 into 0.0 so equal inputs hash equally
+    return arr + 0.0
+
+
+def _feed(h, value):
+    if isinstance(value, dict):
+        h.update(b"{")
+        for key in sorted(value):
+            _feed(h, str(key))
+            _feed(h, value[key])
+        h.update(b"}")
+    elif isinstance(value, (list, np.ndarray)):
+        # Arrays hash like the equivalent JSON list, so the same data sent as
+        # JSON or in a binary format maps to the same key
+        arr = (value.astype(np.float64) + 0.0 if isinstance(value, np.ndarray)
+               else _numeric_array(value))
+        if arr is not None:
+            h.update(b"A" + struct.pack(f"<{arr.ndim + 1}q", arr.ndim, *arr.shape))
+            h.update(np.ascontiguousarray(arr, dtype="<f8").tobytes())
+        else:
+            h.update(b"[")
+            for item in value:
+                _feed(h, item)
+            h.update(b"]")
+    elif isinstance(value, bool) or value is None:
+        h.update(b"L" + repr(value).encode())
+    elif isinstance(value, (int, float)):
+        # 1, 1.0 and 1e0 mean the same thing to every endpoint
+        h.update(b"N" + struct.pack("<d", float(value) + 0.0))
+    else:
+        encoded = str(value).encode()
+        h.update(b"S" + struct.pack("<q", len(encoded)) + encoded)
+
+
+def request_key(endpoint, version, payload, variant=""):
+    """
+    Content address of a request: endpoint, endpoint version, response
+    ``variant`` (the negotiated format) and a hash of the canonicalised
+    payload.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(variant.encode() + b"\0")
+    _feed(h, payload)
+    return f"rc:{endpoint}:v{version}:{h.hexdigest()}"
+
+
+# -----------------------------------------------------------------------------
+# Storage tiers
+# -----------------------------------------------------------------------------
+
+class _LocalCache:
+    """
+    Thread-safe LRU with a per-entry expiry.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = _LocalCache(LOCAL_SIZE)
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _pack(status, content_type, body):
+    header = json.dumps([status, content_type]).encode()
+    return struct.pack("<I", len(header)) + header + zlib.compress(body, 1)
+
+
+def _unpack(blob):
+    (n,) = struct.unpack_from("<I", blob)
+    status, content_type = json.loads(blob[4:4 + n])
+    return status, content_type, zlib.decompress(blob[4 + n:])
+
+
+def _redis():
+    return current_app.extensions.get("redis_binary")
+
+
+def _redis_get(store, key):
+    if store is None:
+        return None
+    try:
+        return store.get(key)
+    except RedisError:
+        _count("errors")
+        return None
+
+
+def _response(entry, source):
+    status, content_type, body = entry
+    response = current_app.response_class(body, status=status, content_type=content_type)
+    response.headers["X-Cache"] = source
+    return response
+
+
+def _compute(view, args, kwargs, key, ttl, store):
+    rv = current_app.make_response(view(*args, **kwargs))
+    if rv.status_code == 200 and not rv.is_streamed:
+        entry = (rv.status_code, rv.content_type, rv.get_data())
+        with stage("cache"):
+            _local.set(key, entry, min(ttl, LOCAL_TTL))
+            if store is not None:
+                try:
+                    store.set(key, _pack(*entry), ex=ttl)
+                except RedisError:
+                    _count("errors")
+    rv.headers["X-Cache"] = "MISS"
+    return rv
+
+
+_scripts = {}
+
+
+def _release_lock_script(store):
+    script = _scripts.get(id(store))
+    if script is None:
+        script = _scripts[id(store)] = store.register_script(RELEASE_LOCK_LUA)
+    return script
+
+
+def _compute_with_lock(view, args, kwargs, key, ttl, store):
+    """
+    Only one worker across the fleet computes a given key; the others poll
+    Redis for its result until the leader's lock expires.
+    """
+    if store is None:
+        return _compute(view, args, kwargs, key, ttl, store)
+
+    lock_key = key + ":lock"
+    token = os.urandom(8)
+    deadline = time.monotonic() + LOCK_TTL_MS / 1000.0
+    acquired = False
+    while True:
+        try:
+            acquired = bool(store.set(lock_key, token, nx=True, px=LOCK_TTL_MS))
+        except RedisError:
+            _count("errors")
+            break
+        if acquired or time.monotonic() > deadline:
+            break
+        time.sleep(LOCK_POLL_SECONDS)
+        blob = _redis_get(store, key)
+        if blob is not None:
+            _count("waits")
+            entry = _unpack(blob)
+            _local.set(key, entry, min(ttl, LOCAL_TTL))
+            return _response(entry, "HIT")
+
+    try:
+        return _compute(view, args, kwargs, key, ttl, store)
+    finally:
+        if acquired:
+            try:
+                _release_lock_script(store)(keys=[lock_key], args=[token])
+            except RedisError:
+                _count("errors")
+
+
+def cached(endpoint, version=1, ttl=None, cacheable=None, array_field=None):
+    """
+    Cache a POST analytics route by the content of its body and the response
+    format it negotiated.
+
+    Lookups go to an in-process LRU first, then Redis. Concurrent identical
+    requests are de-duplicated (single flight) within the process and, via a
+    short Redis lock, across workers. ``cacheable(payload)`` can veto caching
+    for non-deterministic requests. Bump ``version`` when the endpoint's
+    output changes. Clients can send ``Cache-Control: no-cache`` to force a
+    recompute. ``array_field`` names the field a bare .npy body fills, as in
+    ``formats.read_payload``.
+
+    A ``dataset_id`` standing in for ``array_field`` must belong to the
+    caller before any lookup: the key covers the dataset's content, not
+    who may read it, so another owner's cached result must not be served.
+    """
+    if ttl is None:
+        env_name = "RESULT_CACHE_TTL_" + endpoint.replace("/", "_").replace("-", "_").upper()
+        ttl = int(os.getenv(env_name, DEFAULT_TTL))
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            payload = formats.read_payload(array_field)
+            if payload.get(array_field) is None and payload.get("dataset_id") is not None:
+                dataset_store.check_owner(payload["dataset_id"], api_keys.caller())
+            if cacheable is not None and not cacheable(payload):
+                return view(*args, **kwargs)
+
+            key = request_key(endpoint, version, payload, formats.response_mimetype())
+            store = _redis()
+            fresh = "no-cache" in request.headers.get("Cache-Control", "")
+
+            if not fresh:
+                with stage("cache"):
+                    entry = _local.get(key)
+                    if entry is not None:
+                        _count("hits_local")
+                    else:
+                        blob = _redis_get(store, key)
+                        if blob is not None:
+                            _count("hits_redis")
+                            entry = _unpack(blob)
+                            _local.set(key, entry, min(ttl, LOCAL_TTL))
+                if entry is not None:
+                    return _response(entry, "HIT")
+
+            # Local single flight: followers wait for the leader's result
+            with _inflight_lock:
+                event = _inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = _inflight[key] = threading.Event()
+            if not leader and not fresh:
+                event.wait(LOCK_TTL_MS / 1000.0)
+                entry = _local.get(key)
+                if entry is not None:
+                    _count("waits")
+                    return _response(entry, "HIT")
+
+            _count("misses")
+            try:
+                if fresh or not leader:
+                    return _compute(view, args, kwargs, key, ttl, store)
+                return _compute_with_lock(view, args, kwargs, key, ttl, store)
+            finally:
+                if leader:
+                    with _inflight_lock:
+                        _inflight.pop(key, None)
+                    event.set()
+
+        return wrapper
+
+    return decorator
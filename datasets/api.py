@@ -0,0 +1,86 @@
+from flask import Blueprint, jsonify, request
+
+from auth import api_keys
+from datasets import store
+from formats import arrays as formats
+
+datasets_bp = Blueprint("datasets", __name__)
+
+
+def _describe(dataset_id, arr):
+    return {"dataset_id": dataset_id, "shape": list(arr.shape),
+            "dtype": arr.dtype.str, "bytes": int(arr.nbytes)}
+
+
+@datasets_bp.route("", methods=["POST"])
+def upload_dataset():
+    """
+    Upload a scenario matrix once and reference it by id
+    ---
+    tags: [Datasets]
+    security:
+      - bearerAuth: []
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: object
+            properties:
+              data:
+                type: array
+                description: (rows x columns) matrix or a vector
+                items:
+                  type: array
+                  items: number
+            required: [data]
+          example:
+            data: [[0.01, -0.02], [-0.05, 0.03], [0.02, -0.08]]
+        application/x-npy:
+          schema:
+            type: string
+            format: binary
+    responses:
+      201:
+        description: Stored; pass dataset_id instead of the inline matrix
+        content:
+          application/json:
+            example:
+              dataset_id: 3f2a9c0b7d1e4f5a8b6c2d0e1f3a4b5c
+              shape: [3, 2]
+              dtype: <f8
+              bytes: 48
+      200:
+        description: An identical dataset was already stored
+      413:
+        description: Body larger than MAX_DATASET_UPLOAD_BYTES
+    """
+    # Refuses larger bodies before they are read
+    request.max_content_length = store.MAX_DATASET_UPLOAD_BYTES
+    data = formats.read_payload("data")
+    if data.get("data") is None:
+        return jsonify({"message": "data is required"}), 400
+    try:
+        dataset_id, created = store.save(data["data"], owner=api_keys.caller())
+    except (TypeError, ValueError) as e:
+        return jsonify({"message": str(e)}), 400
+    body = _describe(dataset_id, store.load(dataset_id))
+    return jsonify(body), 201 if created else 200, {"Location": f"/datasets/{dataset_id}"}
+
+
+@datasets_bp.route("/<dataset_id>", methods=["GET"])
+def get_dataset(dataset_id):
+    """
+    Dataset metadata
+    ---
+    tags: [Datasets]
+    security:
+      - bearerAuth: []
+    responses:
+      200:
+        description: Shape and size of the stored matrix
+      404:
+        description: Unknown dataset, or one uploaded by another client
+    """
+    store.check_owner(dataset_id, api_keys.caller())
+    return jsonify(_describe(dataset_id, store.load(dataset_id)))
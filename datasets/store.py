@@ -0,0 +1,214 @@
+import hashlib
+import os
+import re
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DATASET_DIR = os.getenv("DATASET_DIR", "/tmp/seas_datasets")
+MAX_DATASET_BYTES = int(os.getenv("MAX_DATASET_BYTES", 512 * 1024 * 1024))
+# Total size of DATASET_DIR; least recently used datasets are evicted beyond it
+DATASET_QUOTA_BYTES = int(os.getenv("DATASET_QUOTA_BYTES", 8 * 1024 * 1024 * 1024))
+# Largest upload body accepted (JSON text is several times the binary size)
+MAX_DATASET_UPLOAD_BYTES = int(os.getenv("MAX_DATASET_UPLOAD_BYTES", 2 * MAX_DATASET_BYTES))
+# Memory maps kept open per process
+DATASET_OPEN_MAX = int(os.getenv("DATASET_OPEN_MAX", 64))
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class DatasetNotFound(LookupError):
+    """Raised for an unknown or malformed dataset id; maps to HTTP 404."""
+
+
+def _path(dataset_id):
+    if not isinstance(dataset_id, str) or not _ID_PATTERN.match(dataset_id):
+        raise DatasetNotFound(f"unknown dataset_id: {dataset_id!r}")
+    return os.path.join(DATASET_DIR, dataset_id + ".npy")
+
+
+def _owners_path(dataset_id):
+    return os.path.join(DATASET_DIR, dataset_id + ".owners")
+
+
+def dataset_id_for(arr):
+    """
+    Content address of a float64 C-contiguous array: a hash of its shape and
+    bytes, so identical uploads from any client share one file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(struct.pack(f"<{arr.ndim + 1}q", arr.ndim, *arr.shape))
+    h.update(memoryview(arr).cast("B"))
+    return h.hexdigest()
+
+
+def save(data, owner=None):
+    """
+    Store a 1-D or 2-D numeric array as ``<id>.npy`` and return
+    ``(dataset_id, created)``. Writes go to a temporary file that is renamed
+    into place, so readers never see a partial dataset. ``owner`` (the
+    uploading client) is added to the dataset's owners; only they can use it.
+    Older datasets are evicted to keep DATASET_DIR under DATASET_QUOTA_BYTES.
+    """
+    arr = np.ascontiguousarray(data, dtype="<f8")
+    if arr.ndim not in (1, 2) or arr.size == 0:
+        raise ValueError("dataset must be a non-empty vector or (rows x columns) matrix")
+    if arr.nbytes > min(MAX_DATASET_BYTES, DATASET_QUOTA_BYTES):
+        raise ValueError(f"dataset exceeds {min(MAX_DATASET_BYTES, DATASET_QUOTA_BYTES)} bytes")
+    if not np.all(np.isfinite(arr)):
+        raise ValueError("dataset values must be finite")
+
+    dataset_id = dataset_id_for(arr)
+    path = _path(dataset_id)
+    if os.path.exists(path):
+        _add_owner(dataset_id, owner)
+        touch(dataset_id)
+        return dataset_id, False
+
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    _evict(arr.nbytes)
+    fd, tmp = tempfile.mkstemp(dir=DATASET_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, arr, allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+        _add_owner(dataset_id, owner)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return dataset_id, True
+
+
+def _add_owner(dataset_id, owner):
+    # One line per owner; O_APPEND writes this small are atomic
+    with open(_owners_path(dataset_id), "a", encoding="utf-8") as f:
+        f.write(f"{owner or ''}\n")
+
+
+def owners(dataset_id):
+    try:
+        with open(_owners_path(dataset_id), "r", encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f}
+    except FileNotFoundError:
+        return set()
+
+
+def touch(dataset_id):
+    """
+    Mark a dataset as used now; eviction removes the least recently used.
+    """
+    try:
+        os.utime(_path(dataset_id))
+    except OSError:
+        pass
+
+
+def _evict(incoming):
+    """
+    Remove least recently used datasets until ``incoming`` more bytes fit
+    in DATASET_QUOTA_BYTES. Processes already mapping a removed file keep
+    their mapping; new requests for it get DatasetNotFound.
+    """
+    entries = []
+    for name in os.listdir(DATASET_DIR):
+        if not name.endswith(".npy"):
+            continue
+        try:
+            st = os.stat(os.path.join(DATASET_DIR, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name[:-4]))
+    total = sum(size for _, size, _ in entries)
+    for _, size, dataset_id in sorted(entries):
+        if total + incoming <= DATASET_QUOTA_BYTES:
+            break
+        for path in (_path(dataset_id), _owners_path(dataset_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with _open_lock:
+            _open.pop(dataset_id, None)
+        total -= size
+
+
+_open = OrderedDict()
+_open_lock = threading.Lock()
+
+
+def load(dataset_id):
+    """
+    The dataset as a read-only memory map. Every process maps the same file,
+    so the data lives once in the page cache however many workers use it.
+    """
+    with _open_lock:
+        arr = _open.get(dataset_id)
+        if arr is not None:
+            _open.move_to_end(dataset_id)
+            return arr
+    try:
+        arr = np.load(_path(dataset_id), mmap_mode="r", allow_pickle=False)
+    except FileNotFoundError:
+        raise DatasetNotFound(f"unknown dataset_id: {dataset_id!r}")
+    with _open_lock:
+        _open[dataset_id] = arr
+        while len(_open) > DATASET_OPEN_MAX:
+            _open.popitem(last=False)
+    return arr
+
+
+class DatasetRef:
+    """
+    A picklable handle on a stored dataset. It pickles as just the id, so
+    handing it to a compute pool worker costs nothing; ``np.asarray(ref)``
+    maps the file in whichever process uses it.
+    """
+
+    __slots__ = ("dataset_id",)
+
+    def __init__(self, dataset_id):
+        _path(dataset_id)
+        self.dataset_id = dataset_id
+
+    def __getstate__(self):
+        return self.dataset_id
+
+    def __setstate__(self, state):
+        self.dataset_id = state
+
+    def __array__(self, dtype=None, copy=None):
+        arr = load(self.dataset_id)
+        return arr if dtype is None else arr.astype(dtype, copy=False)
+
+    @property
+    def shape(self):
+        return load(self.dataset_id).shape
+
+
+def check_owner(dataset_id, owner):
+    """
+    Raise DatasetNotFound unless ``dataset_id`` exists and ``owner`` uploaded
+    it (other clients cannot tell it apart from a missing dataset).
+    """
+    if not os.path.exists(_path(dataset_id)) or (owner or "") not in owners(dataset_id):
+        raise DatasetNotFound(f"unknown dataset_id: {dataset_id!r}")
+
+
+def resolve(payload, field, default=None, owner=None):
+    """
+    ``payload[field]`` if present, else a DatasetRef for ``payload["dataset_id"]``
+    (which must exist and belong to ``owner``), else ``default``.
+    """
+    value = payload.get(field)
+    if value is None and payload.get("dataset_id") is not None:
+        ref = DatasetRef(payload["dataset_id"])
+        check_owner(ref.dataset_id, owner)
+        touch(ref.dataset_id)
+        return ref
+    return default if value is None else value
@@ -0,0 +1,268 @@
+import math
+import os
+from statistics import NormalDist
+
+import numpy as np
+
+METHODS = ("historical", "parametric", "monte_carlo")
+# Largest Monte Carlo draw a request may ask for
+MAX_SCENARIOS = int(os.getenv("CVAR_MAX_SCENARIOS", 1_000_000))
+# Largest simulated (scenarios x portfolios) matrix of a batch request
+MAX_BATCH_SIMULATION_VALUES = int(os.getenv("CVAR_MAX_BATCH_SIMULATION_VALUES", 20_000_000))
+
+_STD_NORMAL = NormalDist()
+
+
+def _as_levels(confidence_level):
+    """
+    Normalise a scalar or list of confidence levels into a 1-D float array.
+    """
+    levels = np.atleast_1d(np.asarray(confidence_level, dtype=np.float64))
+    if levels.ndim != 1 or levels.size == 0:
+        raise ValueError("confidence_level must be a number or a non-empty list")
+    if np.any((levels <= 0) | (levels >= 1)):
+        raise ValueError("confidence_level values must lie strictly between 0 and 1")
+    return levels
+
+
+def _as_weights(weights):
+    w = np.asarray(weights, dtype=np.float64)
+    if w.ndim != 1 or w.size == 0:
+        raise ValueError("portfolio must be a non-empty list of weights")
+    return w
+
+
+def portfolio_returns(weights, returns):
+    """
+    Scenario returns of the portfolio, i.e. ``returns @ weights``.
+
+    ``returns`` is an (S x N) matrix of asset returns; float32 input is kept
+    as float32 so large matrices are not up-cast.
+    """
+    w = _as_weights(weights)
+    R = np.asarray(returns)
+    if R.dtype not in (np.float32, np.float64):
+        R = R.astype(np.float64)
+    if R.ndim != 2 or R.shape[1] != w.size:
+        raise ValueError(
+            f"returns must be a (scenarios x {w.size}) matrix, got shape {R.shape}"
+        )
+    if R.shape[0] == 0:
+        raise ValueError("returns must contain at least one scenario")
+    return R @ w.astype(R.dtype, copy=False)
+
+
+def historical_var_cvar(port_returns, confidence_level):
+    """
+    Historical VaR/CVaR of portfolio scenario returns.
+
+    ``port_returns`` is either a vector of S scenario returns or an (S x P)
+    matrix holding one column per portfolio. All confidence levels (and all
+    portfolios) are answered from a single ``np.partition`` call (partial
+    selection, O(S)) rather than a full sort. Results are expressed as
+    returns, so losses are negative, with shape (L,) or (L x P).
+    """
+    x = np.asarray(port_returns)
+    if x.ndim not in (1, 2):
+        raise ValueError("scenario returns must be a vector or a matrix")
+    levels = _as_levels(confidence_level)
+    n = x.shape[0]
+    if n == 0:
+        raise ValueError("at least one scenario is required")
+
+    # Number of tail scenarios for each level: ceil((1 - alpha) * S), >= 1
+    k = np.clip(np.ceil((1.0 - levels) * n - 1e-9).astype(np.intp), 1, n)
+    kth = np.unique(k - 1)
+    part = np.partition(x, kth, axis=0)
+
+    # Every element above each kth is no larger than it, so the prefix sum
+    # of the partitioned head gives each tail total directly.
+    head = np.cumsum(part[: k.max()], axis=0, dtype=np.float64)
+    var = part[k - 1].astype(np.float64)
+    cvar = head[k - 1] / (k if x.ndim == 1 else k[:, None])
+    return var, cvar
+
+
+def parametric_var_cvar(mu, sigma, confidence_level):
+    """
+    Gaussian VaR/CVaR for a portfolio with mean ``mu`` and volatility ``sigma``.
+
+    ``mu`` and ``sigma`` may also be length-P vectors, giving (L x P) results.
+    """
+    levels = _as_levels(confidence_level)
+    z = np.array([_STD_NORMAL.inv_cdf(a) for a in levels])
+    tail = np.exp(-0.5 * z * z) / math.sqrt(2.0 * math.pi) / (1.0 - levels)
+    mu = np.asarray(mu, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    if mu.ndim:
+        z, tail = z[:, None], tail[:, None]
+    var = mu - sigma * z
+    cvar = mu - sigma * tail
+    return var, cvar
+
+
+def _as_weight_matrix(weights):
+    W = np.asarray(weights, dtype=np.float64)
+    if W.ndim != 2 or W.size == 0:
+        raise ValueError("portfolios must be a non-empty (P x N) matrix of weights")
+    return W
+
+
+def batch_portfolio_returns(weights, returns):
+    """
+    Scenario returns of P portfolios at once from a single matrix product,
+    as an (S x P) matrix.
+    """
+    W = _as_weight_matrix(weights)
+    R = np.asarray(returns)
+    if R.dtype not in (np.float32, np.float64):
+        R = R.astype(np.float64)
+    if R.ndim != 2 or R.shape[1] != W.shape[1]:
+        raise ValueError(
+            f"returns must be a (scenarios x {W.shape[1]}) matrix, got shape {R.shape}"
+        )
+    if R.shape[0] == 0:
+        raise ValueError("returns must contain at least one scenario")
+    # Computed as (P x S) and returned transposed so each portfolio's scenarios
+    # are contiguous for the column-wise partition in historical_var_cvar.
+    return (W.astype(R.dtype, copy=False) @ R.T).T
+
+
+def portfolio_moments(weights, returns=None, mean=None, cov=None):
+    """
+    Mean and volatility of the portfolio, either from a scenario matrix or
+    from an explicit asset mean vector / covariance matrix.
+    """
+    if returns is not None:
+        pr = portfolio_returns(weights, returns)
+        sigma = float(pr.std(ddof=1)) if pr.size > 1 else 0.0
+        return float(pr.mean()), sigma
+
+    w = _as_weights(weights)
+    if mean is None or cov is None:
+        raise ValueError("either returns or both mean and cov are required")
+    mu = np.asarray(mean, dtype=np.float64)
+    sigma = np.asarray(cov, dtype=np.float64)
+    if mu.shape != w.shape or sigma.shape != (w.size, w.size):
+        raise ValueError("mean/cov dimensions do not match the portfolio")
+    variance = float(w @ sigma @ w)
+    if variance < 0:
+        raise ValueError("cov must be positive semi-definite")
+    return float(mu @ w), math.sqrt(variance)
+
+
+def monte_carlo_var_cvar(mu, sigma, confidence_level, n_scenarios=10000,
+                         dof=None, rng=None):
+    """
+    Monte Carlo VaR/CVaR under an elliptical (Gaussian or Student-t) model.
+
+    For a linear portfolio of elliptically distributed assets the portfolio
+    return is itself a location-scale draw, so only ``n_scenarios`` scalars
+    are simulated instead of an (S x N) matrix.
+    """
+    try:
+        n_scenarios = int(n_scenarios)
+    except (TypeError, ValueError):
+        raise ValueError("n_scenarios must be an integer") from None
+    if not 1 <= n_scenarios <= MAX_SCENARIOS:
+        raise ValueError(f"n_scenarios must be between 1 and {MAX_SCENARIOS}")
+    rng = rng if rng is not None else np.random.default_rng()
+
+    if dof is None:
+        shocks = rng.standard_normal(n_scenarios)
+    else:
+        try:
+            dof = float(dof)
+        except (TypeError, ValueError):
+            raise ValueError("dof must be a number") from None
+        if not dof > 2:
+            raise ValueError("dof must be greater than 2")
+        # Rescale so the shocks have unit variance
+        shocks = rng.standard_t(dof, n_scenarios) * math.sqrt((dof - 2.0) / dof)
+
+    mu = np.asarray(mu, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    if mu.ndim:
+        # Common random numbers: every portfolio sees the same shocks
+        shocks = shocks[:, None]
+    return historical_var_cvar(mu + sigma * shocks, confidence_level)
+
+
+def _rng(seed):
+    try:
+        return np.random.default_rng(seed)
+    except (TypeError, ValueError):
+        raise ValueError("seed must be a non-negative integer") from None
+
+
+def estimate(weights, returns=None, confidence_level=0.95, method="historical",
+             mean=None, cov=None, n_scenarios=10000, dof=None, seed=None):
+    """
+    Estimate VaR and CVaR for one portfolio.
+
+    Returns ``(var, cvar)`` as float arrays aligned with ``confidence_level``.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+
+    if method == "historical":
+        if returns is None:
+            raise ValueError("historical method requires a returns matrix")
+        return historical_var_cvar(portfolio_returns(weights, returns), confidence_level)
+
+    mu, sigma = portfolio_moments(weights, returns, mean, cov)
+    if method == "parametric":
+        return parametric_var_cvar(mu, sigma, confidence_level)
+
+    return monte_carlo_var_cvar(mu, sigma, confidence_level, n_scenarios, dof,
+                                _rng(seed))
+
+
+def estimate_batch(weights, returns=None, confidence_level=0.95, method="historical",
+                   mean=None, cov=None, n_scenarios=10000, dof=None, seed=None):
+    """
+    Estimate VaR and CVaR for P portfolios against one shared scenario set.
+
+    ``weights`` is a (P x N) matrix. Returns ``(var, cvar)`` as (P x L)
+    arrays, one row per portfolio.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+
+    if returns is not None:
+        pr = batch_portfolio_returns(weights, returns)
+        if method == "historical":
+            var, cvar = historical_var_cvar(pr, confidence_level)
+            return var.T, cvar.T
+        mu = pr.mean(axis=0, dtype=np.float64)
+        sigma = pr.std(axis=0, ddof=1, dtype=np.float64) if pr.shape[0] > 1 \
+            else np.zeros(pr.shape[1])
+    elif method == "historical":
+        raise ValueError("historical method requires a returns matrix")
+    else:
+        W = _as_weight_matrix(weights)
+        if mean is None or cov is None:
+            raise ValueError("either returns or both mean and cov are required")
+        m = np.asarray(mean, dtype=np.float64)
+        C = np.asarray(cov, dtype=np.float64)
+        if m.shape != (W.shape[1],) or C.shape != (W.shape[1], W.shape[1]):
+            raise ValueError("mean/cov dimensions do not match the portfolios")
+        mu = W @ m
+        variance = np.einsum("pi,ij,pj->p", W, C, W)
+        if np.any(variance < 0):
+            raise ValueError("cov must be positive semi-definite")
+        sigma = np.sqrt(variance)
+
+    if method == "parametric":
+        var, cvar = parametric_var_cvar(mu, sigma, confidence_level)
+    else:
+        try:
+            values = int(n_scenarios) * mu.size
+        except (TypeError, ValueError):
+            raise ValueError("n_scenarios must be an integer") from None
+        if values > MAX_BATCH_SIMULATION_VALUES:
+            raise ValueError("n_scenarios x portfolios must be at most "
+                             f"{MAX_BATCH_SIMULATION_VALUES}")
+        var, cvar = monte_carlo_var_cvar(mu, sigma, confidence_level, n_scenarios,
+                                         dof, _rng(seed))
+    return var.T, cvar.T
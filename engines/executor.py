@@ -0,0 +1,256 @@
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics.stages import stage
+from profiling import profiler
+
+# Modules imported once in the forkserver so every worker starts warm
+PRELOAD_MODULES = ("numpy", "scipy", "cvxpy",
+                   "engines.cvar", "engines.wasserstein",
+                   "engines.heavy_tail", "engines.kolmogorov")
+
+_CPUS = os.cpu_count() or 1
+# Every web worker (gunicorn sets WEB_CONCURRENCY) builds its own pools, so
+# each is sized for its share of the host: a host runs WEB_CONCURRENCY x
+# (share + 3 x max(1, share // 2)) compute processes, about 2.5 x CPUs, plus
+# one forkserver per web worker
+_WEB_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+_SHARE = max(1, _CPUS // _WEB_WORKERS)
+
+# family: (workers, max pending tasks, per-task timeout in seconds)
+DEFAULTS = {
+    "cvar":        (_SHARE,               4 * _SHARE, 10),
+    "wasserstein": (max(1, _SHARE // 2),  2 * _SHARE, 60),
+    "heavy_tail":  (max(1, _SHARE // 2),  2 * _SHARE, 60),
+    "kolmogorov":  (max(1, _SHARE // 2),  2 * _SHARE, 60),
+}
+
+# Extra time the caller waits beyond the in-worker deadline before giving up
+TIMEOUT_GRACE = 2.0
+
+
+class ComputeBusy(Exception):
+    """Raised when a family's queue is full; maps to HTTP 503."""
+
+
+class ComputeTimeout(Exception):
+    """Raised when a task exceeds its family's timeout; maps to HTTP 504."""
+
+
+def _family_setting(family, name, default, cast=int):
+    return cast(os.getenv(f"COMPUTE_{name}_{family.upper()}", default))
+
+
+def _deadline_exceeded(signum, frame):
+    raise ComputeTimeout("task exceeded its deadline")
+
+
+def _run_task(timeout, fn, args, kwargs):
+    """
+    Worker-side wrapper: arm an interval timer so a runaway task is
+    interrupted inside the worker, freeing the process for the next task.
+    """
+    if timeout:
+        signal.signal(signal.SIGALRM, _deadline_exceeded)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _noop():
+    return os.getpid()
+
+
+def _mp_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(list(PRELOAD_MODULES))
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+class ComputePool:
+    """
+    A process pool for one endpoint family with a bounded number of pending
+    (queued + running) tasks. With ``workers == 0`` tasks run inline in the
+    calling thread, which is useful for cheap families and for debugging.
+    """
+
+    def __init__(self, family, workers, max_pending, timeout):
+        self.family = family
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.stats = {"submitted": 0, "rejected": 0, "timed_out": 0}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=_mp_context())
+            return self._executor
+
+    def _reset_executor(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def acquire(self):
+        """
+        Take one of the family's ``max_pending`` slots for work that runs
+        outside the pool (a streamed response); raises ComputeBusy when none
+        is free. Give it back with release().
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise ComputeBusy(f"{self.family} compute queue is full")
+            self.pending += 1
+            self.stats["submitted"] += 1
+
+    def release(self, future=None):
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue ``fn(*args, **kwargs)`` on a worker and return its Future.
+        Raises ComputeBusy if the family already has ``max_pending`` tasks.
+        """
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self.acquire()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_task, self.timeout, fn, args, kwargs)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool and retry once
+            self._reset_executor(executor)
+            try:
+                future = self._get_executor().submit(_run_task, self.timeout, fn,
+                                                     args, kwargs)
+            except BaseException:
+                self.release()
+                raise
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def result(self, future):
+        """
+        Wait for a Future from this pool, cancelling it if it is still queued
+        when the timeout passes.
+        """
+        wait = self.timeout + TIMEOUT_GRACE if self.timeout else None
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeout:
+            future.cancel()
+            self.stats["timed_out"] += 1
+            raise ComputeTimeout(f"{self.family} task exceeded {self.timeout}s")
+
+    def run(self, fn, *args, **kwargs):
+        with stage("compute"):
+            session = profiler.current()
+            if session is not None and self.workers > 0:
+                # A profiled request: profile the task inside the worker too
+                return session.run_remote(self, fn, args, kwargs)
+            return self.result(self.submit(fn, *args, **kwargs))
+
+    def profiled(self):
+        """
+        This pool, or, while the request is being profiled, a view of it
+        whose tasks are profiled inside the worker as ``run`` does. For
+        callers that ``submit`` tasks and collect them with ``result``.
+        """
+        session = profiler.current()
+        if session is None or self.workers <= 0:
+            return self
+        return session.remote_pool(self)
+
+    def start(self):
+        """
+        Fork every worker up front so the first requests don't pay for it.
+        """
+        if self.workers > 0:
+            executor = self._get_executor()
+            for future in [executor.submit(_noop) for _ in range(self.workers)]:
+                future.result()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool(family):
+    """
+    The shared ComputePool for ``family``, sized from COMPUTE_WORKERS_<FAMILY>,
+    COMPUTE_QUEUE_<FAMILY> and COMPUTE_TIMEOUT_<FAMILY>.
+    """
+    with _pools_lock:
+        if family not in _pools:
+            workers, max_pending, timeout = DEFAULTS.get(family, (1, 2 * _SHARE, 60))
+            _pools[family] = ComputePool(
+                family,
+                _family_setting(family, "WORKERS", workers),
+                _family_setting(family, "QUEUE", max_pending),
+                _family_setting(family, "TIMEOUT", timeout, float),
+            )
+        return _pools[family]
+
+
+def pools():
+    """
+    The pools created so far, by family.
+    """
+    with _pools_lock:
+        return dict(_pools)
+
+
+def submit(family, fn, *args, **kwargs):
+    return pool(family).submit(fn, *args, **kwargs)
+
+
+def run(family, fn, *args, **kwargs):
+    """
+    Run ``fn`` on the family's pool and block until it returns.
+    """
+    return pool(family).run(fn, *args, **kwargs)
+
+
+def start(families=None):
+    for family in families or DEFAULTS:
+        pool(family).start()
+
+
+def shutdown(wait=True):
+    with _pools_lock:
+        pools = list(_pools.values())
+    for p in pools:
+        p.shutdown(wait)
@@ -0,0 +1,142 @@
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Upper bound on the working memory of one simulated block of paths
+BLOCK_BYTES = int(os.getenv("HEAVY_TAIL_BLOCK_BYTES", 64 * 1024 * 1024))
+# Blocks simulated concurrently; NumPy releases the GIL for the bulk fills
+THREADS = int(os.getenv("HEAVY_TAIL_THREADS", os.cpu_count() or 1))
+
+
+def _validate(n_paths, periods, shock_magnitude, dof, alpha, beta,
+              base_volatility, jump_intensity):
+    if n_paths < 1:
+        raise ValueError("n_paths must be positive")
+    if periods < 1:
+        raise ValueError("periods must be positive")
+    if shock_magnitude < 0:
+        raise ValueError("shock_magnitude must be non-negative")
+    if dof <= 2:
+        raise ValueError("dof must be greater than 2")
+    if alpha < 0 or beta < 0 or alpha + beta >= 1:
+        raise ValueError("GARCH parameters need alpha, beta >= 0 and alpha + beta < 1")
+    if base_volatility <= 0:
+        raise ValueError("base_volatility must be positive")
+    if jump_intensity < 0:
+        raise ValueError("jump_intensity must be non-negative")
+
+
+def _simulate_block(rng, n_paths, periods, shock_magnitude, dof, alpha, beta,
+                    base_volatility, jump_intensity):
+    """
+    Simulate one (periods x n_paths) block, time-major so every step of the
+    GARCH recursion works on a contiguous row.
+    """
+    # Student-t innovations rescaled to unit variance, filled in place below
+    out = rng.standard_t(dof, size=(periods, n_paths))
+    out *= math.sqrt((dof - 2.0) / dof)
+
+    long_run = base_volatility ** 2
+    omega = long_run * (1.0 - alpha - beta)
+    h = np.full(n_paths, long_run)
+    sq = np.empty(n_paths)
+    for t in range(periods):
+        row = out[t]
+        np.sqrt(h, out=sq)
+        row *= sq
+        # h <- omega + alpha * eps^2 + beta * h
+        np.multiply(row, row, out=sq)
+        h *= beta
+        sq *= alpha
+        h += sq
+        h += omega
+
+    # Compound Poisson jumps: given the total count the jump times are uniform
+    # over the block, so only the jumps themselves are ever materialised.
+    if jump_intensity > 0 and shock_magnitude > 0:
+        n_jumps = rng.poisson(jump_intensity * out.size)
+        if n_jumps:
+            where = rng.integers(0, out.size, n_jumps)
+            sizes = rng.standard_normal(n_jumps) * (shock_magnitude * base_volatility)
+            np.add.at(out.reshape(-1), where, sizes)
+
+    return out
+
+
+def simulate_blocks(n_paths, periods, shock_magnitude=1.0, dof=5.0, alpha=0.08,
+                    beta=0.9, base_volatility=0.01, jump_intensity=0.01,
+                    rng=None, block_paths=None, dtype=np.float64, threads=None):
+    """
+    Yield simulated return paths as successive (block x periods) arrays.
+
+    Returns follow a GARCH(1,1) process driven by Student-t innovations, with
+    Poisson-arriving Gaussian jumps whose scale is ``shock_magnitude`` times
+    ``base_volatility`` (the unconditional per-period volatility). Blocks are
+    sized to stay under ``BLOCK_BYTES`` unless ``block_paths`` is given, so
+    memory is bounded whatever the total number of paths. ``threads``
+    (default HEAVY_TAIL_THREADS) blocks are simulated concurrently.
+    """
+    n_paths, periods = int(n_paths), int(periods)
+    shock_magnitude, dof = float(shock_magnitude), float(dof)
+    alpha, beta = float(alpha), float(beta)
+    base_volatility, jump_intensity = float(base_volatility), float(jump_intensity)
+    _validate(n_paths, periods, shock_magnitude, dof, alpha, beta,
+              base_volatility, jump_intensity)
+
+    rng = rng if rng is not None else np.random.default_rng()
+    if block_paths is None:
+        block_paths = max(1, BLOCK_BYTES // (periods * 8))
+    return _blocks(rng, n_paths, periods, shock_magnitude, dof, alpha, beta,
+                   base_volatility, jump_intensity, int(block_paths), dtype,
+                   THREADS if threads is None else max(1, int(threads)))
+
+
+def _blocks(rng, n_paths, periods, shock_magnitude, dof, alpha, beta,
+            base_volatility, jump_intensity, block_paths, dtype, threads):
+    starts = range(0, n_paths, block_paths)
+    # One child generator per block keeps the output identical whatever the
+    # number of threads used to produce it.
+    children = rng.spawn(len(starts))
+
+    def run(i):
+        size = min(block_paths, n_paths - starts[i])
+        block = _simulate_block(children[i], size, periods, shock_magnitude, dof,
+                                alpha, beta, base_volatility, jump_intensity)
+        return np.ascontiguousarray(block.T, dtype=dtype)
+
+    if threads <= 1 or len(starts) == 1:
+        for i in range(len(starts)):
+            yield run(i)
+        return
+
+    # At most ``threads`` blocks are in flight, which keeps memory bounded
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        in_flight = deque()
+        try:
+            for i in range(len(starts)):
+                in_flight.append(pool.submit(run, i))
+                if len(in_flight) >= threads:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+def simulate(n_paths, periods, shock_magnitude=1.0, seed=None, **kwargs):
+    """
+    Simulate ``n_paths`` heavy-tailed return paths as one (n_paths x periods)
+    array. ``seed`` (or an explicit ``rng``) makes the result reproducible.
+    """
+    rng = kwargs.pop("rng", None) or np.random.default_rng(seed)
+    dtype = kwargs.get("dtype", np.float64)
+    out = np.empty((int(n_paths), int(periods)), dtype=dtype)
+    row = 0
+    for block in simulate_blocks(n_paths, periods, shock_magnitude, rng=rng, **kwargs):
+        out[row:row + block.shape[0]] = block
+        row += block.shape[0]
+    return out
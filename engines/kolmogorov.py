@@ -0,0 +1,225 @@
+import bz2
+import lzma
+import math
+import os
+import zlib
+
+import numpy as np
+
+COMPRESSORS = {
+    "zlib": lambda b: zlib.compress(b, 9),
+    "lzma": lambda b: lzma.compress(b, preset=6),
+    "bz2": lambda b: bz2.compress(b, 9),
+}
+
+# Deflate cannot reference data further back than this
+_ZLIB_WINDOW = 32768
+
+# Longest series lempel_ziv() accepts; its parse is a Python-level loop
+# (about 0.4s per million symbols)
+LZ_MAX_SYMBOLS = int(os.getenv("KOLMOGOROV_LZ_MAX_SYMBOLS", 2_000_000))
+
+
+def _integer(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer") from None
+
+
+def symbolise(data, n_symbols=8):
+    """
+    Quantise a numeric series into ``n_symbols`` equiprobable (quantile) bins
+    and return the bin indices as a uint8 array.
+    """
+    x = np.asarray(data, dtype=np.float64).ravel()
+    if x.size < 2:
+        raise ValueError("data must contain at least two values")
+    if not np.all(np.isfinite(x)):
+        raise ValueError("data must be finite")
+    n_symbols = int(n_symbols)
+    if not 2 <= n_symbols <= 256:
+        raise ValueError("n_symbols must be between 2 and 256")
+
+    edges = np.quantile(x, np.linspace(0, 1, n_symbols + 1)[1:-1])
+    return np.searchsorted(edges, x, side="right").astype(np.uint8)
+
+
+def compression_ratios(symbols, n_symbols):
+    """
+    Compressed size of the symbol stream for each compressor, in bits per
+    symbol relative to the log2(n_symbols) bits an incompressible stream needs.
+    """
+    raw = np.ascontiguousarray(symbols, dtype=np.uint8).tobytes()
+    ideal_bits = len(raw) * math.log2(n_symbols)
+    return {name: 8 * len(fn(raw)) / ideal_bits for name, fn in COMPRESSORS.items()}
+
+
+def lempel_ziv(symbols, n_symbols):
+    """
+    LZ78 phrase count of the symbol stream and its normalised form
+    c * log_k(n) / n, which tends to the entropy rate (1 for white noise).
+    Phrases are nodes of a trie keyed by (parent node, symbol), so each
+    symbol costs one dict lookup whatever the phrase length.
+    """
+    n = len(symbols)
+    if n > LZ_MAX_SYMBOLS:
+        raise ValueError(f"data must have at most {LZ_MAX_SYMBOLS} values")
+    trie = {}
+    node = 0
+    for byte in np.ascontiguousarray(symbols, dtype=np.uint8).tobytes():
+        key = node << 8 | byte
+        child = trie.get(key)
+        if child is None:
+            trie[key] = len(trie) + 1
+            node = 0
+        else:
+            node = child
+    count = len(trie) + (1 if node else 0)
+    return count, count * math.log(n, n_symbols) / n
+
+
+def _block_codes(symbols, n_symbols, block_length):
+    """
+    Dense integer ids for every overlapping block of ``block_length`` symbols.
+    """
+    n = symbols.size - block_length + 1
+    if n < 1:
+        raise ValueError("data is shorter than block_length")
+    if block_length * math.log2(n_symbols) > 62:
+        raise ValueError("block_length too large for n_symbols")
+    codes = np.zeros(n, dtype=np.int64)
+    for j in range(block_length):
+        codes *= n_symbols
+        codes += symbols[j:j + n]
+    return np.unique(codes, return_inverse=True)[1].ravel()
+
+
+def block_entropy(symbols, n_symbols, block_length=3):
+    """
+    Shannon entropy (bits) of overlapping blocks of ``block_length`` symbols,
+    and the entropy rate per symbol normalised to [0, 1].
+    """
+    if block_length < 1:
+        raise ValueError("block_length must be positive")
+    counts = np.bincount(_block_codes(symbols, n_symbols, block_length))
+    p = counts[counts > 0] / counts.sum()
+    h = float(-(p * np.log2(p)).sum())
+    return h, h / (block_length * math.log2(n_symbols))
+
+
+def explore(data, n_symbols=8, block_length=3):
+    """
+    Complexity profile of a series: compression ratios, LZ complexity and
+    block entropy of its quantile-symbolised form.
+    """
+    n_symbols = _integer(n_symbols, "n_symbols")
+    block_length = _integer(block_length, "block_length")
+    symbols = symbolise(data, n_symbols)
+    phrases, lz = lempel_ziv(symbols, n_symbols)
+    h, rate = block_entropy(symbols, n_symbols, block_length)
+    return {
+        "complexity_score": round(min(lz, 1.0), 4),
+        "n_symbols": int(n_symbols),
+        "compression": compression_ratios(symbols, n_symbols),
+        "lempel_ziv": {"phrases": phrases, "normalised": lz},
+        "block_entropy": {"block_length": int(block_length), "entropy_bits": h,
+                          "entropy_rate": rate},
+    }
+
+
+# -----------------------------------------------------------------------------
+# Rolling windows
+# -----------------------------------------------------------------------------
+
+def _xlogx(c):
+    c = c.astype(np.float64)
+    return np.where(c > 0, c * np.log(np.maximum(c, 1)), 0.0)
+
+
+def rolling_block_entropy(symbols, n_symbols, window, step, block_length=3):
+    """
+    Normalised block-entropy rate of each window, kept up to date by adding
+    and removing only the blocks that enter and leave as the window slides.
+    Total work is O(n) regardless of the window length.
+    """
+    ids = _block_codes(symbols, n_symbols, block_length)
+    per_window = window - block_length + 1
+    counts = np.bincount(ids[:per_window], minlength=ids.max() + 1)
+    s = float(_xlogx(counts).sum())
+    norm = block_length * math.log2(n_symbols) * math.log(2)
+
+    rates = [(math.log(per_window) - s / per_window) / norm]
+    for start in range(step, symbols.size - window + 1, step):
+        leaving = ids[start - step:start]
+        entering = ids[start - step + per_window:start + per_window]
+        touched = np.unique(np.concatenate((leaving, entering)))
+        s -= _xlogx(counts[touched]).sum()
+        np.subtract.at(counts, leaving, 1)
+        np.add.at(counts, entering, 1)
+        s += _xlogx(counts[touched]).sum()
+        rates.append((math.log(per_window) - s / per_window) / norm)
+    return np.array(rates)
+
+
+def rolling_zlib(symbols, n_symbols, window, step):
+    """
+    Approximate zlib ratio of each window. The series is cut into ``step``
+    sized chunks, each compressed once with the preceding chunk as a preset
+    dictionary; a window's size is then a sliding sum of its chunks' sizes,
+    so every byte is compressed a bounded number of times.
+    """
+    raw = np.ascontiguousarray(symbols, dtype=np.uint8).tobytes()
+    n_chunks = len(raw) // step
+    sizes = np.empty(n_chunks, dtype=np.int64)
+    previous = b""
+    for i in range(n_chunks):
+        chunk = raw[i * step:(i + 1) * step]
+        if previous:
+            comp = zlib.compressobj(9, zlib.DEFLATED, -15,
+                                    zdict=previous[-_ZLIB_WINDOW:])
+        else:
+            comp = zlib.compressobj(9, zlib.DEFLATED, -15)
+        sizes[i] = len(comp.compress(chunk)) + len(comp.flush())
+        previous = chunk
+
+    per_window = window // step
+    totals = np.concatenate(([0], np.cumsum(sizes)))
+    window_bytes = totals[per_window:] - totals[:-per_window]
+    return 8 * window_bytes / (window * math.log2(n_symbols))
+
+
+def explore_rolling(data, window, step=None, n_symbols=8, block_length=3):
+    """
+    Rolling complexity over windows of ``window`` points advancing by ``step``
+    (which must divide ``window``). Symbols are assigned once over the whole
+    series so windows are comparable. Only zlib ratios and block-entropy
+    rates are reported per window: LZ phrase counts and the lzma and bz2
+    ratios cannot be updated as the window slides.
+    """
+    window = _integer(window, "window")
+    n_symbols = _integer(n_symbols, "n_symbols")
+    block_length = _integer(block_length, "block_length")
+    if window < 1:
+        raise ValueError("window must be positive")
+    if step is None:
+        # Largest divisor of the window that is at most a tenth of it
+        step = next(d for d in range(max(1, window // 10), 0, -1) if window % d == 0)
+    step = _integer(step, "step")
+    symbols = symbolise(data, n_symbols)
+    if step < 1 or window % step:
+        raise ValueError("step must be a positive divisor of window")
+    if block_length < 1:
+        raise ValueError("block_length must be positive")
+    if not block_length <= window <= symbols.size:
+        raise ValueError("window must be between block_length and the series length")
+
+    entropy = rolling_block_entropy(symbols, n_symbols, window, step, block_length)
+    ratios = rolling_zlib(symbols, n_symbols, window, step)
+    return {
+        "window": window,
+        "step": step,
+        "starts": np.arange(0, step * entropy.size, step),
+        "zlib": ratios[:entropy.size],
+        "block_entropy_rate": entropy,
+    }
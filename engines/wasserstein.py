@@ -0,0 +1,292 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from functools import lru_cache
+
+import numpy as np
+
+from engines import cvar as cvar_engine
+from engines.executor import ComputeBusy
+
+PROBLEM_CACHE_SIZE = int(os.getenv("WASSERSTEIN_PROBLEM_CACHE_SIZE", 32))
+WARM_START_CACHE_SIZE = int(os.getenv("WASSERSTEIN_WARM_START_CACHE_SIZE", 1024))
+MAX_FRONTIER_POINTS = int(os.getenv("WASSERSTEIN_MAX_FRONTIER_POINTS", 500))
+
+
+class SolverFailed(RuntimeError):
+    """Raised when the solver ends without an optimal solution; maps to HTTP 422."""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+    def __str__(self):
+        return f"Wasserstein optimisation failed: {self.status}"
+
+
+class _CompiledProblem:
+    """
+    A parametrised mean-CVaR Wasserstein DRO problem for one (n_assets,
+    n_samples) shape. Only parameter values change between solves, so cvxpy
+    canonicalises it once and reuses the compiled form afterwards.
+    """
+
+    def __init__(self, n_assets, n_samples):
+        # cvxpy takes seconds to import; web workers that only validate and
+        # hand off to the compute pool never need it
+        import cvxpy as cp
+
+        self.returns = cp.Parameter((n_samples, n_assets), name="returns")
+        self.mean = cp.Parameter(n_assets, name="mean")
+        self.risk_aversion = cp.Parameter(nonneg=True, name="risk_aversion")
+        self.tail_weight = cp.Parameter(nonneg=True, name="tail_weight")
+        self.robust_weight = cp.Parameter(nonneg=True, name="robust_weight")
+
+        self.weights = cp.Variable(n_assets, name="weights")
+        self.var = cp.Variable(name="var")
+        self.excess = cp.Variable(n_samples, nonneg=True, name="excess")
+
+        # Rockafellar-Uryasev CVaR of the loss -R w, plus the dual-norm penalty
+        # that a type-1 Wasserstein ball of the given radius adds to it.
+        objective = cp.Minimize(
+            -self.mean @ self.weights
+            + self.risk_aversion * self.var
+            + self.tail_weight * cp.sum(self.excess)
+            + self.robust_weight * cp.norm(self.weights, 2)
+        )
+        constraints = [
+            self.excess >= -self.returns @ self.weights - self.var,
+            cp.sum(self.weights) == 1,
+            self.weights >= 0,
+        ]
+        self.problem = cp.Problem(objective, constraints)
+        self.optimal = (cp.OPTIMAL, cp.OPTIMAL_INACCURATE)
+        self.solver_error = cp.SolverError
+        self.lock = threading.Lock()
+
+    def solve(self, returns, radius, risk_aversion, confidence_level, warm=None,
+              **solver_opts):
+        n_samples = returns.shape[0]
+        tail = 1.0 - confidence_level
+
+        self.returns.value = returns
+        self.mean.value = returns.mean(axis=0)
+        self.risk_aversion.value = risk_aversion
+        self.tail_weight.value = risk_aversion / (tail * n_samples)
+        self.robust_weight.value = radius * (1.0 + risk_aversion / tail)
+
+        if warm is not None:
+            self.weights.value, self.var.value, self.excess.value = warm
+
+        try:
+            self.problem.solve(warm_start=True, **solver_opts)
+        except self.solver_error:
+            # The solver itself gave up (numerical trouble, iteration limit)
+            raise SolverFailed(self.problem.status or "solver_error") from None
+        if self.problem.status not in self.optimal:
+            raise SolverFailed(self.problem.status)
+
+        state = (self.weights.value.copy(), self.var.value.copy(),
+                 self.excess.value.copy())
+        return state, float(self.problem.value)
+
+
+@lru_cache(maxsize=PROBLEM_CACHE_SIZE)
+def get_problem(n_assets, n_samples):
+    """
+    Build (once per shape) the parametrised DRO problem.
+    """
+    return _CompiledProblem(n_assets, n_samples)
+
+
+# Last solution per (client, shape), used to warm-start that client's next solve
+_warm_starts = OrderedDict()
+_warm_lock = threading.Lock()
+
+
+def _get_warm_start(key):
+    with _warm_lock:
+        state = _warm_starts.get(key)
+        if state is not None:
+            _warm_starts.move_to_end(key)
+        return state
+
+
+def _set_warm_start(key, state):
+    with _warm_lock:
+        _warm_starts[key] = state
+        _warm_starts.move_to_end(key)
+        while len(_warm_starts) > WARM_START_CACHE_SIZE:
+            _warm_starts.popitem(last=False)
+
+
+def _number(value, name):
+    """
+    ``value`` as a finite float; ValueError (not TypeError) for anything else
+    so callers can report it as a bad request.
+    """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number") from None
+    if not np.isfinite(number):
+        raise ValueError(f"{name} must be finite")
+    return number
+
+
+def _validate(returns, radius, risk_aversion, confidence_level):
+    R = np.asarray(returns, dtype=np.float64)
+    if R.ndim != 2 or R.shape[0] < 1 or R.shape[1] < 1:
+        raise ValueError("returns must be a non-empty (samples x assets) matrix")
+    if not np.all(np.isfinite(R)):
+        raise ValueError("returns must be finite")
+    if radius < 0:
+        raise ValueError("wasserstein_radius must be non-negative")
+    if risk_aversion < 0:
+        raise ValueError("risk_aversion must be non-negative")
+    if not 0 < confidence_level < 1:
+        raise ValueError("confidence_level must lie strictly between 0 and 1")
+    return R
+
+
+def _shippable(returns, R):
+    # Array-likes that map their data on demand (stored datasets) are sent to
+    # pool workers as the handle rather than as a pickled copy of the matrix
+    if hasattr(returns, "__array__") and not isinstance(returns, np.ndarray):
+        return returns
+    return R
+
+
+def _solve(returns, radius, risk_aversion, confidence_level, warm, **solver_opts):
+    """
+    Solve one problem instance with this process's cached compiled problem.
+    Module-level so it can be shipped to a compute pool worker.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    compiled = get_problem(returns.shape[1], returns.shape[0])
+    with compiled.lock:
+        return compiled.solve(returns, radius, risk_aversion, confidence_level,
+                              warm, **solver_opts)
+
+
+def optimize(returns, radius=0.1, risk_aversion=0.5, confidence_level=0.95,
+             client_id=None, run=None, **solver_opts):
+    """
+    Long-only mean-CVaR portfolio that is robust to every return distribution
+    within ``radius`` (type-1 Wasserstein, Euclidean cost) of the empirical
+    scenarios in ``returns``.
+
+    Returns ``(weights, objective)``. When ``client_id`` is given the solve is
+    warm-started from that client's previous solution for the same shape.
+    ``run(fn, *args, **kwargs)`` executes the solve, e.g. on a compute pool;
+    by default it runs in the calling thread.
+    """
+    radius = _number(radius, "wasserstein_radius")
+    risk_aversion = _number(risk_aversion, "risk_aversion")
+    confidence_level = _number(confidence_level, "confidence_level")
+    R = _validate(returns, radius, risk_aversion, confidence_level)
+    n_samples, n_assets = R.shape
+
+    warm_key = (client_id, n_assets, n_samples) if client_id is not None else None
+    warm = _get_warm_start(warm_key) if warm_key is not None else None
+
+    run = run or (lambda fn, *args, **kwargs: fn(*args, **kwargs))
+    state, objective = run(_solve, _shippable(returns, R), radius, risk_aversion,
+                           confidence_level, warm, **solver_opts)
+
+    if warm_key is not None:
+        _set_warm_start(warm_key, state)
+
+    weights = np.clip(state[0], 0.0, None)
+    return weights / weights.sum(), objective
+
+
+# -----------------------------------------------------------------------------
+# Radius / risk-aversion frontier
+# -----------------------------------------------------------------------------
+
+def _frontier_point(returns, radius, risk_aversion, confidence_level, state, objective):
+    weights = np.clip(state[0], 0.0, None)
+    weights /= weights.sum()
+    port = returns @ weights
+    _, tail = cvar_engine.historical_var_cvar(port, confidence_level)
+    return {
+        "wasserstein_radius": radius,
+        "risk_aversion": risk_aversion,
+        "weights": weights.round(6).tolist(),
+        "objective": objective,
+        "expected_return": float(port.mean()),
+        "cvar": float(tail[0]),
+    }
+
+
+def frontier(returns, radii, risk_aversions, confidence_level=0.95, pool=None):
+    """
+    Solve the optimiser over every (risk_aversion, radius) combination and
+    yield each frontier point as soon as it is solved.
+
+    Each risk-aversion value is one chain that walks the radii in ascending
+    order, warm-starting every solve from its neighbour's solution. Chains
+    are independent, so with a ``pool`` (anything with a ``submit`` returning
+    a Future, e.g. a compute pool) they run in parallel.
+    """
+    if np.ndim(radii) != 1 or np.ndim(risk_aversions) != 1:
+        raise ValueError("radii and risk_aversion must be non-empty lists")
+    radii = sorted(_number(x, "radii") for x in radii)
+    risk_aversions = [_number(x, "risk_aversion") for x in risk_aversions]
+    confidence_level = _number(confidence_level, "confidence_level")
+    if not radii or not risk_aversions:
+        raise ValueError("radii and risk_aversion must be non-empty lists")
+    if len(radii) * len(risk_aversions) > MAX_FRONTIER_POINTS:
+        raise ValueError(f"frontier is limited to {MAX_FRONTIER_POINTS} points")
+    R = _validate(returns, radii[0], min(risk_aversions), confidence_level)
+    return _frontier_points(R, _shippable(returns, R), radii, risk_aversions,
+                            confidence_level, pool)
+
+
+def _submit_inline(fn, *args):
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+def _frontier_points(R, task_returns, radii, risk_aversions, confidence_level, pool):
+    submit_task = pool.submit if pool is not None else _submit_inline
+    # Enough chains in flight to keep the pool's workers busy; the rest wait
+    # here rather than filling the family's queue
+    in_flight = max(1, getattr(pool, "workers", 0) or len(risk_aversions))
+    ready = deque((chain, 0, None) for chain in range(len(risk_aversions)))
+    pending = {}
+
+    def fill():
+        while ready and len(pending) < in_flight:
+            chain, step, warm = ready[0]
+            try:
+                future = submit_task(_solve, task_returns, radii[step], risk_aversions[chain],
+                                     confidence_level, warm)
+            except ComputeBusy:
+                # Other requests hold the rest of the queue: carry on with the
+                # chains already running, or give up if none are
+                if not pending:
+                    raise
+                return
+            ready.popleft()
+            pending[future] = (chain, step)
+
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chain, step = pending.pop(future)
+                state, objective = (pool.result(future) if hasattr(pool, "result")
+                                    else future.result())
+                if step + 1 < len(radii):
+                    ready.append((chain, step + 1, state))
+                yield _frontier_point(R, radii[step], risk_aversions[chain],
+                                      confidence_level, state, objective)
+            fill()
+    finally:
+        for future in pending:
+            future.cancel()
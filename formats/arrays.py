@@ -0,0 +1,275 @@
+import io
+import json
+from importlib.util import find_spec
+
+import numpy as np
+from flask import abort, current_app, g, request
+from werkzeug.exceptions import HTTPException
+
+from metrics.stages import stage
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback below
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# pyarrow is large; only check that it is installed here and import it on use
+HAVE_ARROW = find_spec("pyarrow") is not None
+
+JSON = "application/json"
+NPY = "application/x-npy"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+
+# Request / response formats this server can handle, JSON first so it stays
+# the default for Accept: */*
+FORMATS = tuple(m for m, available in ((JSON, True), (NPY, True), (ARROW, HAVE_ARROW),
+                                       (MSGPACK, msgpack is not None)) if available)
+
+# Only plain numeric buffers are accepted from clients (no object / pickle)
+_NUMERIC_KINDS = "biuf"
+
+
+# -----------------------------------------------------------------------------
+# JSON (fallback) with ndarray support
+# -----------------------------------------------------------------------------
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serialisable")
+
+
+def dumps(value):
+    """
+    Serialise to JSON bytes. ndarrays are written straight from their
+    buffers when orjson is installed, and via ``tolist`` otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_json_default).encode()
+
+
+def _loads_json(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+# -----------------------------------------------------------------------------
+# Decoders: request body -> dict of fields (arrays as read-only ndarrays that
+# share the body's buffer)
+# -----------------------------------------------------------------------------
+
+def _checked(arr):
+    if arr.dtype.kind not in _NUMERIC_KINDS:
+        raise ValueError(f"unsupported array dtype {arr.dtype}")
+    return arr
+
+
+def _query_params():
+    """
+    Scalar parameters sent alongside a binary body, e.g.
+    ``?confidence_level=0.95&method=parametric``. Values are read as JSON
+    where possible so numbers and lists keep their types.
+    """
+    params = {}
+    for key, value in request.args.items():
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def _decode_npy(body, array_field):
+    fp = io.BytesIO(body)
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+        shape, fortran, dtype = np.lib.format.read_array_header_2_0(fp)
+    if dtype.hasobject:
+        raise ValueError("object arrays are not accepted")
+    count = int(np.prod(shape))
+    arr = np.frombuffer(body, dtype=dtype, count=count, offset=fp.tell())
+    arr = _checked(arr.reshape(shape, order="F" if fortran else "C"))
+    return {request.args.get("field", array_field): arr}
+
+
+def _decode_arrow(body):
+    import pyarrow as pa
+
+    table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    payload = {}
+    metadata = table.schema.metadata or {}
+    if b"params" in metadata:
+        payload.update(json.loads(metadata[b"params"]))
+    for name in table.column_names:
+        column = table.column(name).combine_chunks()
+        if pa.types.is_fixed_size_list(column.type):
+            # One row per scenario, list_size values per row: an (S x N) matrix
+            values = column.flatten().to_numpy(zero_copy_only=True)
+            payload[name] = _checked(values.reshape(len(column), column.type.list_size))
+        else:
+            payload[name] = _checked(column.to_numpy(zero_copy_only=True))
+    return payload
+
+
+def _msgpack_array(obj):
+    # Same layout as msgpack-numpy: {"nd": True, "type", "shape", "data"}
+    if obj.get("nd") is True and "data" in obj:
+        dtype = np.dtype(obj["type"])
+        return _checked(np.frombuffer(obj["data"], dtype=dtype).reshape(obj["shape"]))
+    return obj
+
+
+def _decode_msgpack(body):
+    return msgpack.unpackb(body, raw=False, object_hook=_msgpack_array)
+
+
+def read_payload(array_field=None):
+    """
+    The request's fields as a dict, decoded according to its Content-Type
+    and parsed once per request. Binary formats carry arrays as raw buffers:
+
+    * application/x-npy: one array, stored under ``?field=`` (default
+      ``array_field``); other parameters go in the query string.
+    * application/vnd.apache.arrow.stream: one column per array field, with
+      matrices as fixed-size-list columns; small parameters as JSON in the
+      ``params`` schema metadata or the query string.
+    * application/msgpack: a map whose arrays use the msgpack-numpy layout.
+
+    Anything else is parsed as JSON.
+    """
+    if "payload" in g:
+        return g.payload
+    mimetype = request.mimetype
+    try:
+        with stage("parse"):
+            body = request.get_data(cache=True)
+            if mimetype == NPY:
+                payload = {**_query_params(), **_decode_npy(body, array_field)}
+            elif mimetype == ARROW and HAVE_ARROW:
+                payload = {**_query_params(), **_decode_arrow(body)}
+            elif mimetype == MSGPACK and msgpack is not None:
+                payload = {**_query_params(), **_decode_msgpack(body)}
+            else:
+                payload = _loads_json(body)
+    except HTTPException:
+        raise  # e.g. 413 from a max_content_length
+    except Exception as e:
+        abort(400, f"could not decode {mimetype or 'request'} body: {e}")
+    if not isinstance(payload, dict):
+        abort(400, "request body must be an object")
+    g.payload = payload
+    return payload
+
+
+# -----------------------------------------------------------------------------
+# Encoders: result dict -> response body
+# -----------------------------------------------------------------------------
+
+def _little_endian(arr):
+    arr = np.ascontiguousarray(arr)
+    return arr.astype(arr.dtype.newbyteorder("<"), copy=False)
+
+
+def _split(result):
+    arrays = {k: v for k, v in result.items() if isinstance(v, np.ndarray)}
+    meta = {k: v for k, v in result.items() if k not in arrays}
+    return arrays, meta
+
+
+def _encode_npy(result):
+    """
+    A single array is sent as is; several arrays of one shape are stacked
+    along a new first axis, named in X-Array-Fields. Everything else goes
+    in the X-Result-Meta JSON header.
+    """
+    arrays, meta = _split(result)
+    if not arrays or len({a.shape for a in arrays.values()}) != 1:
+        return None
+    arr = next(iter(arrays.values())) if len(arrays) == 1 else np.stack(list(arrays.values()))
+    arr = _little_endian(arr)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(arr))
+    headers = {"X-Array-Fields": ",".join(arrays),
+               "X-Result-Meta": dumps(meta).decode()}
+    return header.getvalue() + arr.tobytes(), headers
+
+
+def _encode_arrow(result):
+    """
+    One column per array field (matrices as fixed-size-list columns); the
+    remaining fields as JSON in the ``params`` schema metadata.
+    """
+    import pyarrow as pa
+
+    arrays, meta = _split(result)
+    if (not arrays or any(a.ndim not in (1, 2) for a in arrays.values())
+            or len({len(a) for a in arrays.values()}) != 1):
+        return None
+    columns = []
+    for arr in arrays.values():
+        arr = _little_endian(arr)
+        if arr.ndim == 1:
+            columns.append(pa.array(arr))
+        else:
+            columns.append(pa.FixedSizeListArray.from_arrays(pa.array(arr.ravel()), arr.shape[1]))
+    schema = pa.schema([pa.field(name, col.type) for name, col in zip(arrays, columns)],
+                       metadata={"params": dumps(meta)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(pa.record_batch(columns, schema=schema))
+    return sink.getvalue().to_pybytes(), {}
+
+
+def _msgpack_default(value):
+    if isinstance(value, np.ndarray):
+        arr = _little_endian(value)
+        return {"nd": True, "type": arr.dtype.str, "shape": list(arr.shape),
+                "data": arr.data}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not msgpack serialisable")
+
+
+def _encode_msgpack(result):
+    return msgpack.packb(result, default=_msgpack_default, use_bin_type=True), {}
+
+
+_ENCODERS = {NPY: _encode_npy, ARROW: _encode_arrow, MSGPACK: _encode_msgpack}
+
+
+def response_mimetype():
+    """
+    The format negotiated from the Accept header (JSON unless the client
+    prefers one of the binary formats).
+    """
+    return request.accept_mimetypes.best_match(FORMATS, default=JSON)
+
+
+def respond(result, status=200):
+    """
+    Encode ``result`` (a dict whose values may be ndarrays) in the negotiated
+    format. Results a binary format cannot represent (e.g. .npy with arrays
+    of different shapes) fall back to JSON.
+    """
+    mimetype = response_mimetype()
+    with stage("serialise"):
+        encoded = _ENCODERS[mimetype](result) if mimetype in _ENCODERS else None
+        if encoded is None:
+            mimetype, encoded = JSON, (dumps(result), {})
+    body, headers = encoded
+    response = current_app.response_class(body, status=status, mimetype=mimetype)
+    response.headers.update(headers)
+    return response
@@ -0,0 +1,41 @@
+import os
+import threading
+
+import startup
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# Compute pools (engines.executor) divide the host's CPUs between workers
+os.environ["WEB_CONCURRENCY"] = str(workers)
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+# Import the app (and, below, the heavy engine dependencies) once in the
+# master; workers are forked from it and share those pages copy-on-write.
+# Set GUNICORN_PRELOAD=0 to import lazily in each worker instead.
+#
+# Forking is safe because the app's background threads (stripe-events,
+# metrics-aggregator, lookup-invalidation, usage-flusher, usage-spooler,
+# jwks-refresh) start on first use, i.e. in a worker serving requests, and
+# each is restarted in a forked child (pid checks, or an at-fork hook for
+# the metrics aggregator). when_ready warns if one is running in the master.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+# Workers snapshot their metrics here so /metrics reports all of them
+os.environ.setdefault("METRICS_DIR", "/tmp/seas_metrics")
+
+
+def on_starting(server):
+    from metrics import registry
+
+    # Snapshots from a previous run would be added to this run's totals
+    registry.clear_snapshots()
+
+
+def when_ready(server):
+    if preload_app:
+        timings = startup.preload()
+        server.log.info("preloaded %s in %.2fs", ", ".join(timings), sum(timings.values()))
+    threads = [t.name for t in threading.enumerate() if t is not threading.main_thread()]
+    if threads:
+        server.log.warning("threads running in the master before fork: %s", ", ".join(threads))
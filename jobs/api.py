@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, Response, current_app, g, jsonify, request
+
+from auth import api_keys
+
+# Analytics routes a job may run, keyed by the endpoint name clients send
+JOB_ENDPOINTS = {
+    "cvar/estimate": "/cvar/estimate",
+    "cvar/estimate/batch": "/cvar/estimate/batch",
+    "wasserstein/optimize": "/wasserstein/optimize",
+    "wasserstein/frontier": "/wasserstein/frontier",
+    "heavy-tail/simulate": "/heavy-tail/simulate",
+    "kolmogorov/explore": "/kolmogorov/explore",
+}
+
+# Request headers replayed into the job so auth and negotiation still apply;
+# API-key callers are carried over as their resolved key context instead
+FORWARDED_HEADERS = ("X-RapidAPI-Proxy-Secret", "X-RapidAPI-User", "Accept")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", 64))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", 24 * 3600))
+# Results larger than this are stored zlib-compressed
+JOB_COMPRESS_BYTES = int(os.getenv("JOB_COMPRESS_BYTES", 1024))
+# Results are buffered to be stored, streamed ones included; larger ones fail
+JOB_RESULT_MAX_BYTES = int(os.getenv("JOB_RESULT_MAX_BYTES", 64 * 1024 * 1024))
+# Line-per-record streams have no single document to store
+STREAMING_TYPES = ("application/x-ndjson",)
+
+jobs_bp = Blueprint("jobs", __name__)
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_active = 0
+_active_lock = threading.Lock()
+
+
+def _job_key(job_id):
+    return f"job:{job_id}"
+
+
+def _result_key(job_id):
+    return f"job:{job_id}:result"
+
+
+def _update(store, job_id, **fields):
+    key = _job_key(job_id)
+    pipe = store.pipeline()
+    pipe.hset(key, mapping={k: str(v) for k, v in fields.items()})
+    pipe.expire(key, JOB_TTL_SECONDS)
+    pipe.execute()
+
+
+def _read_body(response):
+    # Stops (and closes) a streamed response as soon as it outgrows the cap
+    chunks, size = [], 0
+    try:
+        for chunk in response.iter_encoded():
+            size += len(chunk)
+            if size > JOB_RESULT_MAX_BYTES:
+                return None
+            chunks.append(chunk)
+    finally:
+        response.close()
+    return b"".join(chunks)
+
+
+def _store_result(store, binary_store, job_id, response):
+    body = _read_body(response)
+    if body is None:
+        _update(store, job_id, status="failed", status_code=413,
+                error=f"result exceeds {JOB_RESULT_MAX_BYTES} bytes", finished_at=time.time())
+        return
+    encoding = "identity"
+    if len(body) > JOB_COMPRESS_BYTES:
+        body, encoding = zlib.compress(body, 6), "zlib"
+    binary_store.set(_result_key(job_id), body, ex=JOB_TTL_SECONDS)
+    _update(store, job_id, status="done" if response.status_code < 400 else "failed",
+            status_code=response.status_code, content_type=response.content_type,
+            encoding=encoding, finished_at=time.time())
+
+
+def _run_job(app, store, binary_store, job_id, path, body, headers, key_context=None):
+    """
+    Replay the analytics request inside a request context of its own, so the
+    job goes through exactly the same guard, parsing and compute path as a
+    synchronous call.
+    """
+    global _active
+    try:
+        _update(store, job_id, status="running", started_at=time.time())
+        environ = {api_keys.ENVIRON_KEY: key_context} if key_context is not None else None
+        with app.test_request_context(path, method="POST", data=body, headers=headers,
+                                      content_type="application/json",
+                                      environ_overrides=environ):
+            response = app.full_dispatch_request()
+            _store_result(store, binary_store, job_id, response)
+    except Exception as e:
+        _update(store, job_id, status="failed", error=str(e), finished_at=time.time())
+    finally:
+        with _active_lock:
+            _active -= 1
+
+
+def _owned_job(job_id):
+    """
+    The job's fields if the caller submitted it; other callers get None, as
+    for a job that does not exist.
+    """
+    job = current_app.extensions["redis"].hgetall(_job_key(job_id))
+    if not job or job.get("owner", "") != (api_keys.caller() or ""):
+        return None
+    return job
+
+
+@jobs_bp.route("", methods=["POST"])
+def create_job():
+    """
+    Submit an analytics request as a background job
+    ---
+    tags: [Jobs]
+    security:
+      - bearerAuth: []
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: object
+            properties:
+              endpoint:
+                type: string
+                enum: [cvar/estimate, cvar/estimate/batch, wasserstein/optimize,
+                       wasserstein/frontier, heavy-tail/simulate, kolmogorov/explore]
+              payload:
+                type: object
+            required: [endpoint, payload]
+          example:
+            endpoint: wasserstein/optimize
+            payload:
+              assets: [[0.01, -0.02], [-0.03, 0.01], [0.02, 0.04]]
+              risk_aversion: 0.5
+    responses:
+      202:
+        description: Job accepted
+        content:
+          application/json:
+            example:
+              id: 2b1f0c9e5d7a4e0f9f4c3a1b2c3d4e5f
+              status: queued
+      400:
+        description: Body is not a JSON object, or the endpoint is unknown
+      406:
+        description: Accept asked for a streaming format (application/x-ndjson)
+    """
+    global _active
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "Request body must be an object"}), 400
+    path = JOB_ENDPOINTS.get(str(data.get("endpoint", "")).strip("/"))
+    if path is None:
+        return jsonify({"message": "Unknown endpoint",
+                        "endpoints": sorted(JOB_ENDPOINTS)}), 400
+
+    if request.accept_mimetypes.best_match(STREAMING_TYPES + ("application/json",)) in STREAMING_TYPES:
+        return jsonify({"message": "Streaming formats are not available for jobs"}), 406
+
+    with _active_lock:
+        if _active >= JOB_QUEUE_MAX:
+            return jsonify({"message": "Job queue is full"}), 503, {"Retry-After": "5"}
+        _active += 1
+
+    store = current_app.extensions["redis"]
+    binary_store = current_app.extensions["redis_binary"]
+    job_id = uuid.uuid4().hex
+    headers = {h: request.headers[h] for h in FORWARDED_HEADERS if h in request.headers}
+    try:
+        # Only the submitter can see the job (empty when the caller is unknown)
+        _update(store, job_id, status="queued", endpoint=path, created_at=time.time(),
+                owner=api_keys.caller() or "")
+        _executor.submit(_run_job, current_app._get_current_object(), store,
+                         binary_store, job_id, path,
+                         json.dumps(data.get("payload", {})), headers, g.get("api_key"))
+    except Exception:
+        with _active_lock:
+            _active -= 1
+        raise
+
+    return jsonify({"id": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+
+@jobs_bp.route("/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    Job status
+    ---
+    tags: [Jobs]
+    security:
+      - bearerAuth: []
+    responses:
+      200:
+        description: Job metadata; result_url is set once the job has finished
+        content:
+          application/json:
+            example:
+              id: 2b1f0c9e5d7a4e0f9f4c3a1b2c3d4e5f
+              status: done
+              endpoint: /wasserstein/optimize
+              status_code: 200
+              result_url: /jobs/2b1f0c9e5d7a4e0f9f4c3a1b2c3d4e5f/result
+      404:
+        description: Unknown or expired job, or one submitted by another client
+    """
+    job = _owned_job(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+    job["id"] = job_id
+    if "status_code" in job:
+        job["status_code"] = int(job["status_code"])
+        if "error" not in job:
+            job["result_url"] = f"/jobs/{job_id}/result"
+    job.pop("encoding", None)
+    job.pop("owner", None)
+    return jsonify(job)
+
+
+@jobs_bp.route("/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    """
+    Job result, returned exactly as the synchronous endpoint would have
+    ---
+    tags: [Jobs]
+    security:
+      - bearerAuth: []
+    responses:
+      200:
+        description: The analytics endpoint's response body
+      404:
+        description: Unknown, unfinished or expired job, or another client's
+    """
+    job = _owned_job(job_id)
+    body = current_app.extensions["redis_binary"].get(_result_key(job_id)) if job else None
+    if body is None:
+        return jsonify({"message": "Result not available"}), 404
+    if job.get("encoding") == "zlib":
+        body = zlib.decompress(body)
+    return Response(body, status=int(job["status_code"]),
+                    content_type=job.get("content_type"))
@@ -0,0 +1,33 @@
+import hmac
+import os
+
+from flask import Blueprint, abort, current_app, request
+
+from metrics import registry
+
+# When set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Prometheus metrics for every worker
+    ---
+    tags: [Operations]
+    responses:
+      200:
+        description: |
+          Text exposition format: per-endpoint, per-stage latency histograms
+          (seas_request_stage_seconds), request counts, DB / Redis round
+          trips, compute pool saturation, cache hit rates and queue depths.
+      401:
+        description: METRICS_TOKEN is set and was not sent
+    """
+    if METRICS_TOKEN and not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        abort(401)
+    return current_app.response_class(registry.render(registry.merged()),
+                                      content_type="text/plain; version=0.0.4; charset=utf-8")
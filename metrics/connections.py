@@ -0,0 +1,14 @@
+from redis import Connection
+
+from metrics.stages import count
+
+
+class RedisConnection(Connection):
+    """
+    redis-py connection that counts every command (or pipeline) it sends as
+    one round trip.
+    """
+
+    def send_packed_command(self, command, check_health=True):
+        count("redis")
+        return super().send_packed_command(command, check_health)
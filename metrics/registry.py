@@ -0,0 +1,397 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Workers write their metrics here so /metrics can answer for all of them
+# (gunicorn.conf.py sets it); unset, each process only reports itself
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+# Finished requests are folded into the histograms this often, off the
+# request path
+AGGREGATE_SECONDS = 1.0
+
+# Request stages timed by metrics.stages; histograms also get "other" (time
+# outside them) and "total"
+STAGES = ("guard", "auth", "rate_limit", "parse", "cache", "compute", "serialise")
+
+# Histogram upper bounds in seconds, from cheap stages (auth, parsing) up to
+# long solver runs
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Finished requests not yet aggregated; appending is atomic
+_finished = deque()
+_lock = threading.Lock()
+# (endpoint, stage) -> one count per bucket, one for +Inf, then the sum
+_histograms = {}
+# (endpoint, method, status) -> requests
+_requests = {}
+# (endpoint, backend) -> round trips; endpoint "background" outside requests
+_round_trips = {}
+
+_aggregator_started = False
+_aggregator_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero; its parent's requests are its own,
+    # and its parent's aggregator thread did not survive the fork
+    global _lock, _aggregator_lock, _aggregator_started
+    _lock = threading.Lock()
+    _aggregator_lock = threading.Lock()
+    _aggregator_started = False
+    _finished.clear()
+    _histograms.clear()
+    _requests.clear()
+    _round_trips.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# -----------------------------------------------------------------------------
+# Recording (request path)
+# -----------------------------------------------------------------------------
+
+def record(endpoint, method, status, durations, total, round_trips):
+    """
+    Add one finished request: ``durations`` holds seconds per STAGES entry
+    (0.0 for stages it did not reach), ``total`` its duration and
+    ``round_trips`` backend name to count (or None). Only queues it (no
+    lock); the histograms are updated by a background thread (and before
+    every collection).
+    """
+    _finished.append((endpoint, method, status, durations, total, round_trips))
+    if not _aggregator_started:
+        _ensure_aggregator()
+
+
+def _observe(endpoint, stage, seconds):
+    counts = _histograms.get((endpoint, stage))
+    if counts is None:
+        counts = _histograms[(endpoint, stage)] = [0] * (len(STAGE_BUCKETS) + 1) + [0.0]
+    counts[bisect_left(STAGE_BUCKETS, seconds)] += 1
+    counts[-1] += seconds
+
+
+def _aggregate():
+    with _lock:
+        while True:
+            try:
+                endpoint, method, status, durations, total, round_trips = _finished.popleft()
+            except IndexError:
+                break
+            for stage, seconds in zip(STAGES, durations):
+                if seconds:
+                    _observe(endpoint, stage, seconds)
+            _observe(endpoint, "other", total - sum(durations))
+            _observe(endpoint, "total", total)
+            key = (endpoint, method, status)
+            _requests[key] = _requests.get(key, 0) + 1
+            for backend, n in (round_trips or {}).items():
+                key = (endpoint, backend)
+                _round_trips[key] = _round_trips.get(key, 0) + n
+
+
+def _run_aggregator():
+    last_snapshot = time.monotonic()
+    while True:
+        time.sleep(AGGREGATE_SECONDS)
+        _aggregate()
+        if METRICS_DIR and time.monotonic() - last_snapshot >= METRICS_FLUSH_SECONDS:
+            last_snapshot = time.monotonic()
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+
+
+def _ensure_aggregator():
+    # One thread per process (threads do not survive fork)
+    global _aggregator_started
+    with _aggregator_lock:
+        if _aggregator_started:
+            return
+        _aggregator_started = True
+        threading.Thread(target=_run_aggregator, name="metrics-aggregator",
+                         daemon=True).start()
+        if METRICS_DIR:
+            atexit.register(write_snapshot)
+
+
+def add_round_trips(endpoint, backend, n=1):
+    with _lock:
+        key = (endpoint, backend)
+        _round_trips[key] = _round_trips.get(key, 0) + n
+
+
+# -----------------------------------------------------------------------------
+# Collection: a family is (name, type, help, [(sample name, labels, value)])
+# -----------------------------------------------------------------------------
+
+def _request_families():
+    _aggregate()
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        requests = dict(_requests)
+        round_trips = dict(_round_trips)
+
+    samples = []
+    for (endpoint, stage), counts in sorted(histograms.items()):
+        labels = (("endpoint", endpoint), ("stage", stage))
+        cumulative = 0
+        for bound, n in zip(STAGE_BUCKETS + ("+Inf",), counts):
+            cumulative += n
+            samples.append(("seas_request_stage_seconds_bucket",
+                            labels + (("le", str(bound)),), cumulative))
+        samples.append(("seas_request_stage_seconds_sum", labels, counts[-1]))
+        samples.append(("seas_request_stage_seconds_count", labels, cumulative))
+    return [
+        ("seas_requests_total", "counter", "Requests by endpoint, method and status",
+         [("seas_requests_total", (("endpoint", e), ("method", m), ("status", str(s))), n)
+          for (e, m, s), n in sorted(requests.items())]),
+        ("seas_request_stage_seconds", "histogram",
+         "Time per request spent in each stage (total and other included)", samples),
+        ("seas_round_trips_total", "counter", "Database and Redis round trips by endpoint",
+         [("seas_round_trips_total", (("endpoint", e), ("backend", b)), n)
+          for (e, b), n in sorted(round_trips.items())]),
+    ]
+
+
+def _family(name, kind, help_text, samples):
+    return (name, kind, help_text, [(name, tuple(labels), value) for labels, value in samples])
+
+
+def _component_families():
+    """
+    Pool, cache and queue statistics from the modules this process has
+    loaded; nothing is imported just to report on it.
+    """
+    families = []
+    executor = sys.modules.get("engines.executor")
+    if executor is not None:
+        pools = sorted(executor.pools().items())
+        families += [
+            _family("seas_compute_pending", "gauge", "Queued plus running compute tasks",
+                    [((("family", f),), p.pending) for f, p in pools]),
+            _family("seas_compute_capacity", "gauge",
+                    "Pending compute tasks allowed before requests get 503",
+                    [((("family", f),), p.max_pending) for f, p in pools]),
+            _family("seas_compute_workers", "gauge", "Compute worker processes",
+                    [((("family", f),), p.workers) for f, p in pools]),
+            _family("seas_compute_tasks_total", "counter",
+                    "Compute tasks submitted, rejected as busy and timed out",
+                    [((("family", f), ("outcome", outcome)), n)
+                     for f, p in pools for outcome, n in sorted(p.stats.items())]),
+        ]
+    results = sys.modules.get("cache.results")
+    if results is not None:
+        families.append(_family("seas_result_cache_total", "counter",
+                                "Result cache lookups by outcome, and Redis errors",
+                                [((("outcome", k),), v) for k, v in sorted(results.stats.items())]))
+    lookups = sys.modules.get("cache.lookups")
+    if lookups is not None:
+        caches = sorted(lookups.stats().items())
+        families += [
+            _family("seas_lookup_cache_total", "counter", "Plan / client lookup cache outcomes",
+                    [((("cache", name), ("outcome", outcome)), s[outcome])
+                     for name, s in caches for outcome in ("hits", "misses")]),
+            _family("seas_lookup_cache_entries", "gauge", "Entries held by each lookup cache",
+                    [((("cache", name),), s["size"]) for name, s in caches]),
+        ]
+    usage = sys.modules.get("models.usage")
+    if usage is not None:
+        recorder = usage.usage_recorder
+        families += [
+            _family("seas_usage_events_total", "counter",
+                    "Usage recorder counters (events recorded, flushed, spooled; batches; failures)",
+                    [((("outcome", k),), v) for k, v in sorted(recorder.stats.items())
+                     if k != "last_flush_ms"]),
+            _family("seas_usage_buffer_depth", "gauge", "Usage events waiting to be written",
+                    [((), recorder.depth())]),
+        ]
+    events = sys.modules.get("billing.events")
+    if events is not None:
+        families.append(_family("seas_stripe_events_total", "counter",
+                                "Stripe webhook events by outcome",
+                                [((("outcome", k),), v) for k, v in sorted(events.stats.items())]))
+    return families
+
+
+def collect():
+    """
+    This process's metric families.
+    """
+    return _request_families() + _component_families()
+
+
+# -----------------------------------------------------------------------------
+# Multi-process: each worker snapshots to METRICS_DIR, /metrics merges them
+# -----------------------------------------------------------------------------
+
+# Counters and histograms of workers that have exited, folded into one file
+# so scrapes do not read a growing number of snapshots
+EXITED = "exited"
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"metrics.{pid}.json")
+
+
+def _read_snapshot(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_families(path, families):
+    rows = [[name, kind, help_text, [[s, list(map(list, labels)), v] for s, labels, v in samples]]
+            for name, kind, help_text, samples in families]
+    fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(rows, f)
+    os.replace(tmp, path)
+
+
+class _Totals:
+    """
+    Sums families sample by sample; gauges only from live processes.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.meta = {}
+
+    def add(self, families, live):
+        for name, kind, help_text, samples in families:
+            self.meta.setdefault(name, (kind, help_text))
+            if kind == "gauge" and not live:
+                continue
+            values = self.values.setdefault(name, {})
+            for sample, labels, value in samples:
+                key = (sample, tuple(map(tuple, labels)))
+                values[key] = values.get(key, 0) + value
+
+    def families(self):
+        return [(name, kind, help_text,
+                 [(s, labels, v) for (s, labels), v in self.values.get(name, {}).items()])
+                for name, (kind, help_text) in self.meta.items()]
+
+
+def _compact(paths):
+    """
+    Fold exited workers' snapshots into the EXITED one and delete them.
+    Serialised across processes with a lock file.
+    """
+    with open(os.path.join(METRICS_DIR, "compact.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        totals = _Totals()
+        exited = _snapshot_path(EXITED)
+        if os.path.exists(exited):
+            totals.add(_read_snapshot(exited), False)
+        folded = []
+        for path in paths:
+            try:
+                totals.add(_read_snapshot(path), False)
+            except FileNotFoundError:
+                continue  # compacted by another worker meanwhile
+            except (OSError, ValueError):
+                pass  # unreadable: drop it rather than read it every scrape
+            folded.append(path)
+        if not folded:
+            return
+        _write_families(exited, totals.families())
+        for path in folded:
+            os.remove(path)
+
+
+def write_snapshot():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_families(_snapshot_path(os.getpid()), collect())
+
+
+def clear_snapshots():
+    """
+    Remove snapshots left by a previous run, including the EXITED totals
+    (called when gunicorn starts).
+    """
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics.*.json")):
+        os.remove(path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merged():
+    """
+    Families for every worker: this process's live values plus the other
+    workers' snapshots. Counters and histograms of workers that have exited
+    are kept so totals do not go backwards; their gauges are dropped.
+    """
+    own = collect()
+    if not METRICS_DIR:
+        return own
+    totals = _Totals()
+    totals.add(own, True)
+    exited = []
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics.*.json")):
+        name = path.rsplit(".", 2)[1]
+        if name == EXITED:
+            live = False
+        else:
+            try:
+                pid = int(name)
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            live = _alive(pid)
+            if not live:
+                exited.append(path)
+        try:
+            totals.add(_read_snapshot(path), live)
+        except (OSError, ValueError):
+            continue
+    if exited:
+        # Already counted above; later scrapes find them in the EXITED file
+        try:
+            _compact(exited)
+        except OSError:
+            pass
+    return totals.families()
+
+
+# -----------------------------------------------------------------------------
+# Prometheus text exposition (version 0.0.4)
+# -----------------------------------------------------------------------------
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(families):
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples:
+            if labels:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{sample}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{sample} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,149 @@
+"""
+Per-request stage timing. ``init_app`` starts a timer for every request;
+code on the request path wraps its work in ``with stage("parse"):`` and
+``count("db")`` records a round trip. When the response goes out the stages
+are added to the histograms in metrics.registry and summarised in a
+Server-Timing header.
+
+Stages used: guard, auth, rate_limit, parse, cache, compute, serialise, plus
+``other`` (time outside any stage) and ``total``. Nested stages are timed
+exclusively, so the stages and ``other`` add up to ``total``. Everything here is a few
+attribute lookups and perf_counter calls, so it stays on in production;
+``metrics.request_overhead`` in the benchmark suite tracks the cost.
+"""
+import os
+import threading
+from time import perf_counter
+
+from metrics import registry
+
+# Set to 0 to stop sending Server-Timing (stages are still recorded)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") != "0"
+
+STAGES = registry.STAGES
+_INDEX = {name: i for i, name in enumerate(STAGES)}
+_PREFIXES = tuple(f"{name};dur=" for name in STAGES)
+
+_local = threading.local()
+
+
+class _Timer:
+    # One slot per stage, so timing a stage is an index and an add
+    __slots__ = ("started", "durations", "round_trips", "current")
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.durations = [0.0] * len(STAGES)
+        self.round_trips = None
+        # Innermost stage in progress
+        self.current = None
+
+
+class stage:
+    """
+    Context manager timing one stage (one of STAGES) of the current request.
+    Outside a request (background threads, compute workers) it does nothing.
+
+    Stages may nest (the guard runs the rate limit check): time spent in a
+    nested stage counts for it alone, not for the stage around it, so the
+    stages never overlap and add up to at most the request's total.
+    """
+
+    __slots__ = ("index", "started", "timer", "parent", "nested")
+
+    def __init__(self, name):
+        self.index = _INDEX[name]
+
+    def __enter__(self):
+        timer = self.timer = getattr(_local, "timer", None)
+        if timer is not None:
+            self.parent = timer.current
+            self.nested = 0.0
+            timer.current = self
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timer = self.timer
+        if timer is not None:
+            elapsed = perf_counter() - self.started
+            timer.durations[self.index] += elapsed - self.nested
+            parent = timer.current = self.parent
+            if parent is not None:
+                parent.nested += elapsed
+
+
+def count(backend, n=1):
+    """
+    Record ``n`` round trips to ``backend`` ("db" or "redis"), against the
+    current request's endpoint or, outside requests, "background".
+    """
+    timer = getattr(_local, "timer", None)
+    if timer is None:
+        registry.add_round_trips("background", backend, n)
+    elif timer.round_trips is None:
+        timer.round_trips = {backend: n}
+    else:
+        timer.round_trips[backend] = timer.round_trips.get(backend, 0) + n
+
+
+def begin():
+    _local.timer = _Timer()
+
+
+def server_timing(durations, total, round_trips):
+    """
+    The Server-Timing header value for one request's stage durations.
+    """
+    # %-formatting onto precomputed prefixes is the cheapest way to get
+    # fixed-precision milliseconds; this is most of finish()'s cost
+    parts = []
+    for prefix, seconds in zip(_PREFIXES, durations):
+        if seconds:
+            parts.append(prefix + "%.3f" % (seconds * 1000))
+    parts.append("other;dur=%.3f" % ((total - sum(durations)) * 1000))
+    parts.append("total;dur=%.3f" % (total * 1000))
+    if round_trips:
+        for backend, n in round_trips.items():
+            parts.append(f'{backend};desc="{n} round trips"')
+    return ", ".join(parts)
+
+
+def finish(endpoint, method, status):
+    """
+    Close the current request's timer, record it and return the
+    Server-Timing header value (None outside a request or with
+    SERVER_TIMING=0).
+    """
+    timer = getattr(_local, "timer", None)
+    if timer is None:
+        return None
+    _local.timer = None
+    total = perf_counter() - timer.started
+    # Folded into the histograms (other and total included) off the request path
+    registry.record(endpoint, method, status, timer.durations, total, timer.round_trips)
+    if not SERVER_TIMING:
+        return None
+    return server_timing(timer.durations, total, timer.round_trips)
+
+
+def init_app(app):
+    """
+    Time every request on ``app``.
+    """
+    from flask import request
+
+    def start_timer():
+        begin()
+
+    def finish_timer(response):
+        rule = request.url_rule
+        header = finish(rule.rule if rule is not None else "unmatched",
+                        request.method, response.status_code)
+        if header is not None:
+            response.headers["Server-Timing"] = header
+        return response
+
+    # First before_request so the guard and everything after it is covered
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+    app.after_request(finish_timer)
@@ -1,49 +1,41 @@
-import mysql.connector
 import datetime
-import os
 
-# Function to get a connection to Google Cloud SQL
-def get_db_connection():
-    """
-    Establishes a connection to the Google Cloud SQL instance using mysql-connector.
-    """
-    connection = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
-    )
-    return connection
+from auth import api_keys
+from cache import lookups
+from models.db import get_connection
+
+client_cache = lookups.LookupCache("clients", ttl=lookups.CLIENT_CACHE_TTL)
 
 # Function to create a new client
 def create_client(name, email, plan_id, trial_end_date):
     """
     Create a new client record in the 'clients' table.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        INSERT INTO clients (name, email, plan_id, created_at, trial_end_date)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (name, email, plan_id, datetime.datetime.utcnow(), trial_end_date))
+        cursor.execute("""
+            INSERT INTO clients (name, email, plan_id, created_at, trial_end_date)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (name, email, plan_id, datetime.datetime.utcnow(), trial_end_date))
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.commit()
+        cursor.close()
 
 # Function to get client by ID
 def get_client_by_id(client_id):
     """
     Get client information by ID.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    return client_cache.get(client_id, lambda: _load_client(client_id))
 
-    cursor.execute("SELECT * FROM clients WHERE id = %s", (client_id,))
-    client = cursor.fetchone()
-    cursor.close()
-    conn.close()
+def _load_client(client_id):
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        cursor.execute("SELECT * FROM clients WHERE id = %s", (client_id,))
+        client = cursor.fetchone()
+        cursor.close()
 
     return client
 
@@ -52,9 +44,6 @@ def update_client(client_id, name=None, email=None, plan_id=None, active=None):
     """
     Update client information in the 'clients' table.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     update_query = "UPDATE clients SET "
     params = []
 
@@ -77,10 +66,18 @@ def update_client(client_id, name=None, email=None, plan_id=None, active=None):
     update_query += " WHERE id = %s"
     params.append(client_id)
 
-    cursor.execute(update_query, tuple(params))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(update_query, tuple(params))
+        conn.commit()
+        cursor.close()
+
+    lookups.invalidate("clients", client_id)
+    # API keys carry the plan and limit; a deactivated client's key stops working
+    if active is False:
+        api_keys.revoke(client_id)
+    elif plan_id:
+        api_keys.refresh_client(client_id)
 
 # Function to deactivate a client
 def deactivate_client(client_id):
@@ -0,0 +1,211 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+from dotenv import load_dotenv
+
+from metrics.stages import count
+
+# Load environment variables from .env file
+load_dotenv()
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+# Connections older than this are closed instead of being reused
+MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))
+# Connections idle longer than this are pinged before being handed out
+HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", 30))
+
+
+def _connect():
+    """
+    Open a new connection to the Google Cloud SQL instance.
+    """
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME")
+    )
+
+
+class _CountingCursor:
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, *args, **kwargs):
+        count("db")
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        count("db")
+        return self._cursor.executemany(*args, **kwargs)
+
+
+class _CountingConnection:
+    """
+    Passes everything through to the connection, counting statements and
+    commits as database round trips for the request metrics.
+    """
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self):
+        count("db")
+        return self._conn.commit()
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe MySQL connection pool.
+
+    At most ``size`` connections are open at once; callers wait up to
+    ``timeout`` seconds for one before PoolError is raised. Idle connections
+    are kept LIFO so the warmest is reused first, pinged if they have been
+    idle for a while, and recycled after ``max_lifetime`` seconds.
+    """
+
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT, max_lifetime=MAX_LIFETIME,
+                 healthcheck_idle=HEALTHCHECK_IDLE, connect=_connect):
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+        self._connect = connect
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.checkouts = 0
+        self.opened = 0
+
+    def _check_fork(self):
+        # Connections inherited from a parent process share its sockets;
+        # drop them (without closing) and start a fresh pool in the child.
+        if self._pid != os.getpid():
+            self._reset()
+
+    @staticmethod
+    def _close(pooled):
+        try:
+            pooled.conn.close()
+        except mysql.connector.Error:
+            pass
+
+    def _usable(self, pooled):
+        now = time.monotonic()
+        if now - pooled.created_at > self.max_lifetime:
+            return False
+        if now - pooled.last_used > self.healthcheck_idle:
+            try:
+                pooled.conn.ping(reconnect=False)
+            except mysql.connector.Error:
+                return False
+        return True
+
+    def acquire(self):
+        self._check_fork()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"No database connection available within {self.timeout}s")
+        try:
+            while True:
+                try:
+                    pooled = self._idle.get_nowait()
+                except queue.Empty:
+                    pooled = _PooledConnection(self._connect())
+                    self.opened += 1
+                    break
+                if self._usable(pooled):
+                    break
+                self._close(pooled)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.checkouts += 1
+        return pooled
+
+    def release(self, pooled, discard=False):
+        if self._pid != os.getpid():
+            return
+        if not discard:
+            try:
+                # End any open transaction so the next user starts clean
+                # (and does not read from a stale REPEATABLE READ snapshot)
+                pooled.conn.rollback()
+            except mysql.connector.Error:
+                discard = True
+        if discard:
+            self._close(pooled)
+        else:
+            pooled.last_used = time.monotonic()
+            self._idle.put(pooled)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check a connection out for the duration of a ``with`` block.
+        """
+        pooled = self.acquire()
+        discard = False
+        try:
+            yield _CountingConnection(pooled.conn)
+        except mysql.connector.errors.InterfaceError:
+            discard = True
+            raise
+        finally:
+            self.release(pooled, discard)
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+def get_connection():
+    """
+    Context manager yielding a pooled connection to Google Cloud SQL.
+    """
+    return get_pool().connection()
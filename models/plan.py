@@ -1,36 +1,25 @@
-import mysql.connector
-import os
-from dotenv import load_dotenv
+from cache import lookups
+from models.db import get_connection
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Function to get a connection to Google Cloud SQL
-def get_db_connection():
-    """
-    Establishes a connection to the Google Cloud SQL instance using mysql-connector.
-    """
-    connection = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
-    )
-    return connection
+# Plan catalogue reads are served from memory; every write below invalidates
+# it in all workers
+plan_cache = lookups.LookupCache("plans", ttl=lookups.PLAN_CACHE_TTL)
 
 # Function to get all active plans
 def get_active_plans():
     """
     Fetches all active plans from the plans table in Google Cloud SQL.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM plans WHERE is_active = 1")
-    plans = cursor.fetchall()
+    return plan_cache.get("active", _load_active_plans)
+
+def _load_active_plans():
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        cursor.execute("SELECT * FROM plans WHERE is_active = 1")
+        plans = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
+        cursor.close()
 
     return plans
 
@@ -39,14 +28,16 @@ def get_plan_by_id(plan_id):
     """
     Fetches a plan by its ID from the plans table in Google Cloud SQL.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM plans WHERE id = %s", (plan_id,))
-    plan = cursor.fetchone()
+    return plan_cache.get(("id", plan_id), lambda: _load_plan(plan_id))
 
-    cursor.close()
-    conn.close()
+def _load_plan(plan_id):
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        cursor.execute("SELECT * FROM plans WHERE id = %s", (plan_id,))
+        plan = cursor.fetchone()
+
+        cursor.close()
 
     return plan
 
@@ -55,46 +46,49 @@ def create_plan(name, price, api_price, consulting_rate, description):
     """
     Creates a new plan in the plans table.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO plans (name, price, api_price, consulting_rate, description, is_active)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (name, price, api_price, consulting_rate, description, True))
 
-    cursor.execute("""
-        INSERT INTO plans (name, price, api_price, consulting_rate, description, is_active)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (name, price, api_price, consulting_rate, description, True))
+        conn.commit()
+        cursor.close()
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    lookups.invalidate("plans")
 
 # Function to update an existing plan
 def update_plan(plan_id, name, price, api_price, consulting_rate, description, is_active):
     """
     Updates an existing plan in the plans table.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        UPDATE plans
-        SET name = %s, price = %s, api_price = %s, consulting_rate = %s, description = %s, is_active = %s
-        WHERE id = %s
-    """, (name, price, api_price, consulting_rate, description, is_active, plan_id))
+        cursor.execute("""
+            UPDATE plans
+            SET name = %s, price = %s, api_price = %s, consulting_rate = %s, description = %s, is_active = %s
+            WHERE id = %s
+        """, (name, price, api_price, consulting_rate, description, is_active, plan_id))
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.commit()
+        cursor.close()
+
+    lookups.invalidate("plans")
 
 # Function to delete a plan
 def delete_plan(plan_id):
     """
     Deletes a plan from the plans table.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("DELETE FROM plans WHERE id = %s", (plan_id,))
 
-    cursor.execute("DELETE FROM plans WHERE id = %s", (plan_id,))
+        conn.commit()
+        cursor.close()
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    lookups.invalidate("plans")
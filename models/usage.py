@@ -1,48 +1,536 @@
-import mysql.connector
+import atexit
 import datetime
+import glob
+import json
 import os
+import queue
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from models.db import get_connection
+from usage.rate_limiter import DEFAULT_REQUESTS_PER_MINUTE
+
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", 500))
+USAGE_FLUSH_MS = int(os.getenv("USAGE_FLUSH_MS", 250))
+USAGE_BUFFER_SIZE = int(os.getenv("USAGE_BUFFER_SIZE", 50000))
+# Events that cannot be written (buffer full, DB down, shutdown) are appended
+# here and replayed by the flusher once the database accepts writes again
+USAGE_SPOOL_DIR = os.getenv("USAGE_SPOOL_DIR", "/tmp/usage_spool")
+# How often an idle flusher looks for spool files (its own or dead workers')
+USAGE_SPOOL_RETRY_SECONDS = float(os.getenv("USAGE_SPOOL_RETRY_SECONDS", 30))
 
-# Function to get a connection to Google Cloud SQL
-def get_db_connection():
+INSERT_USAGE_SQL = """
+    INSERT INTO usage_logs (client_id, endpoint, timestamp, usage_cost)
+    VALUES (%s, %s, %s, %s)
+"""
+
+# Rollups are maintained alongside usage_logs so the dashboard never scans
+# raw history: per client x endpoint x hour/day bucket, plus a per-client
+# total for the current calendar month (UTC) that backs the usage summary.
+USAGE_ROLLUP_DDL = (
     """
-    Establishes a connection to the Google Cloud SQL instance using mysql-connector.
+    CREATE TABLE IF NOT EXISTS usage_rollups (
+        client_id INT NOT NULL,
+        granularity ENUM('hour', 'day') NOT NULL,
+        bucket_start DATETIME NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        calls BIGINT NOT NULL DEFAULT 0,
+        cost DECIMAL(18, 6) NOT NULL DEFAULT 0,
+        PRIMARY KEY (client_id, granularity, bucket_start, endpoint)
+    )
+    """,
     """
-    connection = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
+    CREATE TABLE IF NOT EXISTS usage_totals (
+        client_id INT NOT NULL,
+        period_start DATE NOT NULL,
+        calls BIGINT NOT NULL DEFAULT 0,
+        cost DECIMAL(18, 6) NOT NULL DEFAULT 0,
+        PRIMARY KEY (client_id, period_start)
     )
-    return connection
+    """,
+    # Keyset pagination of a client's raw log walks this index
+    "CREATE INDEX idx_usage_logs_client_id ON usage_logs (client_id, id)",
+)
 
-# Function to log usage data
-def log_usage(client_id, endpoint, usage_cost):
+UPSERT_ROLLUP_SQL = """
+    INSERT INTO usage_rollups (client_id, granularity, bucket_start, endpoint, calls, cost)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE calls = calls + VALUES(calls), cost = cost + VALUES(cost)
+"""
+
+UPSERT_TOTAL_SQL = """
+    INSERT INTO usage_totals (client_id, period_start, calls, cost)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE calls = calls + VALUES(calls), cost = cost + VALUES(cost)
+"""
+
+# Bucket expressions used when rebuilding rollups from usage_logs
+ROLLUP_BUCKET_SQL = {
+    "hour": "DATE_FORMAT(timestamp, '%%Y-%%m-%%d %%H:00:00')",
+    "day": "DATE(timestamp)",
+}
+
+DEFAULT_API_LIMIT = int(os.getenv("DEFAULT_API_LIMIT", 1000))
+USAGE_PAGE_SIZE = int(os.getenv("USAGE_PAGE_SIZE", 500))
+MAX_USAGE_PAGE_SIZE = 5000
+
+# Function to create the rollup tables
+def create_rollup_tables():
+    """
+    Creates the rollup tables and the usage_logs pagination index if they
+    are missing.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for statement in USAGE_ROLLUP_DDL:
+            try:
+                cursor.execute(statement)
+            except mysql.connector.Error as e:
+                if e.errno != errorcode.ER_DUP_KEYNAME:
+                    raise
+        conn.commit()
+        cursor.close()
+
+
+def _period_start(ts):
+    return ts.date().replace(day=1)
+
+
+def aggregate_usage(rows):
     """
-    Logs usage data for a specific client.
+    Folds (client_id, endpoint, timestamp, usage_cost) rows into rollup and
+    monthly-total increments.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    buckets = {}
+    totals = {}
+    for client_id, endpoint, ts, cost in rows:
+        cost = float(cost or 0)
+        hour = ts.replace(minute=0, second=0, microsecond=0)
+        for key in ((client_id, "hour", hour, endpoint),
+                    (client_id, "day", hour.replace(hour=0), endpoint)):
+            calls, total = buckets.get(key, (0, 0.0))
+            buckets[key] = (calls + 1, total + cost)
+        key = (client_id, _period_start(ts))
+        calls, total = totals.get(key, (0, 0.0))
+        totals[key] = (calls + 1, total + cost)
+    return ([k + v for k, v in buckets.items()],
+            [k + v for k, v in totals.items()])
+
+# Function to write a batch of usage rows
+def write_usage_logs(rows):
+    """
+    Inserts many (client_id, endpoint, timestamp, usage_cost) rows in one
+    multi-row INSERT and folds them into the rollups, in a single commit.
+    """
+    rollups, totals = aggregate_usage(rows)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(INSERT_USAGE_SQL, rows)
+        cursor.executemany(UPSERT_ROLLUP_SQL, rollups)
+        cursor.executemany(UPSERT_TOTAL_SQL, totals)
+        conn.commit()
+        cursor.close()
+
+# Function to rebuild rollups from the raw log
+def rebuild_rollups(since):
+    """
+    Recomputes rollups and monthly totals from usage_logs for everything at
+    or after ``since`` (rounded down to the start of its month). Used to
+    backfill history or repair rollups after manual edits to usage_logs.
+    """
+    start = datetime.datetime.combine(_period_start(since), datetime.time())
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM usage_rollups WHERE bucket_start >= %s", (start,))
+        cursor.execute("DELETE FROM usage_totals WHERE period_start >= %s", (start.date(),))
+        for granularity, bucket in ROLLUP_BUCKET_SQL.items():
+            cursor.execute(f"""
+                INSERT INTO usage_rollups (client_id, granularity, bucket_start, endpoint, calls, cost)
+                SELECT client_id, '{granularity}', {bucket}, endpoint,
+                       COUNT(*), COALESCE(SUM(usage_cost), 0)
+                FROM usage_logs WHERE timestamp >= %s
+                GROUP BY client_id, {bucket}, endpoint
+            """, (start,))
+        cursor.execute("""
+            INSERT INTO usage_totals (client_id, period_start, calls, cost)
+            SELECT client_id, DATE_FORMAT(timestamp, '%%Y-%%m-01'), COUNT(*),
+                   COALESCE(SUM(usage_cost), 0)
+            FROM usage_logs WHERE timestamp >= %s
+            GROUP BY client_id, DATE_FORMAT(timestamp, '%%Y-%%m-01')
+        """, (start,))
+        conn.commit()
+        cursor.close()
+
+
+class UsageRecorder:
+    """
+    Buffers usage events in memory and writes them in batches from a
+    background thread, every ``batch_size`` events or ``flush_ms``
+    milliseconds, whichever comes first.
+
+    Recording never blocks on the database or the disk: when the buffer is
+    full, a flush fails, or the process exits, events are spooled to disk as
+    JSON lines by background threads. The flusher replays spool files
+    (including those of dead workers and interrupted replays) after its next
+    successful write, or every USAGE_SPOOL_RETRY_SECONDS when idle.
+    ``stats`` exposes back-pressure counters.
+
+    Loss window: events still in memory are lost if the process is killed
+    without running atexit (SIGKILL, OOM kill). Normally that is under
+    ``flush_ms`` worth of events; while the database is slow it can be up to
+    ``buffer_size``, plus any overflow not yet spooled.
+    """
+
+    def __init__(self, batch_size=USAGE_BATCH_SIZE, flush_ms=USAGE_FLUSH_MS,
+                 buffer_size=USAGE_BUFFER_SIZE, spool_dir=USAGE_SPOOL_DIR,
+                 writer=write_usage_logs, spool_retry=USAGE_SPOOL_RETRY_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.buffer_size = buffer_size
+        self.spool_dir = spool_dir
+        self.writer = writer
+        self.spool_retry = spool_retry
+        self.stats = {"recorded": 0, "flushed": 0, "batches": 0, "spooled": 0,
+                      "replayed": 0, "flush_failures": 0, "last_flush_ms": 0.0}
+        self._pid = None
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        # Set when rows are spooled, cleared when the spool is replayed
+        self._spooled = False
+
+    # -- request path ---------------------------------------------------------
+
+    def record(self, client_id, endpoint, usage_cost, timestamp=None):
+        self._ensure_started()
+        row = (client_id, endpoint, timestamp or datetime.datetime.utcnow(), usage_cost)
+        self.stats["recorded"] += 1
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Handed to the spooler thread; the request never waits on disk
+            self._overflow.append(row)
+            self._overflowed.set()
+
+    def depth(self):
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    # -- flusher --------------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Fresh buffer and thread per process (threads do not survive fork)
+            self._queue = queue.Queue(maxsize=self.buffer_size)
+            self._overflow = deque()
+            self._overflowed = threading.Event()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="usage-flusher",
+                                            daemon=True)
+            self._spooler = threading.Thread(target=self._run_spooler, name="usage-spooler",
+                                             daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+            self._spooler.start()
+            atexit.register(self.close)
 
-    cursor.execute("""
-        INSERT INTO usage_logs (client_id, endpoint, timestamp, usage_cost)
-        VALUES (%s, %s, %s, %s)
-    """, (client_id, endpoint, datetime.datetime.utcnow(), usage_cost))
+    def _drain(self, first=None):
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            self.writer(batch)
+        except Exception:
+            self.stats["flush_failures"] += 1
+            self._spool(batch)
+            return False
+        self.stats["flushed"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["last_flush_ms"] = (time.perf_counter() - started) * 1000.0
+        return True
+
+    def _run(self):
+        self._replay_spool()
+        last_replay = time.monotonic()
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.extend(self._drain(self._queue.get(timeout=timeout)))
+                except queue.Empty:
+                    break
+            wrote = self._write(batch) if batch else False
+            # Retry what earlier failures left on disk as soon as the database
+            # takes a batch again; look for dead workers' spools now and then
+            if (wrote and self._spooled) or time.monotonic() - last_replay >= self.spool_retry:
+                self._replay_spool()
+                last_replay = time.monotonic()
+
+    def _drain_overflow(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self._overflow.popleft())
+            except IndexError:
+                return rows
+
+    def _run_spooler(self):
+        while not self._stop.is_set():
+            self._overflowed.wait()
+            self._overflowed.clear()
+            rows = self._drain_overflow()
+            if rows:
+                self._spool(rows)
+
+    def flush(self):
+        """
+        Write everything currently buffered, from the calling thread.
+        """
+        if self._pid != os.getpid():
+            return
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._overflowed.set()
+        self._thread.join(timeout=self.flush_interval * 4)
+        self._spooler.join(timeout=self.flush_interval * 4)
+        self.flush()
+        rows = self._drain_overflow()
+        if rows:
+            self._spool(rows)
+
+    # -- crash safety ---------------------------------------------------------
+
+    def _spool_path(self):
+        return os.path.join(self.spool_dir, f"usage.{os.getpid()}.jsonl")
+
+    def _spool(self, rows):
+        lines = "".join(
+            json.dumps([c, e, ts.isoformat(), cost]) + "\n" for c, e, ts, cost in rows
+        )
+        with self._spool_lock:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            with open(self._spool_path(), "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        self.stats["spooled"] += len(rows)
+        self._spooled = True
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _claim(self, path):
+        source = os.path.basename(path).split(".jsonl", 1)[0]
+        claimed = os.path.join(self.spool_dir, f"{source}.jsonl.{os.getpid()}.replay")
+        try:
+            with self._spool_lock:
+                os.rename(path, claimed)
+        except OSError:
+            return None  # another worker claimed it first
+        # Rows of an interrupted replay that were already written
+        progress = f"{path}.progress"
+        if path.endswith(".replay") and os.path.exists(progress):
+            os.replace(progress, f"{claimed}.progress")
+        return claimed
+
+    def _replay_spool(self):
+        """
+        Re-queue events spooled by processes that are no longer running, by
+        this process's failed flushes and overflows, and by replays that
+        were interrupted (whose replaying process died).
+        """
+        self._spooled = False
+        candidates = []
+        for path in glob.glob(os.path.join(self.spool_dir, "usage.*.jsonl")):
+            try:
+                pid = int(path.rsplit(".", 2)[-2])
+            except ValueError:
+                continue
+            if pid == os.getpid() or not self._alive(pid):
+                candidates.append(path)
+        for path in glob.glob(os.path.join(self.spool_dir, "usage.*.jsonl.*.replay")):
+            try:
+                pid = int(path.rsplit(".", 2)[-2])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not self._alive(pid):
+                candidates.append(path)
+
+        for path in candidates:
+            claimed = self._claim(path)
+            if claimed is not None:
+                self._replay_file(claimed)
+
+    def _replay_file(self, claimed):
+        progress = f"{claimed}.progress"
+        try:
+            with open(progress, "r", encoding="utf-8") as f:
+                done = int(f.read() or 0)
+        except (OSError, ValueError):
+            done = 0
+        with open(claimed, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        rows = [(c, e, datetime.datetime.fromisoformat(ts), cost)
+                for c, e, ts, cost in rows[done:]]
+        written = done
+        for start in range(0, len(rows), self.batch_size):
+            end = start + self.batch_size
+            if not self._write(rows[start:end]):
+                # The failed batch was re-spooled; keep the rest with it
+                if rows[end:]:
+                    self._spool(rows[end:])
+                break
+            self.stats["replayed"] += len(rows[start:end])
+            written += len(rows[start:end])
+            # A replay cut short by a crash resumes after the written rows
+            with open(f"{progress}.tmp", "w", encoding="utf-8") as f:
+                f.write(str(written))
+            os.replace(f"{progress}.tmp", progress)
+        os.remove(claimed)
+        if os.path.exists(progress):
+            os.remove(progress)
+
+
+usage_recorder = UsageRecorder()
+
+# Function to log usage data
+def log_usage(client_id, endpoint, usage_cost):
+    """
+    Logs usage data for a specific client. The row is buffered and written
+    in the next batch, so this returns without touching the database.
+    """
+    usage_recorder.record(client_id, endpoint, usage_cost)
 
 # Function to get all usage logs for a client
 def get_usage_logs(client_id):
     """
     Fetches all usage logs for a specific client.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("SELECT * FROM usage_logs WHERE client_id = %s", (client_id,))
-    logs = cursor.fetchall()
-    cursor.close()
-    conn.close()
+        cursor.execute("SELECT * FROM usage_logs WHERE client_id = %s", (client_id,))
+        logs = cursor.fetchall()
+        cursor.close()
 
     return logs
+
+# Function to get the dashboard usage summary for a client
+def get_usage_summary(client_id, now=None):
+    """
+    Returns ``planName``, ``currentCalls``, ``apiLimit``, ``rateLimit`` and ``currentCost``
+    for the current calendar month, read from usage_totals with one indexed
+    lookup instead of scanning usage_logs. The limit is the plan's
+    ``api_limit`` column when it has one, else DEFAULT_API_LIMIT.
+    """
+    period = _period_start(now or datetime.datetime.utcnow())
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        cursor.execute("""
+            SELECT p.*, COALESCE(t.calls, 0) AS current_calls,
+                   COALESCE(t.cost, 0) AS current_cost
+            FROM clients c
+            LEFT JOIN plans p ON p.id = c.plan_id
+            LEFT JOIN usage_totals t ON t.client_id = c.id AND t.period_start = %s
+            WHERE c.id = %s
+        """, (period, client_id))
+        row = cursor.fetchone() or {}
+        cursor.close()
+
+    return {
+        "planName": row.get("name") or "No plan",
+        "currentCalls": int(row.get("current_calls") or 0),
+        "apiLimit": int(row.get("api_limit") or DEFAULT_API_LIMIT),
+        "rateLimit": int(row.get("rate_limit_per_minute") or DEFAULT_REQUESTS_PER_MINUTE),
+        "currentCost": float(row.get("current_cost") or 0),
+        "periodStart": period.isoformat(),
+    }
+
+# Function to get rolled-up usage for a client
+def get_usage_rollups(client_id, granularity="day", start=None, end=None):
+    """
+    Fetches per-endpoint call counts and cost sums per hour or day bucket
+    in ``[start, end)``.
+    """
+    if granularity not in ROLLUP_BUCKET_SQL:
+        raise ValueError(f"granularity must be one of {sorted(ROLLUP_BUCKET_SQL)}")
+    query = """
+        SELECT bucket_start, endpoint, calls, cost FROM usage_rollups
+        WHERE client_id = %s AND granularity = %s
+    """
+    params = [client_id, granularity]
+    if start is not None:
+        query += " AND bucket_start >= %s"
+        params.append(start)
+    if end is not None:
+        query += " AND bucket_start < %s"
+        params.append(end)
+    query += " ORDER BY bucket_start, endpoint"
+
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, tuple(params))
+        rollups = cursor.fetchall()
+        cursor.close()
+
+    return rollups
+
+# Function to page through a client's raw usage logs
+def get_usage_logs_page(client_id, after=None, limit=None):
+    """
+    Fetches up to ``limit`` (default USAGE_PAGE_SIZE) usage logs with ids greater than the ``after``
+    cursor, oldest first. Returns ``(logs, next_cursor)``; ``next_cursor``
+    is None on the last page. Each page is a range scan on
+    (client_id, id), so its cost does not grow with the client's history.
+    """
+    limit = max(1, min(int(limit or USAGE_PAGE_SIZE), MAX_USAGE_PAGE_SIZE))
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        cursor.execute("""
+            SELECT id, endpoint, timestamp, usage_cost FROM usage_logs
+            WHERE client_id = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (client_id, int(after or 0), limit + 1))
+        logs = cursor.fetchall()
+        cursor.close()
+
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_cursor = logs[-1]["id"]
+    return logs, next_cursor
@@ -0,0 +1,52 @@
+from flask import Blueprint, abort, current_app, jsonify, request
+
+from profiling import profiler
+
+profiles_bp = Blueprint("profiles", __name__)
+
+
+@profiles_bp.route("/debug/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Download a stored request profile
+    ---
+    tags: [Operations]
+    parameters:
+      - name: profile_id
+        in: path
+        type: string
+        required: true
+        description: The X-Profile-Id returned by the profiled request
+      - name: X-Profile
+        in: header
+        type: string
+        required: true
+        description: PROFILE_TOKEN
+    responses:
+      200:
+        description: |
+          Sampled profiles as collapsed stacks (text/plain; feed to
+          flamegraph.pl, speedscope or inferno), cProfile profiles as a pstats
+          file (open with pstats, snakeviz or flameprof). Compute worker frames
+          appear under a "[<family> worker]" frame.
+      401:
+        description: Missing or wrong X-Profile token, or profiling disabled
+      404:
+        description: Unknown or expired profile
+    """
+    if not profiler.authorised(request.headers.get(profiler.HEADER)):
+        abort(401)
+    stored = profiler.load_profile(current_app.extensions["redis_binary"], profile_id)
+    if stored is None:
+        return jsonify({"message": "Profile not found"}), 404
+
+    if stored[b"format"].decode() == profiler.PSTATS:
+        response = current_app.response_class(stored[b"data"], content_type="application/octet-stream")
+        response.headers["Content-Disposition"] = f'attachment; filename="{profile_id}.prof"'
+    else:
+        response = current_app.response_class(stored[b"data"], content_type="text/plain; charset=utf-8")
+    response.headers["X-Profile-Mode"] = stored[b"mode"].decode()
+    response.headers["X-Profile-Endpoint"] = stored[b"endpoint"].decode()
+    response.headers["X-Profile-Status"] = stored[b"status"].decode()
+    response.headers["X-Profile-Duration-Ms"] = stored[b"duration_ms"].decode()
+    return response
@@ -0,0 +1,340 @@
+"""
+On-demand profiling of single requests. A request carrying
+``X-Profile: <PROFILE_TOKEN>`` runs under a sampling profiler (or cProfile
+with ``X-Profile-Mode: cprofile``), including the part of it that runs in a
+compute pool worker and, for a streamed response, the generation of its
+body. The profile is stored in Redis under a fresh id, returned in
+``X-Profile-Id`` and served by ``/debug/profiles/<id>``.
+
+Without PROFILE_TOKEN no hooks are installed; with it, requests that do not
+carry the header cost one header lookup.
+"""
+import cProfile
+import hmac
+import marshal
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from redis.exceptions import RedisError
+
+# Admin secret enabling the feature; unset, profiling is off entirely
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_TTL_SECONDS = int(os.getenv("PROFILE_TTL_SECONDS", 24 * 3600))
+
+HEADER = "X-Profile"
+MODE_HEADER = "X-Profile-Mode"
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+
+# Stored profile formats: collapsed stacks ("a;b;c 12" per line, as read by
+# flamegraph.pl, speedscope and inferno) and a marshalled pstats dump
+FOLDED = "folded"
+PSTATS = "pstats"
+
+_local = threading.local()
+# Sessions in progress in this process; lets compute calls skip the
+# thread-local lookup when nothing is being profiled
+_active = 0
+_active_lock = threading.Lock()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def folded_stack(frame):
+    """
+    ``frame`` and its callers as one collapsed-stack line, outermost first.
+    """
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class Sampler:
+    """
+    Samples one thread's stack every ``interval`` seconds from a background
+    thread and counts identical stacks. Costs the profiled thread nothing
+    beyond sharing the GIL at the sampling rate.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000.0):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.paused = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.paused:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[folded_stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+
+class _LoadedStats:
+    # What pstats.Stats.add expects of a profiler: stats and create_stats()
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+# -----------------------------------------------------------------------------
+# Compute pool workers
+# -----------------------------------------------------------------------------
+
+def run_profiled(mode, interval, fn, args, kwargs):
+    """
+    Worker-side wrapper: run ``fn`` under the requested profiler and return
+    ``(result, profile)``, where profile is a Counter of collapsed stacks or
+    a pstats dict.
+    """
+    if mode == CPROFILE:
+        profile = cProfile.Profile()
+        result = profile.runcall(fn, *args, **kwargs)
+        profile.create_stats()
+        return result, profile.stats
+    sampler = Sampler(threading.get_ident(), interval).start()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        counts = sampler.stop()
+    return result, counts
+
+
+# -----------------------------------------------------------------------------
+# Web side
+# -----------------------------------------------------------------------------
+
+class Session:
+    """
+    The profile of one request in progress.
+    """
+
+    def __init__(self, mode, endpoint):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.remote = []
+        # Set while a streamed response body is still being generated
+        self.streaming = False
+        self.ended = False
+        if mode == CPROFILE:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = Sampler(threading.get_ident()).start()
+
+    def run_remote(self, pool, fn, args, kwargs):
+        """
+        Run ``fn`` on ``pool`` under the same profiler. Sampled worker
+        stacks are grafted onto the web stack at this call, and the web
+        thread (only waiting meanwhile) is not sampled.
+        """
+        prefix = folded_stack(sys._getframe(1)) + f";[{pool.family} worker]"
+        if self.mode == SAMPLE:
+            self.sampler.paused = True
+        try:
+            result, profile = pool.result(pool.submit(
+                run_profiled, self.mode, PROFILE_INTERVAL_MS / 1000.0, fn, args, kwargs))
+        finally:
+            if self.mode == SAMPLE:
+                self.sampler.paused = False
+        self.remote.append((prefix, profile))
+        return result
+
+    def remote_pool(self, pool):
+        """
+        ``pool`` as seen by this session, for callers that submit tasks and
+        collect their results themselves rather than through ``run``.
+        """
+        return _ProfiledPool(self, pool)
+
+    def finish(self):
+        """
+        Stop profiling and return ``(format, bytes)``.
+        """
+        if self.mode == CPROFILE:
+            import pstats
+
+            self.profile.disable()
+            stats = pstats.Stats(self.profile)
+            for _, remote in self.remote:
+                stats.add(_LoadedStats(remote))
+            return PSTATS, marshal.dumps(stats.stats)
+
+        counts = self.sampler.stop()
+        for prefix, remote in self.remote:
+            for stack, n in remote.items():
+                counts[f"{prefix};{stack}"] += n
+        lines = "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+        return FOLDED, lines.encode()
+
+
+class _ProfiledPool:
+    """
+    Submits tasks to a compute pool under the session's profiler and keeps
+    each worker profile as its result is collected. The web thread is
+    sampled meanwhile: it may be doing other work between results.
+    """
+
+    def __init__(self, session, pool):
+        self.session = session
+        self.pool = pool
+        self.family = pool.family
+        self.workers = pool.workers
+
+    def submit(self, fn, *args, **kwargs):
+        prefix = folded_stack(sys._getframe(1)) + f";[{self.family} worker]"
+        future = self.pool.submit(run_profiled, self.session.mode,
+                                  PROFILE_INTERVAL_MS / 1000.0, fn, args, kwargs)
+        future.profile_prefix = prefix
+        return future
+
+    def result(self, future):
+        result, profile = self.pool.result(future)
+        self.session.remote.append((future.profile_prefix, profile))
+        return result
+
+
+def _begin(session):
+    global _active
+    _local.session = session
+    with _active_lock:
+        _active += 1
+
+
+def _end(session=None):
+    """
+    End ``session`` (by default this thread's) and return it, or None if it
+    had already ended.
+    """
+    global _active
+    if session is None:
+        session = getattr(_local, "session", None)
+    if session is None or session.ended:
+        return None
+    session.ended = True
+    if getattr(_local, "session", None) is session:
+        _local.session = None
+    with _active_lock:
+        _active -= 1
+    return session
+
+
+def current():
+    """
+    The Session profiling this thread's request, if any.
+    """
+    if not _active:
+        return None
+    session = getattr(_local, "session", None)
+    return session if session is not None and not session.ended else None
+
+
+def authorised(value):
+    return bool(PROFILE_TOKEN) and value is not None and hmac.compare_digest(value, PROFILE_TOKEN)
+
+
+def _profile_key(profile_id):
+    return f"profile:{profile_id}"
+
+
+def store_profile(store, session, fmt, data, duration, status):
+    key = _profile_key(session.id)
+    pipe = store.pipeline()
+    pipe.hset(key, mapping={"format": fmt, "mode": session.mode, "endpoint": session.endpoint,
+                            "status": str(status), "duration_ms": f"{duration * 1000:.1f}",
+                            "created_at": str(int(time.time())), "data": data})
+    pipe.expire(key, PROFILE_TTL_SECONDS)
+    pipe.execute()
+
+
+def load_profile(store, profile_id):
+    """
+    The stored profile's fields (bytes keys and values), or None.
+    """
+    return store.hgetall(_profile_key(profile_id)) or None
+
+
+def init_app(app):
+    """
+    Profile requests on ``app`` that carry a valid X-Profile header. Does
+    nothing unless PROFILE_TOKEN is set.
+    """
+    if not PROFILE_TOKEN:
+        return
+    from flask import current_app, request
+
+    def start_profile():
+        value = request.headers.get(HEADER)
+        # Fetching a profile sends the same header; do not profile that
+        if value is None or not authorised(value) or request.blueprint == "profiles":
+            return
+        mode = CPROFILE if request.headers.get(MODE_HEADER) == CPROFILE else SAMPLE
+        rule = request.url_rule
+        _begin(Session(mode, rule.rule if rule is not None else request.path))
+
+    def save(session, store, status):
+        if _end(session) is None:
+            return False
+        duration = time.perf_counter() - session.started
+        fmt, data = session.finish()
+        try:
+            store_profile(store, session, fmt, data, duration, status)
+        except RedisError:
+            return False
+        return True
+
+    def finish_profile(response):
+        session = current()
+        if session is None:
+            return response
+        store = current_app.extensions["redis_binary"]
+        if response.is_streamed:
+            # Most of the work happens while the body is generated, so the
+            # profile stays open (this thread generates it) until it closes.
+            # The id is known already; the profile appears once it has.
+            session.streaming = True
+            response.call_on_close(lambda: save(session, store, response.status_code))
+        elif not save(session, store, response.status_code):
+            return response
+        response.headers["X-Profile-Id"] = session.id
+        response.headers["X-Profile-Url"] = f"/debug/profiles/{session.id}"
+        return response
+
+    def discard_profile(exc):
+        # Only reached with a session when after_request did not run; a
+        # streamed response's session is saved when the response closes
+        session = current()
+        if session is not None and not session.streaming:
+            _end(session).finish()
+
+    # Ahead of every other hook, so the guard and auth are profiled too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(discard_profile)
@@ -0,0 +1,99 @@
+"""
+Worker start-up helpers: preloading heavy modules in a gunicorn master so
+workers share them through fork, and an import-time profile of the app.
+
+    python startup.py                 # profile `import app`
+    python startup.py engines.wasserstein --top 15
+"""
+import argparse
+import gc
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+from engines.executor import PRELOAD_MODULES as ENGINE_MODULES
+
+# Imported on first use in each worker unless preloaded in the master: what
+# the compute pools' forkserver preloads, plus stripe for the billing routes
+HEAVY_MODULES = ENGINE_MODULES + ("stripe",)
+
+
+def preload(modules=None):
+    """
+    Import ``modules`` (default PRELOAD_MODULES, a comma-separated env var,
+    else HEAVY_MODULES) and freeze everything allocated so far out of the
+    garbage collector, so forked workers keep sharing those pages instead of
+    dirtying them on the first collection. Returns seconds spent per module;
+    modules that are not installed are skipped.
+    """
+    if modules is None:
+        configured = os.getenv("PRELOAD_MODULES")
+        modules = configured.split(",") if configured else HEAVY_MODULES
+    timings = {}
+    for name in modules:
+        name = name.strip()
+        if not name:
+            continue
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        timings[name] = time.perf_counter() - started
+    gc.collect()
+    gc.freeze()
+    return timings
+
+
+def profile_imports(target="app", python=sys.executable):
+    """
+    Run ``import target`` in a fresh interpreter with ``-X importtime`` and
+    return one dict per imported module (``module``, ``depth``, ``self_us``,
+    ``cumulative_us``) in import order.
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run([python, "-X", "importtime", "-c", f"import {target}"],
+                          cwd=cwd, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines()
+                  if not line.startswith("import time:")]
+        raise RuntimeError(errors[-1] if errors else f"import {target} failed")
+    return rows
+
+
+def report(rows, top=25):
+    """
+    Text report: total import time, the slowest top-level dependencies by
+    cumulative time and the slowest individual modules by self time.
+    """
+    total = sum(r["self_us"] for r in rows)
+    lines = [f"{len(rows)} modules imported in {total / 1e6:.3f}s", "",
+             "Slowest top-level imports (cumulative):"]
+    shallow = [r for r in rows if r["depth"] <= 1]
+    for r in sorted(shallow, key=lambda r: -r["cumulative_us"])[:top]:
+        lines.append(f"  {r['cumulative_us'] / 1e3:9.1f} ms  {r['module']}")
+    lines += ["", "Slowest modules (self):"]
+    for r in sorted(rows, key=lambda r: -r["self_us"])[:top]:
+        lines.append(f"  {r['self_us'] / 1e3:9.1f} ms  {r['module']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time profile")
+    parser.add_argument("target", nargs="?", default="app")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+    print(report(profile_imports(args.target), args.top))
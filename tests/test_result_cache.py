@@ -0,0 +1,31 @@
+import pytest
+
+from benchmarks.standins import StandIns
+
+
+@pytest.fixture(scope="module")
+def env():
+    env = StandIns()
+    yield env
+    env.close()
+
+
+def _headers(env, user):
+    return {**env.api_headers(), "X-RapidAPI-User": user}
+
+
+def test_cached_result_is_not_served_to_another_dataset_owner(env):
+    client = env.master_app.test_client()
+    upload = client.post("/datasets", json={"data": [[0.01, -0.02], [-0.05, 0.03], [0.02, -0.08]]},
+                         headers=_headers(env, "alice"))
+    assert upload.status_code in (200, 201)
+    body = {"portfolio": [0.3, 0.7], "dataset_id": upload.get_json()["dataset_id"]}
+
+    first = client.post("/cvar/estimate", json=body, headers=_headers(env, "alice"))
+    assert first.status_code == 200
+    again = client.post("/cvar/estimate", json=body, headers=_headers(env, "alice"))
+    assert again.headers["X-Cache"] == "HIT"
+
+    other = client.post("/cvar/estimate", json=body, headers=_headers(env, "bob"))
+    assert other.status_code == 404
+    assert "X-Cache" not in other.headers
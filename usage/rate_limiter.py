@@ -1,49 +1,272 @@
-import mysql.connector
+import math
+import os
+import threading
 import time
-from flask import current_app
+from collections import namedtuple
 
-def get_db():
+from flask import current_app, g, has_app_context
+from redis.exceptions import RedisError
+
+from metrics.stages import stage
+
+DEFAULT_REQUESTS_PER_MINUTE = int(os.getenv("DEFAULT_REQUESTS_PER_MINUTE", 60))
+# Share of a client's per-minute limit a worker reserves per shared-store trip;
+# 0 disables the local lease tier
+LEASE_FRACTION = float(os.getenv("RATE_LIMIT_LEASE_FRACTION", 0.1))
+# Unused leased tokens are dropped after this long so idle workers do not
+# hoard a client's quota
+LEASE_TTL_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_TTL", 2.0))
+# A lease holds about as many tokens as the worker admitted for the client
+# in the last window of this length
+LEASE_RATE_WINDOW_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_RATE_WINDOW", LEASE_TTL_SECONDS))
+
+RateLimitResult = namedtuple(
+    "RateLimitResult", ["allowed", "limit", "remaining", "reset_after", "retry_after"]
+)
+
+# Token bucket holding up to ARGV[1] tokens, refilled at ARGV[2] tokens per
+# millisecond; a caller first returns ARGV[4] unused tokens (the rest of an
+# expired lease), then takes as many whole tokens as are available, up to
+# ARGV[3] (1 for a plain check, more for a lease). Uses the server clock so
+# all workers agree on time, and does the whole check in one round trip.
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local refund = tonumber(ARGV[4]) or 0
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate + refund)
+local granted = math.min(want, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + 1000)
+return {granted, tostring(tokens)}
+"""
+
+
+def _retry_after_ms(tokens, rate_per_ms):
+    # Time until the bucket holds one whole token again
+    return max(0.0, (1.0 - tokens) / rate_per_ms)
+
+
+def _result(allowed, tokens, capacity, rate_per_ms):
+    """
+    Build the header-ready result from the bucket state after a check.
+    """
+    retry_after = 0 if allowed else math.ceil(_retry_after_ms(tokens, rate_per_ms) / 1000.0)
+    reset_after = math.ceil((capacity - tokens) / rate_per_ms / 1000.0)
+    return RateLimitResult(bool(allowed), capacity, int(tokens), reset_after, retry_after)
+
+
+class LocalTokenBuckets:
+    """
+    In-process token buckets with the same semantics as the Redis script.
+    Used when Redis is unavailable; limits are then enforced per worker.
+    """
+
+    def __init__(self, max_clients=100000):
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate_per_ms, want=1, refund=0):
+        now = time.monotonic() * 1000.0
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - ts) * rate_per_ms + refund)
+            granted = min(want, math.floor(tokens))
+            tokens -= granted
+            if len(self._buckets) >= self.max_clients and key not in self._buckets:
+                # Drop an arbitrary bucket; a fresh bucket only ever errs
+                # towards allowing a request
+                self._buckets.pop(next(iter(self._buckets)))
+            self._buckets[key] = (tokens, now)
+        return granted, tokens
+
+
+_local_buckets = LocalTokenBuckets()
+_scripts = {}
+
+
+def _token_bucket_script(store):
+    script = _scripts.get(id(store))
+    if script is None:
+        script = _scripts[id(store)] = store.register_script(TOKEN_BUCKET_LUA)
+    return script
+
+
+def plan_limit(plan_id):
+    """
+    Requests per minute allowed on a plan: the plan's ``rate_limit_per_minute``
+    column when it has one, else DEFAULT_REQUESTS_PER_MINUTE.
     """
-    Connect to the database using configuration from the app.
+    if plan_id is None:
+        return DEFAULT_REQUESTS_PER_MINUTE
+    from models.plan import get_plan_by_id
+    plan = get_plan_by_id(plan_id) or {}
+    return int(plan.get("rate_limit_per_minute") or DEFAULT_REQUESTS_PER_MINUTE)
+
+
+def _take_shared(store, key, capacity, rate_per_ms, want, refund=0):
+    """
+    Return ``refund`` unused tokens to the shared bucket and take up to
+    ``want``; returns ``(granted, tokens_left)``.
     """
-    if 'db' not in g:
-        g.db = mysql.connector.connect(
-            host=current_app.config['DB_HOST'],
-            user=current_app.config['DB_USER'],
-            password=current_app.config['DB_PASSWORD'],
-            database=current_app.config['DB_NAME']
-        )
-    return g.db
+    if store is not None:
+        try:
+            granted, tokens = _token_bucket_script(store)(
+                keys=[key], args=[capacity, rate_per_ms, want, refund])
+            return int(granted), float(tokens)
+        except RedisError:
+            pass
+    return _local_buckets.take(key, capacity, rate_per_ms, want, refund)
 
-def rate_limit(client_id, max_requests_per_minute):
+
+def check_rate_limit(client_id, max_requests_per_minute, store=None):
+    """
+    Take one token from the client's shared bucket (capacity and refill of
+    ``max_requests_per_minute`` per minute) and return a RateLimitResult.
     """
-    Implements rate limiting using Google Cloud SQL (MySQL/PostgreSQL).
-    Tracks the number of requests per client.
+    capacity = float(max_requests_per_minute)
+    rate_per_ms = capacity / 60000.0
+    granted, tokens = _take_shared(store, f"rate_limit:{client_id}", capacity,
+                                   rate_per_ms, 1)
+    return _result(granted >= 1, tokens, capacity, rate_per_ms)
+
+
+class _Lease:
+    __slots__ = ("tokens", "expires_at", "denied_until", "shared_tokens",
+                 "window_start", "hits", "recent_hits")
+
+    def __init__(self):
+        self.tokens = 0
+        self.expires_at = 0.0
+        self.denied_until = 0.0
+        self.shared_tokens = 0.0
+        # Requests seen in the current and the last complete rate window
+        self.window_start = 0.0
+        self.hits = 0
+        self.recent_hits = 0
+
+
+class LeasedRateLimiter:
     """
-    current_time = int(time.time())
-    time_window = current_time // 60  # Minute granularity
-    key = f"rate_limit:{client_id}:{time_window}"
+    Per-worker pre-admission tier in front of the shared token bucket.
+
+    A worker reserves a lease of several tokens in one shared-store round
+    trip and admits requests from it locally. Once the shared bucket refuses
+    a lease, the client is rejected locally until a token could have been
+    refilled. Tokens are reserved before they are spent, so the shared limit
+    is never exceeded.
 
-    # Get DB connection
-    db = get_db()
-    cursor = db.cursor()
+    Tokens sitting in one worker's lease are unavailable to the others, so
+    leases are sized from the requests this worker saw for the client in
+    the last ``rate_window`` seconds (at most ``lease_fraction`` of the
+    capacity). A worker that has not been receiving a client's traffic
+    takes one token at a time, so a sudden burst is admitted up to exactly
+    the plan limit. What is left of an expired lease is returned to the
+    shared bucket on the worker's next trip to it.
+    """
 
-    # Check if the client has exceeded the limit in the database
-    cursor.execute("SELECT count FROM rate_limits WHERE client_id = %s AND time_window = %s", (client_id, time_window))
-    row = cursor.fetchone()
+    def __init__(self, lease_fraction=LEASE_FRACTION, lease_ttl=LEASE_TTL_SECONDS,
+                 rate_window=LEASE_RATE_WINDOW_SECONDS, max_clients=100000):
+        self.lease_fraction = lease_fraction
+        self.lease_ttl = lease_ttl
+        self.rate_window = rate_window
+        self.max_clients = max_clients
+        self.shared_calls = 0
+        self._leases = {}
+        self._lock = threading.Lock()
 
-    if row:
-        requests = row[0]
-        if requests >= max_requests_per_minute:
-            return False  # Limit exceeded
+    def _lease(self, key):
+        lease = self._leases.get(key)
+        if lease is None:
+            if len(self._leases) >= self.max_clients:
+                self._leases.pop(next(iter(self._leases)))
+            lease = self._leases[key] = _Lease()
+        return lease
 
-        # Increment request count
-        cursor.execute("UPDATE rate_limits SET count = count + 1 WHERE client_id = %s AND time_window = %s", (client_id, time_window))
-    else:
-        # Insert a new row if client doesn't exist for this time window
-        cursor.execute("INSERT INTO rate_limits (client_id, time_window, count) VALUES (%s, %s, 1)", (client_id, time_window))
+    def check(self, client_id, max_requests_per_minute, store=None):
+        capacity = float(max_requests_per_minute)
+        rate_per_ms = capacity / 60000.0
+        key = f"rate_limit:{client_id}"
+        now = time.monotonic()
 
-    # Commit the transaction
-    db.commit()
+        with self._lock:
+            lease = self._lease(key)
+            if now - lease.window_start >= self.rate_window:
+                # Only a window that just ended says anything about the next one
+                lease.recent_hits = (lease.hits if now - lease.window_start < 2 * self.rate_window
+                                     else 0)
+                lease.window_start, lease.hits = now, 0
+            lease.hits += 1
+            if lease.tokens and now < lease.expires_at:
+                lease.tokens -= 1
+                return _result(True, lease.tokens + lease.shared_tokens, capacity,
+                               rate_per_ms)
+            if now < lease.denied_until:
+                reset_after = math.ceil((capacity - lease.shared_tokens) / rate_per_ms / 1000.0)
+                return RateLimitResult(False, capacity, 0, reset_after,
+                                       math.ceil(lease.denied_until - now))
+            refund, lease.tokens = lease.tokens, 0
+            want = 1 + min(max(0, int(capacity * self.lease_fraction) - 1), lease.recent_hits)
 
-    return True
+        granted, tokens = _take_shared(store, key, capacity, rate_per_ms, want, refund)
+
+        with self._lock:
+            self.shared_calls += 1
+            lease = self._lease(key)
+            lease.shared_tokens = tokens
+            if granted < 1:
+                lease.tokens = 0
+                lease.denied_until = now + _retry_after_ms(tokens, rate_per_ms) / 1000.0
+                return _result(False, tokens, capacity, rate_per_ms)
+            # One granted token admits this request; the rest form the lease
+            lease.tokens = granted - 1
+            lease.expires_at = now + self.lease_ttl
+            lease.denied_until = 0.0
+            return _result(True, lease.tokens + tokens, capacity, rate_per_ms)
+
+
+_leased_limiter = LeasedRateLimiter()
+
+
+def rate_limit(client_id, max_requests_per_minute=None, plan_id=None):
+    """
+    Implements token-bucket rate limiting on the shared Redis connection,
+    falling back to per-worker buckets if Redis is unreachable. Unless
+    RATE_LIMIT_LEASE_FRACTION is 0, checks go through the local lease tier
+    first so most requests never leave the process.
+    Returns True if the request may proceed. The full result is kept on
+    ``g.rate_limit`` so ``add_rate_limit_headers`` can report it.
+    """
+    with stage("rate_limit"):
+        if max_requests_per_minute is None:
+            max_requests_per_minute = plan_limit(plan_id)
+        store = current_app.extensions.get("redis") if has_app_context() else None
+        if LEASE_FRACTION > 0:
+            result = _leased_limiter.check(client_id, max_requests_per_minute, store)
+        else:
+            result = check_rate_limit(client_id, max_requests_per_minute, store)
+    if has_app_context():
+        g.rate_limit = result
+    return result.allowed
+
+
+def add_rate_limit_headers(response):
+    """
+    after_request hook adding X-RateLimit-* (and Retry-After on rejection)
+    for requests that went through ``rate_limit``.
+    """
+    result = g.get("rate_limit")
+    if result is not None:
+        response.headers["X-RateLimit-Limit"] = str(int(result.limit))
+        response.headers["X-RateLimit-Remaining"] = str(result.remaining)
+        response.headers["X-RateLimit-Reset"] = str(result.reset_after)
+        if not result.allowed:
+            response.headers["Retry-After"] = str(max(1, result.retry_after))
+    return response